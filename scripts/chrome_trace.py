@@ -0,0 +1,165 @@
+""" Write chrome://tracing JSON traces one event at a time """
+
+import gzip
+import io
+import json
+import sys
+
+
+class Writer(object):
+    """ a chrome://tracing trace written to a file as events are added
+
+    Use as a context manager. path "-" is stdout. The trace is
+    gzip-compressed if compress is True or path ends in ".gz". Timestamps
+    are in ns and written in us relative to origin, so the trace starts near 0.
+
+    Tracks are named with process() and thread(), which emit the metadata
+    events that label them the first time each one is used.
+    """
+
+    def __init__(self, path, compress=False, origin=0):
+        self.path = path
+        self.compress = compress or path.endswith(".gz")
+        self.origin = origin
+        self.f = None
+        self.first = True
+        self.pids = {}
+        self.tids = set()
+        self.num_events = 0
+
+    def __enter__(self):
+        if self.path == "-":
+            if self.compress:
+                self.f = io.TextIOWrapper(gzip.GzipFile(
+                    fileobj=sys.stdout.buffer, mode="wb"), encoding="utf-8")
+            else:
+                self.f = sys.stdout
+        elif self.compress:
+            self.f = gzip.open(self.path, "wt", encoding="utf-8")
+        else:
+            self.f = open(self.path, "w")
+        self.f.write('{"displayTimeUnit": "ns", "traceEvents": [\n')
+        return self
+
+    def __exit__(self, *exc):
+        self.f.write('\n]}\n')
+        if self.f is sys.stdout:
+            self.f.flush()
+        else:
+            self.f.close()
+        return False
+
+    def event(self, e):
+        """write the dict e as one trace event"""
+        if not self.first:
+            self.f.write(",\n")
+        self.first = False
+        self.f.write(json.dumps(e, separators=(",", ":")))
+        self.num_events += 1
+
+    def us(self, ts):
+        """the trace time of timestamp ts (ns)"""
+        return (ts - self.origin) / 1000
+
+    def process(self, key, name):
+        """return the pid of the track for key, labeled name the first time it is used"""
+        if key not in self.pids:
+            pid = len(self.pids)
+            self.pids[key] = pid
+            self.event({"name": "process_name", "ph": "M",
+                        "pid": pid, "args": {"name": name}})
+            self.event({"name": "process_sort_index", "ph": "M",
+                        "pid": pid, "args": {"sort_index": pid}})
+        return self.pids[key]
+
+    def thread(self, pid, tid, name):
+        """return tid, labeling thread tid of pid with name the first time it is used"""
+        if (pid, tid) not in self.tids:
+            self.tids.add((pid, tid))
+            self.event({"name": "thread_name", "ph": "M",
+                        "pid": pid, "tid": tid, "args": {"name": name}})
+        return tid
+
+    def complete(self, name, cat, pid, tid, start, end, args=None):
+        """write a complete ("X") event from timestamp start to end (ns)"""
+        e = {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "pid": pid,
+            "tid": tid,
+            "ts": self.us(start),
+            "dur": (end - start) / 1000,
+        }
+        if args:
+            e["args"] = args
+        self.event(e)
+
+    def counter(self, name, pid, ts, values):
+        """write the values (a dict of series name to value) of counter name at timestamp ts (ns)"""
+        self.event({"name": name, "ph": "C", "pid": pid,
+                    "ts": self.us(ts), "args": values})
+
+
+class Aggregator(object):
+    """ write events to a Writer, merging events shorter than resolution (ns) into aggregate slices per track
+
+    Pass the rising and falling edge of each event in (timestamp, edge)
+    order (see nvprof.sweep.edges). Short events on a track are merged while
+    the gap between them is less than resolution. Longer events are written
+    as they are, and end the aggregate on their track at both of their
+    edges, so aggregates nest inside them like the events they replace.
+    An aggregate has the name of its events if they all have the same name,
+    and args with the number of events and their total duration (us).
+    """
+
+    def __init__(self, writer, resolution):
+        self.writer = writer
+        self.resolution = resolution
+        # (pid, tid) -> [first event, start, end, count, total duration, names, cats]
+        self.pending = {}
+
+    def rising(self, name, cat, pid, tid, start, end, args=None):
+        """the rising edge of an event from start to end, which is written like Writer.complete"""
+        track = (pid, tid)
+        if end - start >= self.resolution:
+            self._flush(track)
+            self.writer.complete(name, cat, pid, tid, start, end, args=args)
+            return
+
+        agg = self.pending.get(track)
+        if agg is not None and start - agg[2] >= self.resolution:
+            self._flush(track)
+            agg = None
+        if agg is None:
+            self.pending[track] = [(name, cat, pid, tid, start, end, args),
+                                   start, end, 1, end - start, {name}, {cat}]
+            return
+        agg[2] = max(agg[2], end)
+        agg[3] += 1
+        agg[4] += end - start
+        agg[5].add(name)
+        agg[6].add(cat)
+
+    def falling(self, pid, tid, start, end):
+        """the falling edge of an event from start to end"""
+        if end - start >= self.resolution:
+            self._flush((pid, tid))
+
+    def _flush(self, track):
+        agg = self.pending.pop(track, None)
+        if agg is None:
+            return
+        first, start, end, count, total, names, cats = agg
+        if count == 1:
+            name, cat, pid, tid, start, end, args = first
+            self.writer.complete(name, cat, pid, tid, start, end, args=args)
+            return
+        name = names.pop() if len(names) == 1 else "{} events".format(count)
+        self.writer.complete(name, ",".join(sorted(cats)), *track, start, end,
+                             args={"count": count, "total_dur": total / 1000})
+
+    def close(self):
+        """write the remaining aggregates"""
+        for track in list(self.pending):
+            self._flush(track)
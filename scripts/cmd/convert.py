@@ -0,0 +1,23 @@
+import click
+import logging
+
+import nvprof.merge
+from nvprof import columnstore
+from nvprof.db import Db
+
+logger = logging.getLogger(__name__)
+
+
+@click.command()
+@click.argument('filename', type=click.Path(exists=True))
+@click.argument('output')
+@click.option('--batch-size', help='Rows read and written at a time', type=int, default=nvprof.merge.DEFAULT_BATCH_SIZE, show_default=True)
+@click.pass_context
+def convert(ctx, filename, output, batch_size):
+    """convert FILENAME to a memory-mapped column store in directory OUTPUT
+
+    summary, list-ranges, and kernel-time accept OUTPUT in place of an nvprof file.
+    """
+    db = Db(filename, sidecar=ctx.obj["SIDECAR"], batch_size=batch_size)
+    logger.debug("converting {} to {}".format(filename, output))
+    columnstore.convert(db, output, batch_size=batch_size)
@@ -1,7 +1,8 @@
-from shutil import copyfile
 import logging
 import click
 from nvprof.db import Db
+from nvprof import extract
+from cmd.summary import to_timestamp
 import os
 
 logger = logging.getLogger(__name__)
@@ -10,37 +11,48 @@ logger = logging.getLogger(__name__)
 @click.command()
 @click.argument('input')
 @click.argument('output')
-@click.argument('start')
-@click.argument('end')
+@click.argument('start', required=False)
+@click.argument('end', required=False)
+@click.option('-r', '--range', multiple=True, help='Only keep records that occur during marker ranges with this in the name')
+@click.option('-n', '--first-ranges', help='Only consider the first n ranges, ordered by start time', type=int)
+@click.option('-d', '--device', multiple=True, type=int, help='Only keep GPU activities on this device id')
+@click.option('-p', '--pid', multiple=True, type=int, help='Only keep API calls and markers from this process id')
+@click.option('-t', '--tid', multiple=True, type=int, help='Only keep API calls and markers from this thread id')
+@click.option('-k', '--kernel', multiple=True, help='Only keep kernels with this in the name')
 @click.pass_context
-def filter(ctx, input, output, start, end):
-    """filter file INPUT to contain only records between START and END"""
-
-    copyfile(input, output)
+def filter(ctx, input, output, start, end, range, first_ranges, device, pid, tid, kernel):
+    """filter file INPUT to contain only records between START and END
+
+    Only the selected records are read from INPUT and written to a new file
+    OUTPUT, in one pass. START and END are timestamps, or seconds from the
+    first record like "1.5s". NVTX ranges are kept whole.
+    """
+
+    db = Db(input, sidecar=ctx.obj["SIDECAR"])
+
+    first, _ = db.get_extent()
+    selection = extract.Selection(
+        begin=to_timestamp(start, first) if start else None,
+        end=to_timestamp(end, first) if end else None,
+        devices=device,
+        pids=pid,
+        tids=tid,
+    )
+    if range:
+        selection.intervals = db.range_intervals(range, first_n=first_ranges)
+        logger.debug("ranges matching the names {} cover {} disjoint intervals".format(
+            range, len(selection.intervals)))
+        if not selection.intervals:
+            logger.warning("no ranges match {}".format(" ".join(range)))
+    if kernel:
+        selection.kernel_ids = db.strings().ids_like(kernel)
+        logger.debug("{} kernel names match {}".format(
+            len(selection.kernel_ids), " ".join(kernel)))
 
     input_size = os.path.getsize(input)
-    logger.debug(
-        "copied {}MB {} -> {}".format(int(input_size/1e6), input, output))
-
-    db = Db(output, read_only=False)
-
-    tables = [
-        'CUPTI_ACTIVITY_KIND_CONCURRENT_KERNEL',
-        'CUPTI_ACTIVITY_KIND_MEMCPY',
-        'CUPTI_ACTIVITY_KIND_KERNEL',
-        'CUPTI_ACTIVITY_KIND_RUNTIME',
-    ]
-
-    for table in tables:
-        sql_cmd = "DELETE FROM {} WHERE (end <= {}) or (start >= {})".format(
-            table, start, end)
-        logger.debug(sql_cmd)
-        db.execute(sql_cmd)
-
-    db.commit()
-    logger.debug("vacuuming...")
-    db.vacuum()
+    logger.debug("extracting {} -> {}".format(input, output))
+    extract.extract(db, output, selection)
 
     output_size = os.path.getsize(output)
-    logger.debug("reduced output size to {}MB".format(
-        int(output_size/1e6)))
+    logger.debug("extracted {}MB of {}MB".format(
+        int(output_size/1e6), int(input_size/1e6)))
@@ -0,0 +1,67 @@
+import click
+import logging
+import numpy as np
+
+import nvprof.merge
+from nvprof import stats
+from nvprof.db import open_db
+
+logger = logging.getLogger(__name__)
+
+KERNEL_TABLE = "CUPTI_ACTIVITY_KIND_CONCURRENT_KERNEL"
+
+
+def kernel_batches(db):
+    """yield (name id, device id, duration) int64 arrays of the kernels in db, a batch at a time"""
+    if not db.num_rows(KERNEL_TABLE):
+        return
+    if db.columnar:
+        arr = db.load_columns(KERNEL_TABLE)
+        for i in range(0, len(arr), db.batch_size):
+            chunk = arr[i:i+db.batch_size]
+            yield (chunk['name_id'].astype(np.int64), chunk['device_id'].astype(np.int64),
+                   chunk['end'] - chunk['start'])
+        return
+    cursor = db.execute(
+        "SELECT name, deviceId, end - start FROM {}".format(KERNEL_TABLE))
+    for batch in nvprof.merge.batches(cursor, db.batch_size):
+        arr = np.array(batch, dtype=np.int64)
+        yield arr[:, 0], arr[:, 1], arr[:, 2]
+
+
+def kernel_stats_of(db):
+    """return {(kernel name, device id): nvprof.stats.Stats} of the kernels in db, in one pass"""
+    groups = {}
+    for name_ids, devices, durations in kernel_batches(db):
+        stats.add_grouped(groups, np.stack([name_ids, devices], axis=1), durations)
+    strings = db.strings()
+    return {(strings[name_id], device): s for (name_id, device), s in groups.items()}
+
+
+@click.command()
+@click.argument('filenames', nargs=-1, required=True)
+@click.option('--sort', type=click.Choice(list(stats.COLUMNS)), default="tot", show_default=True)
+@click.option('-k', '--top', type=int, default=20, show_default=True, help='Only print this many kernels, 0 for all')
+@click.option('--batch-size', help='Rows read at a time', type=int, default=nvprof.merge.DEFAULT_BATCH_SIZE, show_default=True)
+@click.pass_context
+def kernel_stats(ctx, filenames, sort, top, batch_size):
+    """print duration statistics of kernels per name and device
+
+    Kernels are read in one pass, and the statistics of each name and device
+    are kept in online accumulators, so memory use does not grow with the
+    number of kernels. Percentiles are within 3%. With several FILENAMES,
+    like the shards written by split, kernels with the same name are merged.
+    """
+
+    groups = {}
+    for filename in filenames:
+        db = open_db(filename, sidecar=ctx.obj["SIDECAR"], batch_size=batch_size)
+        for key, s in kernel_stats_of(db).items():
+            if key not in groups:
+                groups[key] = stats.Stats()
+            groups[key].merge(s)
+    logger.debug("{} kernels".format(len(groups)))
+
+    print(stats.header(["device", "name"]))
+    for (name, device), s in stats.top(groups, sort, k=top):
+        print(*stats.row(s), device, name, sep="\t")
@@ -1,74 +1,74 @@
 import click
 import logging
-from nvprof.db import Db
-from datetime import datetime
-import math
+import numpy as np
+
+import nvprof.merge
+from nvprof import stats
+from nvprof.db import open_db
 
 logger = logging.getLogger(__name__)
 
+RANGE_TABLE = "CUPTI_ACTIVITY_KIND_RANGE"
+
+
+def range_batches(db):
+    """yield (name id, pid, tid, duration) int64 arrays of the ranges in db, a batch at a time
+
+    tids are unsigned, like nvprof.record.Range.tid. pid and tid are -1 for
+    ranges that are not on a thread.
+    """
+    if db.columnar:
+        if not db.num_rows(RANGE_TABLE):
+            return
+        arr = db.load_columns(RANGE_TABLE)
+        for i in range(0, len(arr), db.batch_size):
+            chunk = arr[i:i+db.batch_size]
+            tid = chunk['tid'].astype(np.int64)
+            pid = np.where(tid == -1, -1, chunk['pid'])
+            yield chunk['name_id'].astype(np.int64), pid, tid, chunk['end'] - chunk['start']
+        return
+    cursor = db.execute("SELECT name, IFNULL(processId, -1), IFNULL(threadId & 0xffffffff, -1), end - start FROM {}".format(
+        db.range_table()))
+    for batch in nvprof.merge.batches(cursor, db.batch_size):
+        arr = np.array(batch, dtype=np.int64)
+        yield arr[:, 0], arr[:, 1], arr[:, 2], arr[:, 3]
+
 
 @click.command()
 @click.argument('filename')
 @click.option('--group/--no-group', default=True, help="group ranges by name")
-@click.option('--sort', type=click.Choice(['count', 'min', 'max', 'avg', 'tot']), default="tot")
+@click.option('--threads', is_flag=True, help="group ranges by name, process, and thread")
+@click.option('--sort', type=click.Choice(list(stats.COLUMNS)), default="tot", show_default=True)
+@click.option('-k', '--top', type=int, default=0, show_default=True, help='Only print this many groups, 0 for all')
 @click.pass_context
-def list_ranges(ctx, filename, group, sort):
-    """print summary statistics of ranges"""
+def list_ranges(ctx, filename, group, threads, sort, top):
+    """print summary statistics of ranges
 
-    db = Db(filename)
+    Ranges are read in one pass into an online accumulator per name (and
+    thread), so memory use does not grow with the number of ranges.
+    Percentiles are within 3%.
+    """
 
-    logger.debug("Loading strings")
-    strings, _ = db.get_strings()
+    db = open_db(filename, sidecar=ctx.obj["SIDECAR"])
 
-    logger.debug("Loading ranges")
-    groups = {}
-    for record in db.records(['CUPTI_ACTIVITY_KIND_RANGE']):
-
-        name = record.name
-        start = record.start
-        end = record.end
-        if group:
-            if name not in groups:
-                groups[name] = []
-            groups[name] += [(start, end)]
-        else:
-            print(name, start, end)
-
-    ordered_output = []
-    if group:
-        print("count\ttot(s)\tmin(s)\tmax(s)\tavg(s)\tstddev(s)\tname")
-        for key in groups:
-            g = groups[key]
-            mi = g[0][1] - g[0][0]
-            ma = g[0][1] - g[0][0]
-            tot = g[0][1] - g[0][0]
-            for e in g[1:]:
-                mi = min(e[1] - e[0], mi)
-                ma = max(e[1] - e[0], ma)
-                tot += e[1] - e[0]
-            avg = tot / len(g)
-            va = (g[0][1] - g[0][0] - avg) ** 2
-            for e in g[1:]:
-                va += (e[1] - e[0] - avg) ** 2
-            if len(g) == 1:
-                va = 0
-            else:
-                va /= (len(g) - 1)
-            stddev = math.sqrt(va)
-            ordered_output += [(len(g), tot/1e9, mi/1e9,
-                                ma/1e9, avg/1e9, stddev/1e9, key)]
+    strings = db.strings()
 
-        sort_by = {
-            'count': 0,
-            'tot': 1,
-            'min': 2,
-            'max': 3,
-            'avg': 4,
-            'stddev': 5,
-        }
+    if not group:
+        for record in db.records(['CUPTI_ACTIVITY_KIND_RANGE']):
+            print(strings[record.name_id], record.start, record.end)
+        return
 
-        ordered_output = sorted(
-            ordered_output, reverse=True, key=lambda t: t[sort_by[sort]])
+    logger.debug("Loading ranges")
+    groups = {}
+    for name_ids, pids, tids, durations in range_batches(db):
+        keys = [name_ids, pids, tids] if threads else [name_ids]
+        stats.add_grouped(groups, np.stack(keys, axis=1), durations)
 
-        for t in ordered_output:
-            print(*t)
+    if threads:
+        print(stats.header(["pid", "tid", "name"]))
+        for (name_id, pid, tid), s in stats.top(groups, sort, k=top):
+            print(*stats.row(s), "-" if pid == -1 else pid, "-" if tid == -1 else tid, strings[name_id])
+    else:
+        print(stats.header(["name"]))
+        for (name_id,), s in stats.top(groups, sort, k=top):
+            print(*stats.row(s), strings[name_id])
@@ -19,6 +19,8 @@ def list_records(ctx, filename, relative):
         'CUPTI_ACTIVITY_KIND_CONCURRENT_KERNEL',
     ]
 
+    strings = db.strings()
+
     if relative:
         timestamp_offset, _ = db.get_extent()
     else:
@@ -32,4 +34,4 @@ def list_records(ctx, filename, relative):
             print("R {} {} {} {} {}".format(
                 norm(r.start), norm(r.end), r.pid, r.tid, r.name()))
         elif isinstance(r, ConcurrentKernel):
-            print("C {} {} {}".format(norm(r.start), norm(r.end), r.name))
+            print("C {} {} {}".format(norm(r.start), norm(r.end), strings[r.name_id]))
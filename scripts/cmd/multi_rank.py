@@ -0,0 +1,150 @@
+import click
+import glob
+import logging
+import multiprocessing
+import os
+import statistics
+
+import exposure
+import nvprof.merge
+from nvprof import align, sweep
+from nvprof.db import Db
+from cmd.summary import summarize, to_timestamp
+
+logger = logging.getLogger(__name__)
+
+# (column name, exposure.Report attribute) of each category that is compared across ranks
+CATEGORIES = [
+    ("kernel", "any_kernel"),
+    ("exposed_kernel", "exposed_kernel"),
+    ("comm", "any_comm"),
+    ("exposed_comm", "exposed_comm"),
+    ("runtime", "any_runtime"),
+    ("exposed_runtime", "exposed_runtime"),
+]
+
+# (category, table) of records compared on the aligned clock
+ALIGNED_TABLES = [
+    ("kernel", "CUPTI_ACTIVITY_KIND_CONCURRENT_KERNEL"),
+    ("comm", "CUPTI_ACTIVITY_KIND_MEMCPY"),
+    ("runtime", "CUPTI_ACTIVITY_KIND_RUNTIME"),
+]
+
+
+def rank_report(job):
+    """ summarize one rank's file in a worker process"""
+    filename, options = job
+    logger.debug("summarizing {}".format(filename))
+    report, _ = summarize(filename, **options)
+    return report
+
+
+@click.command()
+@click.argument('patterns', nargs=-1, required=True)
+@click.option('-b', '--begin', help='Only consider events that begin after this time')
+@click.option('-e', '--end', help='Only consider records that end before this time')
+@click.option('-r', '--range', multiple=True, help='Only consider records that occur during marker ranges with this in the name')
+@click.option('-n', '--first-ranges', help='Only consider the first n ranges, ordered by start time', type=int)
+@click.option('--batch-size', help='Rows fetched at a time from each table while merging edges', type=int, default=nvprof.merge.DEFAULT_BATCH_SIZE, show_default=True)
+@click.option('--engine', type=click.Choice(['timeline', 'vectorized']), default='timeline', show_default=True, help='how each rank is summarized, see summary --engine')
+@click.option('--clip', is_flag=True, help='Only count the part of each record inside the selected ranges and --begin/--end')
+@click.option('-j', '--jobs', type=int, default=os.cpu_count(), show_default=True, help='Summarize this many files at a time')
+@click.option('--align', 'anchors', multiple=True, help='Align the clocks of the files on ranges with this in the name')
+@click.option('--align-edge', type=click.Choice(['start', 'end']), default='end', show_default=True, help='The edge of the anchor ranges that happens at the same time on every rank')
+@click.pass_context
+def multi_rank(ctx, patterns, begin, end, range, first_ranges, batch_size, engine, clip, jobs, anchors, align_edge):
+    """summarize one nvprof file per rank and compare the ranks
+
+    PATTERNS are files or globs. Ranks are numbered in sorted filename order.
+    -b and -e are relative to the start of each file, or to the first record
+    of any rank if --align is given.
+    """
+
+    filenames = sorted({f for pattern in patterns for f in glob.glob(pattern)})
+    if not filenames:
+        logger.error("no files match {}".format(" ".join(patterns)))
+        raise SystemExit(-1)
+    logger.debug("{} ranks".format(len(filenames)))
+
+    options = {
+        "sidecar": ctx.obj["SIDECAR"],
+        "batch_size": batch_size,
+        "begin": begin,
+        "end": end,
+        "range": range,
+        "first_ranges": first_ranges,
+        "engine": engine,
+        "clip": clip,
+    }
+    work = [(filename, options) for filename in filenames]
+
+    if anchors:
+        dbs = [Db(filename, sidecar=ctx.obj["SIDECAR"], batch_size=batch_size)
+               for filename in filenames]
+        offsets = align.estimate_offsets(
+            [align.anchor_times(db, anchors, edge=align_edge) for db in dbs])
+
+        # -b and -e are on the aligned clock, which starts at the first record of any rank
+        aligned_start = min(db.get_extent()[0] + offset for db,
+                            offset in zip(dbs, offsets))
+        rank_spans = []
+        work = []
+        for filename, offset in zip(filenames, offsets):
+            rank_begin = to_timestamp(begin, aligned_start) - offset if begin else None
+            rank_end = to_timestamp(end, aligned_start) - offset if end else None
+            rank_spans += [(rank_begin, rank_end)]
+            # summarize takes absolute timestamps on the clock of the file
+            work += [(filename, dict(options,
+                                     begin=str(rank_begin) if begin else None,
+                                     end=str(rank_end) if end else None))]
+
+    with multiprocessing.Pool(min(jobs, len(filenames))) as pool:
+        reports = pool.map(rank_report, work)
+
+    print("Rank Report")
+    print("===========")
+    print("rank\t" + "\t".join(c + "(s)" for c, _ in CATEGORIES) + "\tfile")
+    for rank, (filename, report) in enumerate(zip(filenames, reports)):
+        times = [getattr(report, attr) / 1e9 for _, attr in CATEGORIES]
+        print(rank, *times, filename, sep="\t")
+    print()
+
+    print("Across Ranks")
+    print("============")
+    print("category\tmin(s)\tmedian(s)\tmax(s)\tslowest rank\tslowest file")
+    for name, attr in CATEGORIES:
+        times = [getattr(report, attr) for report in reports]
+        slowest = max(enumerate(times), key=lambda rt: rt[1])[0]
+        print(name, min(times) / 1e9, statistics.median(times) / 1e9, max(times) / 1e9,
+              slowest, filenames[slowest], sep="\t")
+
+    if not anchors:
+        return
+
+    print()
+    print("Clock Offsets")
+    print("=============")
+    print("rank\toffset(s)\tfile")
+    for rank, (filename, offset) in enumerate(zip(filenames, offsets)):
+        print(rank, offset / 1e9, filename, sep="\t")
+    print()
+
+    # merge the records of every rank into one stream on the aligned clock
+    sources = []
+    for rank, (db, offset, span) in enumerate(zip(dbs, offsets, rank_spans)):
+        intervals = None
+        if range:
+            intervals = db.range_intervals(range, first_n=first_ranges)
+        spans = [span] if span != (None, None) else []
+        for category, table in ALIGNED_TABLES:
+            sources += [((rank, category), align.aligned_rows(db, table, offset,
+                                                              intervals=intervals, spans=spans, clip=clip))]
+    edges = sweep.edges(align.merged_rows(sources, batch_size=batch_size), 0, 1)
+    overlap = exposure.rank_overlap(edges, len(dbs))
+
+    print("Aligned Across Ranks")
+    print("====================")
+    print("category\tany rank(s)\tall ranks(s)")
+    for category, _ in ALIGNED_TABLES:
+        any_time, all_time = overlap.get(category, (0, 0))
+        print(category, any_time / 1e9, all_time / 1e9, sep="\t")
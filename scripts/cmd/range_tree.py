@@ -0,0 +1,118 @@
+import click
+import logging
+import numpy as np
+
+from nvprof import merge
+from nvprof.range_tree import Builder
+from nvprof.db import Db
+
+logger = logging.getLogger(__name__)
+
+# tables of GPU activities attributed to the ranges of the runtime calls that launched them
+ACTIVITY_TABLES = [
+    ("CUPTI_ACTIVITY_KIND_CONCURRENT_KERNEL", "kernel"),
+    ("CUPTI_ACTIVITY_KIND_MEMCPY", "memcpy"),
+]
+
+# the frame of GPU time launched outside of any range
+OUTSIDE = "(outside ranges)"
+
+
+def unsigned(tid):
+    """tid as an unsigned thread id, like nvprof.record.Runtime.tid"""
+    return tid + 2**32 if tid is not None and tid < 0 else tid
+
+
+def build(db, by_thread=False):
+    """return the root nvprof.range_tree.Node of the ranges of db, in a single pass over ranges and launches ordered by start"""
+    # ranges that start together come longest first, so the enclosing one is the parent
+    sources = [("range", db.execute("SELECT start, end, name, processId, threadId FROM {} ORDER BY start, end DESC".format(
+        db.range_table())))]
+    for table, field in ACTIVITY_TABLES:
+        if db.metadata().num_rows(table) and db.metadata().num_rows("CUPTI_ACTIVITY_KIND_RUNTIME"):
+            sources += [(field, db.correlated_activities("CUPTI_ACTIVITY_KIND_RUNTIME", table, ["start", "end"]))]
+
+    builder = Builder(by_thread=by_thread)
+    for tag, row in merge.merge(sources, batch_size=db.batch_size):
+        if tag == "range":
+            start, end, name_id, pid, tid = row
+            builder.range(start, end, name_id, (pid, unsigned(tid)))
+        else:
+            call_start, _, pid, tid, start, end = row
+            builder.launch(call_start, (pid, unsigned(tid)), tag, end - start)
+    return builder.close()
+
+
+def build_selected(db, intervals=None, spans=None):
+    """return the root nvprof.range_tree.Node of the ranges of db, a Db or column store, that overlap the selection
+
+    intervals and spans select time like in Db.filtered_rows. Ranges are not
+    clipped, and no GPU time is attributed.
+    """
+    builder = Builder()
+    if not db.metadata().num_rows("CUPTI_ACTIVITY_KIND_MARKER"):
+        return builder.close()
+    cols = db.filtered_columns("CUPTI_ACTIVITY_KIND_RANGE", intervals=intervals, spans=spans)
+    # ranges that start together come longest first, so the enclosing one is the parent
+    order = np.lexsort((-cols['end'], cols['start']))
+    for start, end, name_id, pid, tid in zip(*(cols[f][order].tolist() for f in ['start', 'end', 'name_id', 'pid', 'tid'])):
+        # -1 is a range not on a thread
+        builder.range(start, end, name_id, (None, None) if tid == -1 else (pid, unsigned(tid)))
+    return builder.close()
+
+
+def label(key, strings):
+    """the name of the frame of a Node key"""
+    if isinstance(key, tuple):
+        pid, tid = key
+        return "(no thread)" if pid is None else "process {} thread {}".format(pid, tid)
+    return strings[key]
+
+
+def print_tree(root, strings):
+    print("count\tincl(s)\texcl(s)\tkernel(s)\tmemcpy(s)\tname")
+    if root.kernel or root.memcpy:
+        print("-", "-", "-", root.kernel/1e9, root.memcpy/1e9, OUTSIDE, sep="\t")
+    for path, node in root.walk():
+        name = "  " * (len(path) - 1) + label(node.key, strings)
+        if isinstance(node.key, tuple):
+            print("-", "-", "-", node.total("kernel")/1e9, node.total("memcpy")/1e9, name, sep="\t")
+        else:
+            print(node.count, node.inclusive/1e9, node.exclusive/1e9,
+                  node.total("kernel")/1e9, node.total("memcpy")/1e9, name, sep="\t")
+
+
+def print_folded(root, strings, metric):
+    """print a line "frame;frame;... value" per path with its own metric (ns), for flamegraph.pl"""
+    if getattr(root, metric):
+        print(OUTSIDE, getattr(root, metric))
+    for path, node in root.walk():
+        value = getattr(node, metric)
+        if value:
+            # ; separates frames
+            print(";".join(label(key, strings).replace(";", ":") for key in path), value)
+
+
+@click.command()
+@click.argument('filename')
+@click.option('--threads', is_flag=True, help="Keep the ranges of each thread in their own tree")
+@click.option('--folded', is_flag=True, help="Print folded stacks for flame graphs instead of a tree")
+@click.option('--metric', type=click.Choice(['exclusive', 'kernel', 'memcpy']), default='exclusive', show_default=True,
+              help="The time (ns) of each folded stack")
+@click.pass_context
+def range_tree(ctx, filename, threads, folded, metric):
+    """print the tree of nested ranges, with their time and the GPU time they launched
+
+    Ranges are nested per thread, and every path of range names is a node
+    with the count, inclusive and exclusive time of its ranges. Kernels and
+    memcpys are attributed by correlationId to the innermost range around the
+    runtime call that launched them, and their time is included in every
+    enclosing path. Ranges and launches are read in one pass ordered by start.
+    """
+
+    db = Db(filename, sidecar=ctx.obj["SIDECAR"])
+    root = build(db, by_thread=threads)
+    if folded:
+        print_folded(root, db.strings(), metric)
+    else:
+        print_tree(root, db.strings())
@@ -0,0 +1,81 @@
+import click
+import logging
+import multiprocessing
+import os
+
+from nvprof import extract
+from nvprof.db import Db
+
+logger = logging.getLogger(__name__)
+
+
+def shard_path(output, i, num_shards):
+    """the file of shard i of num_shards, OUTPUT.i.nvprof with i zero-padded"""
+    return "{}.{:0{}d}.nvprof".format(output, i, len(str(num_shards - 1)))
+
+
+def time_windows(first, last, num_shards):
+    """return num_shards (begin, end) windows of equal length that cover first to last
+
+    The first window has no begin and the last no end, so records at the
+    very start and end of the trace are not lost.
+    """
+    bounds = [first + (last - first) * i // num_shards for i in range(num_shards + 1)]
+    windows = list(zip(bounds[:-1], bounds[1:]))
+    windows[0] = (None, windows[0][1])
+    windows[-1] = (windows[-1][0], None)
+    return windows
+
+
+def write_shard(job):
+    """extract one shard in a worker process"""
+    input, sidecar, path, begin, end = job
+    db = Db(input, sidecar=sidecar)
+    extract.extract(db, path, extract.Selection(begin=begin, end=end, clip=True))
+    logger.debug("wrote {}".format(path))
+    return path
+
+
+@click.command()
+@click.argument('input')
+@click.argument('output')
+@click.option('-N', '--shards', type=int, help='Split into this many windows of equal time')
+@click.option('-r', '--range', multiple=True, help='Write one shard per marker range with this in the name')
+@click.option('-n', '--first-ranges', help='Only split the first n ranges, ordered by start time', type=int)
+@click.option('-j', '--jobs', type=int, default=os.cpu_count(), show_default=True, help='Write this many shards at a time')
+@click.pass_context
+def split(ctx, input, output, shards, range, first_ranges, jobs):
+    """split file INPUT into nvprof files OUTPUT.0.nvprof, OUTPUT.1.nvprof, ...
+
+    Each shard holds the records of a time window (--shards) or of a range
+    instance (--range), and the strings, devices, and other tables without
+    timestamps. Records that cross the edge of a shard are clipped to it,
+    are written to every shard they overlap, and are listed by table and
+    rowid in its openvprof_clipped table.
+    """
+
+    if bool(shards) == bool(range):
+        logger.error("pass one of --shards or --range")
+        raise SystemExit(-1)
+
+    db = Db(input, sidecar=ctx.obj["SIDECAR"])
+    if range:
+        ranges_view = db.ranges_with_name(range, first_n=first_ranges)
+        windows = db.execute(
+            "SELECT start, end FROM {} ORDER BY start".format(ranges_view)).fetchall()
+        if not windows:
+            logger.error("no ranges match {}".format(" ".join(range)))
+            raise SystemExit(-1)
+    else:
+        first, last = db.get_extent()
+        windows = time_windows(first, last, shards)
+    logger.debug("{} shards".format(len(windows)))
+
+    # build the sidecar tables before the workers read them
+    extract.prepare(db)
+
+    work = [(input, ctx.obj["SIDECAR"], shard_path(output, i, len(windows)), begin, end)
+            for i, (begin, end) in enumerate(windows)]
+    with multiprocessing.Pool(min(jobs, len(work))) as pool:
+        for path in pool.imap(write_shard, work):
+            print(path)
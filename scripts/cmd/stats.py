@@ -18,7 +18,7 @@ def stats(ctx, filename):
     sz = os.path.getsize(filename)
     print('size {}MB'.format(sz/1024/1024))
 
-    db = Db(filename)
+    db = Db(filename, sidecar=ctx.obj["SIDECAR"])
 
     first_timestamp, last_timestamp = db.get_extent()
 
@@ -40,3 +40,4 @@ def stats(ctx, filename):
     for table, name in tables.items():
         num_rows = db.num_rows(table)
         print("stats\t{}\t{}".format(name, num_rows))
+    print("stats\tstrings\t{}".format(db.metadata().num_strings))
@@ -8,13 +8,17 @@ from math import ceil
 from collections import defaultdict
 from enum import Enum
 import heapq
+import multiprocessing
 import timeline
+import exposure
 import operator
 from functools import reduce
 
 import cupti.activity_memory_kind
 import nvprof.record
-from nvprof.db import Db
+import nvprof.merge
+from nvprof.db import open_db
+from cmd.range_tree import build_selected
 
 logger = logging.getLogger(__name__)
 
@@ -25,25 +29,51 @@ logger = logging.getLogger(__name__)
 @click.option('-e', '--end', help='Only consider records that end before this time')
 @click.option('-r', '--range', multiple=True, help='Only consider records that occur during marker ranges with this in the name')
 @click.option('-n', '--first-ranges', help='Only consider the first n ranges, ordered by start time', type=int)
+@click.option('--batch-size', help='Rows fetched at a time from each table while merging edges', type=int, default=nvprof.merge.DEFAULT_BATCH_SIZE, show_default=True)
+@click.option('--engine', type=click.Choice(['timeline', 'vectorized']), default='timeline', show_default=True, help='timeline walks every edge through timeline.Expr, vectorized computes the same times with NumPy')
+@click.option('--clip', is_flag=True, help='Only count the part of each record inside the selected ranges and --begin/--end')
+@click.option('-j', '--jobs', type=int, default=1, show_default=True, help='Split the trace into time shards and summarize them in this many processes')
 @click.pass_context
-def summary(ctx, filename, begin, end, range, first_ranges):
+def summary(ctx, filename, begin, end, range, first_ranges, batch_size, engine, clip, jobs):
 
-    db = Db(filename)
+    report, selected_timeslices = summarize(filename, sidecar=ctx.obj["SIDECAR"], batch_size=batch_size,
+                                            begin=begin, end=end, range=range, first_ranges=first_ranges,
+                                            engine=engine, clip=clip, jobs=jobs)
+    print_report(report, selected_timeslices)
+
+
+def to_timestamp(value, first):
+    """ convert a --begin or --end value to a timestamp
+
+    "1.5s" is seconds after first, anything else is a timestamp in ns
+    """
+    if value[-1] == "s":
+        value = first + float(value[:-1]) * 1_000_000_000
+    return int(value)
+
+
+def summarize(filename, sidecar=False, batch_size=nvprof.merge.DEFAULT_BATCH_SIZE, begin=None, end=None,
+              range=(), first_ranges=None, engine="timeline", clip=False, jobs=1):
+    """ return (exposure.Report, selected timeslices) for filename
+
+    The arguments are the options of the summary command.
+    """
+
+    db = open_db(filename, sidecar=sidecar, batch_size=batch_size)
+    if db.columnar and engine == "timeline":
+        logger.info("using the vectorized engine for column store {}".format(filename))
+        engine = "vectorized"
 
     nvprof_start_timestamp, _ = db.get_extent()
     logger.debug("First timestamp: {}".format(nvprof_start_timestamp))
 
     if end:
         logger.debug("got --end = {}".format(end))
-        if end[-1] == "s":
-            end = nvprof_start_timestamp + float(end[:-1]) * 1_000_000_000
-        end = int(end)
+        end = to_timestamp(end, nvprof_start_timestamp)
         logger.debug("converted --end to ts {}".format(end))
     if begin:
         logger.debug("got --begin = {}".format(begin))
-        if begin[-1] == "s":
-            begin = nvprof_start_timestamp + float(begin[:-1]) * 1_000_000_000
-        begin = int(begin)
+        begin = to_timestamp(begin, nvprof_start_timestamp)
         logger.debug("converted --begin to ts {}".format(begin))
 
     if begin or end:
@@ -65,97 +95,136 @@ def summary(ctx, filename, begin, end, range, first_ranges):
     devices = db.get_devices()
     logger.debug("{} devices".format(len(devices)))
 
-    logger.debug("Loading strings")
-    nvprof_id_to_string, nvprof_string_to_id = db.get_strings()
-    logger.debug("{} strings".format(len(nvprof_id_to_string)))
+    # names are resolved lazily, only for the records that are reported
+    strings = db.strings()
 
     logger.debug("Loading thread ids")
-    tids = set()
-    for row in db.execute("SELECT distinct threadId from CUPTI_ACTIVITY_KIND_RUNTIME"):
-        tid = row[0]
-        if tid < 0:
-            tid += 2**32
-            assert tid >= 0
-        tids.add(tid)
+    tids = db.metadata().tids
     logger.debug("{} distinct thread IDs".format(len(tids)))
-    pids = set()
-    for row in db.execute("SELECT distinct processId from CUPTI_ACTIVITY_KIND_RUNTIME"):
-        pids.add(row[0])
+    pids = db.metadata().pids
     logger.debug("{} distinct process IDs".format(len(pids)))
 
     selected_timeslices = 0.0
+    intervals = None
     if range:
-        ranges_view = db.ranges_with_name(range, first_n=first_ranges)
-        num_ranges = db.execute(
-            'SELECT Count(*) from {}'.format(ranges_view)).fetchone()[0]
-        logger.debug("{} ranges match the names {}".format(num_ranges, range))
-
+        intervals = db.range_intervals(range, first_n=first_ranges)
+        logger.debug("ranges matching the names {} cover {} disjoint intervals".format(
+            range, len(intervals)))
         # figure out how much of the time is spent during the selected ranges
-        range_edges = db.edges_from_rows(ranges_view)
-        num_overlapped = 0
-        in_range = None
-        for row in db.ordered_edges(range_edges):
-            ts = row[0]
-            is_posedge = row[1]
-            row = row[2:]
-            if is_posedge:
-                num_overlapped += 1
-            else:
-                num_overlapped -= 1
-            if num_overlapped == 1:
-                in_range = ts
-            elif num_overlapped == 0:
-                selected_timeslices += ts - in_range
-                in_range = None
+        selected_timeslices = sum(end - start for start, end in intervals)
     logger.debug("Selected timeslices cover {}s".format(
         selected_timeslices/1e9))
 
-    tables = [
+    if jobs > 1:
+        report = sharded_report(db, filename, sidecar, jobs, engine, devices,
+                                pids, tids, intervals, opt_spans, clip)
+    elif engine == "timeline":
+        report = timeline_report(db, devices, strings, pids, tids, intervals,
+                                 opt_spans, clip, normalize_to_nvprof)
+    else:
+        report = vectorized_report(db, devices, strings,
+                                   intervals, opt_spans, clip)
+
+    logger.debug("Building the tree of selected ranges")
+    root = build_selected(db, intervals, opt_spans)
+    report.ranges = [(len(path) - 1, strings[node.key], node.count, node.inclusive, node.exclusive)
+                     for path, node in root.walk()]
+
+    return report, selected_timeslices
+
+
+# how many time shards each --jobs process gets, so shards with more records do not leave processes idle
+SHARDS_PER_JOB = 4
+
+# tables read by either engine
+REPORT_TABLES = [
+    'CUPTI_ACTIVITY_KIND_CONCURRENT_KERNEL',
+    'CUPTI_ACTIVITY_KIND_MEMCPY',
+    'CUPTI_ACTIVITY_KIND_KERNEL',
+    'CUPTI_ACTIVITY_KIND_RUNTIME',
+]
+
+
+def sharded_report(db, filename, sidecar, jobs, engine, devices, pids, tids, intervals, spans, clip):
+    """ compute an exposure.Report by summarizing time shards of the trace in a process pool
+
+    The extent of the trace is split into equal shards. Each worker selects
+    the same records as the serial report, including those already active at
+    the left boundary of its shard, and clips them to the shard. Every
+    nanosecond is then counted in exactly one shard, so the sum of the shard
+    reports is the serial report.
+    """
+    first, last = db.get_extent()
+    if first is None:
+        logger.debug("no records to shard")
+        return exposure.Report()
+    num_shards = jobs * SHARDS_PER_JOB
+    bounds = [first + (last - first) * i // num_shards
+              for i in range(num_shards + 1)]
+    logger.debug("summarizing {} shards with {} jobs".format(num_shards, jobs))
+
+    # build any sidecar tables once, instead of in every worker
+    db.build_indexes(REPORT_TABLES)
+
+    work = [(filename, sidecar, db.batch_size, engine, devices, pids, tids,
+             intervals, spans, clip, first, window) for window in zip(bounds[:-1], bounds[1:])]
+    report = exposure.Report()
+    with multiprocessing.Pool(jobs) as pool:
+        for shard in pool.imap_unordered(shard_report, work):
+            report.add(shard)
+    return report
+
+
+def shard_report(job):
+    """ compute the exposure.Report of one time window in a worker process"""
+    filename, sidecar, batch_size, engine, devices, pids, tids, intervals, spans, clip, first, window = job
+    db = open_db(filename, sidecar=sidecar, batch_size=batch_size)
+    strings = db.strings()
+    if engine == "timeline":
+        return timeline_report(db, devices, strings, pids, tids, intervals, spans, clip,
+                               lambda ts: ts - first, window=window)
+    return vectorized_report(db, devices, strings, intervals, spans, clip, window=window)
+
+
+def vectorized_report(db, devices, strings, intervals, spans, clip, window=None):
+    """ compute an exposure.Report from NumPy arrays of the filtered tables"""
+    activities = {}
+    for table in [
         'CUPTI_ACTIVITY_KIND_CONCURRENT_KERNEL',
         'CUPTI_ACTIVITY_KIND_MEMCPY',
-        'CUPTI_ACTIVITY_KIND_KERNEL',
         'CUPTI_ACTIVITY_KIND_RUNTIME',
-    ]
+    ]:
+        activities[table] = db.filtered_columns(
+            table, intervals=intervals, spans=spans, clip=clip, window=window)
+        logger.debug("loaded {} rows from {}".format(
+            len(activities[table]), table))
+
+    return exposure.vectorized_report(
+        activities['CUPTI_ACTIVITY_KIND_CONCURRENT_KERNEL'],
+        activities['CUPTI_ACTIVITY_KIND_MEMCPY'],
+        activities['CUPTI_ACTIVITY_KIND_RUNTIME'],
+        devices, strings)
+
+
+def timeline_report(db, devices, strings, pids, tids, intervals, spans, clip, normalize, window=None):
+    """ compute an exposure.Report by walking every edge through a timeline.Expr graph
+
+    If window is a (start, end) pair, only the time inside it is reported
+    """
 
-    # make filtered versions of all the tables
+    # make filtered edges for all the tables
     filtered_edges = {}
-    total_edges = 0
-    for table in tables:
-        filtered = db.create_filtered_table(
-            table, range_names=range, first_n_ranges=first_ranges, spans=opt_spans)
-
-        num_rows = db.execute(
-            'SELECT Count(*) from {}'.format(filtered)).fetchone()[0]
-        logger.debug("{} rows in {} overlap ranges {}".format(
-            num_rows, table, range))
-
-        edges_view = db.create_edges_view(filtered)
-        logger.debug("{} filtered is {}, edges in {}".format(
-            table, filtered, edges_view))
-        # sql = db._rows_in_range_name(table, range)
-        num_rows = db.execute(
-            'SELECT Count(*) from {}'.format(edges_view)).fetchone()[0]
-        logger.debug("{} edges in {} overlap ranges {}".format(
-            num_rows, table, range))
-        total_edges += num_rows
-        filtered_edges[table] = edges_view
-
-    for table, edges in filtered_edges.items():
-        logger.debug('{} -> {}'.format(table, edges))
-
-    logger.debug("{} edges".format(total_edges))
+    for table in REPORT_TABLES:
+        filtered_edges[table] = db.filtered_edges(
+            table, intervals=intervals, spans=spans, clip=clip, window=window)
 
     gpu_kernels = {}
     runtimes = {}
     comms = {}
     for d in devices:
         gpu_kernels[d.id_] = timeline.Timeline()
-        comms["cpu-gpu" + str(d.id_)] = timeline.Timeline()
-        comms["gpu" + str(d.id_) + "-cpu"] = timeline.Timeline()
-
-        for d1 in devices:
-            comms["gpu" + str(d.id_) + "-gpu" + str(d1.id_)
-                  ] = timeline.Timeline()
+    for tag in exposure.link_tags(devices):
+        comms[tag] = timeline.Timeline()
 
     for p in pids:
         for t in tids:
@@ -171,13 +240,14 @@ def summary(ctx, filename, begin, end, range, first_ranges):
         operator.or_, runtimes.values(), timeline.NeverActive())
 
     exposed_gpu = any_gpu_kernel & (~ (any_comm | any_runtime))
-    any_gpu_kernel.record_key = lambda r: (r.device_id, r.name)
-    exposed_gpu.record_key = lambda r: (r.device_id, r.name)
+    # record keys hold ids, which are resolved to names when the report is made
+    any_gpu_kernel.record_key = lambda r: (r.device_id, r.name_id)
+    exposed_gpu.record_key = lambda r: (r.device_id, r.name_id)
     exposed_comm = any_comm & (~ (any_gpu_kernel | any_runtime))
     exposed_runtime_mask = ~ (any_gpu_kernel | any_comm)
     exposed_runtime = any_runtime & exposed_runtime_mask
-    exposed_runtime.record_key = lambda r: (r.pid, r.tid, r.name())
-    any_runtime.record_key = lambda r: (r.pid, r.tid, r.name())
+    exposed_runtime.record_key = lambda r: (r.pid, r.tid, r.cbid)
+    any_runtime.record_key = lambda r: (r.pid, r.tid, r.cbid)
 
     # any_runtime.verbose = True
     any_runtime.name = "any_runtime"
@@ -193,27 +263,28 @@ def summary(ctx, filename, begin, end, range, first_ranges):
     edges_read = 0
     loop_wall_start = time.time()
     # for a particular table, how to create a row
-    row_factories = {}
-    for table, edges in filtered_edges.items():
-        if table == 'CUPTI_ACTIVITY_KIND_CONCURRENT_KERNEL':
-            row_factories[edges] = nvprof.record.ConcurrentKernel.from_nvprof_row
-        elif table == 'CUPTI_ACTIVITY_KIND_MEMCPY':
-            row_factories[edges] = nvprof.record.Comm.from_nvprof_memcpy_row
-        elif table == 'CUPTI_ACTIVITY_KIND_RUNTIME':
-            row_factories[edges] = nvprof.record.Runtime.from_nvprof_row
-        elif table == 'CUPTI_ACTIVITY_KIND_RANGE':
-            row_factories[edges] = nvprof.record.Range.from_nvprof_row
-    for timestamp, is_posedge, record in db.multi_ordered_edges_records(filtered_edges.values(), row_factories=row_factories):
+    row_factories = {
+        'CUPTI_ACTIVITY_KIND_CONCURRENT_KERNEL': nvprof.record.ConcurrentKernel.from_nvprof_row,
+        'CUPTI_ACTIVITY_KIND_MEMCPY': nvprof.record.Comm.from_nvprof_memcpy_row,
+        'CUPTI_ACTIVITY_KIND_RUNTIME': nvprof.record.Runtime.from_nvprof_row,
+        'CUPTI_ACTIVITY_KIND_RANGE': nvprof.record.Range.from_nvprof_row,
+    }
+    for timestamp, is_posedge, record in db.multi_ordered_edges_records(filtered_edges, row_factories=row_factories):
 
         edges_read += 1
         if edges_read % 15000 == 0:
             elapsed = time.time() - loop_wall_start
-            logger.debug("{} rows/sec, {}/{} ({}%)".format(edges_read /
-                                                           elapsed, edges_read, total_edges, edges_read/total_edges * 100))
+            logger.debug("{} rows/sec, {} edges".format(
+                edges_read / elapsed, edges_read))
 
         assert timestamp
         assert record
-        timestamp = normalize_to_nvprof(timestamp)
+
+        # zero-length records contribute no time, and their falling edge sorts before their rising edge
+        if record.start == record.end:
+            continue
+
+        timestamp = normalize(timestamp)
 
         # Update active masks
         if isinstance(record, nvprof.record.Runtime):
@@ -229,15 +300,7 @@ def summary(ctx, filename, begin, end, range, first_ranges):
             else:
                 gpu_kernels[record.device_id].set_idle(timestamp)
         elif isinstance(record, nvprof.record.Comm):
-            if record.src_id == -1:
-                src_tag = 'cpu'
-            else:
-                src_tag = 'gpu' + str(record.src_id)
-            if record.dst_id == -1:
-                dst_tag = 'cpu'
-            else:
-                dst_tag = 'gpu' + str(record.dst_id)
-            comm_id = src_tag + "-" + dst_tag
+            comm_id = exposure.link_tag(record.src_id, record.dst_id)
             if is_posedge:
                 comms[comm_id].set_active(timestamp)
             else:
@@ -265,94 +328,111 @@ def summary(ctx, filename, begin, end, range, first_ranges):
             else:
                 exposed_comm.end_record(timestamp, record)
 
+    report = exposure.Report()
+    report.any_comm = any_comm.time
+    report.exposed_comm = exposed_comm.time
+    report.comm_links = {tag: t.time for tag, t in comms.items()}
+    report.any_runtime = any_runtime.time
+    report.exposed_runtime = exposed_runtime.time
+    report.any_runtime_records = {
+        (pid, tid, nvprof.record.runtime_cbid_name(cbid)): t for (pid, tid, cbid), t in any_runtime.record_times.items()}
+    report.exposed_runtime_records = {
+        (pid, tid, nvprof.record.runtime_cbid_name(cbid)): t for (pid, tid, cbid), t in exposed_runtime.record_times.items()}
+    report.any_kernel = any_gpu_kernel.time
+    report.exposed_kernel = exposed_gpu.time
+    report.gpu_kernels = {gpu: t.time for gpu, t in gpu_kernels.items()}
+    report.any_kernel_records = {
+        (device_id, strings[name_id]): t for (device_id, name_id), t in any_gpu_kernel.record_times.items()}
+    return report
+
+
+def by_time(times):
+    """(key, time) pairs with non-zero time, longest first
+
+    Ties are ordered by key so that every engine prints the same report.
+    """
+    return sorted([(k, t) for k, t in times.items() if t],
+                  key=lambda kt: (-kt[1], str(kt[0])))
+
+
+def print_report(report, selected_timeslices):
     print("Selected timeslices cover {}s".format(selected_timeslices/1e9))
 
     print("Marker Report")
     print("=============")
-    print("<not implemented>")
+    print("count\tincl(s)\texcl(s)\tname")
+    for depth, name, count, inclusive, exclusive in report.ranges:
+        print(count, inclusive/1e9, exclusive/1e9, "  " * depth + name, sep="\t")
     print()
 
     print("Communication Report")
     print("====================")
-    print("Active communication Time-Slices: {}s".format(any_comm.time/1e9))
-    print("Exposed communication Time-Slices: {}s".format(exposed_comm.time/1e9))
+    print("Active communication Time-Slices: {}s".format(report.any_comm/1e9))
+    print("Exposed communication Time-Slices: {}s".format(report.exposed_comm/1e9))
     print("Active Communication Time-Slices")
     print("--------------------------------")
-    for tag, t in comms.items():
-        print("  {} {}s".format(tag, t.time/1e9))
+    for tag, t in report.comm_links.items():
+        print("  {} {}s".format(tag, t/1e9))
 
     print("Exposed communication breakdown")
     print("-------------------------------")
-    # for tag, t in exposed_comm.record_times.items():
-    #     print("  {}s".format(tag))
-    # print("")
 
     print("Runtime Report")
     print("==============")
-    print("Any CUDA Runtime Time-Slices: {}s".format(any_runtime.time/1e9))
-    print("Exposed CUDA Runtime Time-Slices: {}s".format(exposed_runtime.time/1e9))
+    print("Any CUDA Runtime Time-Slices: {}s".format(report.any_runtime/1e9))
+    print("Exposed CUDA Runtime Time-Slices: {}s".format(report.exposed_runtime/1e9))
 
     print("Exposed Runtime by Thread")
     print("-------------------------")
     thread_times = defaultdict(lambda: 0.0)
-    for record, elapsed in exposed_runtime.record_times.items():
+    for record, elapsed in report.exposed_runtime_records.items():
         thread_times[record[1]] += elapsed
-    thread_times = sorted(thread_times.items(),
-                          key=lambda t: t[1], reverse=True)
-    for name, elapsed in thread_times:
+    for name, elapsed in by_time(thread_times):
         print("  {} {}s".format(name, elapsed/1e9))
 
     print("Any Runtime by Call")
     print("-----------------------")
     call_times = defaultdict(lambda: 0.0)
-    for record, elapsed in any_runtime.record_times.items():
+    for record, elapsed in report.any_runtime_records.items():
         call_times[record[2]] += elapsed
-    call_times = sorted(call_times.items(), key=lambda t: t[1], reverse=True)
-    for name, elapsed in call_times:
+    for name, elapsed in by_time(call_times):
         print("  {} {}s".format(name, elapsed/1e9))
 
     print("Exposed Runtime by Call")
     print("-----------------------")
     call_times = defaultdict(lambda: 0.0)
-    for record, elapsed in exposed_runtime.record_times.items():
+    for record, elapsed in report.exposed_runtime_records.items():
         call_times[record[2]] += elapsed
-    call_times = sorted(call_times.items(), key=lambda t: t[1], reverse=True)
-    for name, elapsed in call_times:
+    for name, elapsed in by_time(call_times):
         print("  {} {}s".format(name, elapsed/1e9))
 
     print("Exposed Runtime Breakdown")
     print("-------------------------")
-    runtime_times = sorted(
-        list(exposed_runtime.record_times.items()), key=lambda t: t[1], reverse=True)
-    for record, elapsed in runtime_times:
+    for record, elapsed in by_time(report.exposed_runtime_records):
         print("  {} {}s".format(str(record), elapsed / 1e9))
 
     print("Any Runtime Breakdown")
     print("---------------------")
-    runtime_times = sorted(
-        list(any_runtime.record_times.items()), key=lambda t: t[1], reverse=True)
-    for record, elapsed in runtime_times:
+    for record, elapsed in by_time(report.any_runtime_records):
         print("  {} {}s".format(str(record), elapsed / 1e9))
 
     print("Kernel Report")
     print("=============")
-    print("Any GPU Kernel Time-Slices: {}s".format(any_gpu_kernel.time/1e9))
-    print("Exposed GPU Kernel Time-Slices: {}s".format(exposed_gpu.time/1e9))
+    print("Any GPU Kernel Time-Slices: {}s".format(report.any_kernel/1e9))
+    print("Exposed GPU Kernel Time-Slices: {}s".format(report.exposed_kernel/1e9))
 
     print("Active kernel time-slices by GPU")
     print("--------------------------------")
-    for gpu, t in gpu_kernels.items():
-        print("  GPU {} Kernel Time: {}s".format(gpu, t.time/1e9))
+    for gpu, t in report.gpu_kernels.items():
+        print("  GPU {} Kernel Time: {}s".format(gpu, t/1e9))
 
     gpu_kernel_names = defaultdict(
         lambda: defaultdict(lambda: 0.0))  # [gpu][name] = 0.0
-    for r, elapsed in any_gpu_kernel.record_times.items():
+    for r, elapsed in report.any_kernel_records.items():
         gpu_kernel_names[r[0]][r[1]] += elapsed
 
-    for gpu, d in gpu_kernel_names.items():
+    for gpu, d in sorted(gpu_kernel_names.items()):
         print("Active kernel time-slices on GPU {}".format(gpu))
         print("-----------------------------------")
-        kernel_times = sorted(list(d.items()),
-                              key=lambda t: t[1], reverse=True)
-        for name, elapsed in kernel_times:
+        for name, elapsed in by_time(d):
             print("  {} {}s".format(name, elapsed/1e9))
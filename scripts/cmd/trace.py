@@ -0,0 +1,307 @@
+import click
+import heapq
+import json
+import logging
+
+import perfetto_trace
+from cmd.summary import to_timestamp
+
+logger = logging.getLogger(__name__)
+
+# characters of openvprof.json read at a time
+CHUNK_SIZE = 1 << 20
+
+# memcpy copy_kind -> the link its bandwidth is counted on, formatted with the device
+MEMCPY_LINKS = {
+    "HtoD": "cpu-gpu{}",
+    "HtoA": "cpu-gpu{}",
+    "DtoH": "gpu{}-cpu",
+    "AtoH": "gpu{}-cpu",
+    "DtoD": "gpu-gpu",
+    "PtoP": "gpu-gpu",
+}
+
+# unified memory counters that are not drawn
+UM_SKIPPED = ("CPU_PAGE_FAULT", "THRASHING", "MAP")
+
+
+def records(f, chunk_size=CHUNK_SIZE, warn=True):
+    """yield the records of f, a JSON array of objects written by RecordWriter, one at a time
+
+    The file is read chunk_size characters at a time, so memory use does not
+    depend on its length. A record cut off by the end of the file, as left by
+    a run that crashed, and a missing closing bracket are ignored, with a
+    warning if warn.
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+    while True:
+        # skip the brackets and separators between records
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,[":
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            buf = f.read(chunk_size)
+            pos = 0
+            eof = not buf
+        if pos == len(buf):
+            if warn:
+                logger.warning("{} ends before the closing ]".format(f.name))
+            return
+        if buf[pos] == "]":
+            return
+
+        try:
+            record, pos = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                if warn:
+                    logger.warning("ignoring a truncated record at the end of {}".format(f.name))
+                return
+            # the record continues in the next chunk
+            more = f.read(chunk_size)
+            eof = not more
+            buf = buf[pos:] + more
+            pos = 0
+            continue
+        yield record
+
+
+def span(r):
+    """(start, end) of a record in ns"""
+    return r["wall_start_ns"], r["wall_start_ns"] + r["wall_duration_ns"]
+
+
+def bandwidth(out, process, link, r, num_bytes):
+    """add num_bytes transferred over the span of r to the bandwidth (B/s) counter of link"""
+    start, end = span(r)
+    if start == end:
+        return
+    bw = num_bytes / (r["wall_duration_ns"] / 1e9)
+    out.edge(link, process, start, bw, True)
+    out.edge(link, process, end, -bw, False)
+
+
+def api(thread):
+    def handle(out, r):
+        out.complete(r["cbid"], "api", "activity", thread, *span(r))
+    return handle
+
+
+def kernel(out, r):
+    out.complete(r["name"], "kernel", "activity", "activity: kernel", *span(r))
+
+
+def memcpy(out, r):
+    seconds = r["wall_duration_ns"] / 1e9
+    args = {"bytes": r["bytes"]}
+    # a copy too short for the clock has no rate
+    if seconds:
+        args["MB/s"] = (r["bytes"] / 1e6) / seconds
+        args["MiB/s"] = (r["bytes"] / 2 ** 20) / seconds
+    out.complete(r["copy_kind"], "memcpy", "activity", "activity: memcpy", *span(r), args=args)
+    bandwidth(out, "bw", MEMCPY_LINKS.get(r["copy_kind"], "generic").format(r["dev"]), r, r["bytes"])
+
+
+def unified_memory_counter(out, r):
+    counter_kind = r["counter_kind"]
+    if counter_kind in UM_SKIPPED:
+        return
+    out.complete(counter_kind, "unified_memory", "activity", "activity: um " + counter_kind,
+                 *span(r), args={"value": r["value"]})
+    if counter_kind == "BYTES_TRANSFER_DTOH":
+        bandwidth(out, "bw", "gpu{}-cpu".format(r["src_id"]), r, r["value"])
+    elif counter_kind == "BYTES_TRANSFER_HTOD":
+        bandwidth(out, "bw", "cpu-gpu{}".format(r["dst_id"]), r, r["value"])
+    elif counter_kind == "BYTES_TRANSFER_DTOD":
+        bandwidth(out, "bw", "gpu{}-gpu{}".format(r["src_id"], r["dst_id"]), r, r["value"])
+
+
+def pcie_throughput(out, r):
+    name = "gpu" + str(r["dev"]) + "-" + r["cntr_kind"]
+    bandwidth(out, "pcie_bw", name, r, r["kbytes"] * 1e3)
+
+
+# record kind -> handle(out, record), which draws the record with out.complete and out.edge
+HANDLERS = {
+    "activity_api_driver": api("activity: driver"),
+    "activity_api_runtime": api("activity: runtime"),
+    "activity_kernel": kernel,
+    "activity_memcpy": memcpy,
+    "activity_unified_memory_counter": unified_memory_counter,
+    "pcie_throughput": pcie_throughput,
+}
+
+
+class Bandwidth(object):
+    """ sweep the edges of transfers into a counter per link of their summed bandwidth
+
+    edge() is called in timestamp order with the change in bandwidth at each
+    rising and falling edge of a transfer, and whether it is rising, so
+    transfers of 0 bytes are counted too. The sum of the transfers that are
+    in flight on a link is written when it changes, after every edge at that
+    timestamp, so overlapping transfers add up and back-to-back transfers do
+    not drop to 0 in between.
+
+    If interval (ns) is given, the counters are resampled to the average
+    bandwidth over each interval instead, written when it changes.
+    """
+
+    def __init__(self, writer, interval=None):
+        self.writer = writer
+        self.interval = interval
+        # (link, process) -> [bandwidth, transfers in flight, timestamp of the last edge,
+        #                     last value written, start of the current interval, bytes in it]
+        self.links = {}
+
+    def _write(self, key, link, ts, value):
+        if value != link[3]:
+            name, process = key
+            self.writer.counter(name, self.writer.process(process, process), ts, {"bw": value})
+            link[3] = value
+
+    def _advance(self, key, link, ts):
+        """account for the bandwidth of link from its last edge to ts"""
+        last, value = link[2], link[0]
+        if self.interval is None:
+            if ts > last:
+                self._write(key, link, last, value)
+            return
+        while ts >= link[4] + self.interval:
+            interval_end = link[4] + self.interval
+            link[5] += value * (interval_end - last)
+            self._write(key, link, link[4], link[5] / self.interval)
+            last = link[4] = interval_end
+            link[5] = 0.0
+            # intervals that are all in between two edges have the same bandwidth
+            skipped = (ts - last) // self.interval
+            if skipped:
+                self._write(key, link, last, value)
+                last = link[4] = last + skipped * self.interval
+        link[5] += value * (ts - last)
+
+    def edge(self, name, process, ts, delta, rising):
+        """change the bandwidth (B/s) of link name of process by delta at ts, the start of a transfer if rising"""
+        key = (name, process)
+        link = self.links.get(key)
+        if link is None:
+            origin = self.writer.origin
+            interval_start = ts if self.interval is None else \
+                origin + (ts - origin) // self.interval * self.interval
+            link = self.links[key] = [0.0, 0, ts, 0.0, interval_start, 0.0]
+        self._advance(key, link, ts)
+        link[2] = ts
+        link[1] += 1 if rising else -1
+        # start from exactly 0 when the link is idle, instead of the rounding error of the sum
+        link[0] = link[0] + delta if link[1] else 0.0
+
+    def close(self):
+        """write the counters after the last edges"""
+        for key, link in self.links.items():
+            if self.interval is None:
+                self._write(key, link, link[2], link[0])
+            else:
+                self._advance(key, link, link[4] + self.interval)
+                self._write(key, link, link[4], link[0])
+
+
+class Reorder(object):
+    """ write events to a trace writer in time order, holding them until window (ns) has passed
+
+    Records are written by RecordWriter as their buffers are flushed, so they
+    are only roughly in time order. Events are held in a heap until an event
+    that starts window later is added, so the heap holds at most window of
+    events. Events that arrive later than that are written out of order.
+    """
+
+    def __init__(self, writer, window, bandwidth):
+        self.writer = writer
+        self.window = window
+        self.bandwidth = bandwidth
+        self.heap = []  # (timestamp, seq, method, args)
+        self.seq = 0
+        self.latest = None
+
+    def _push(self, ts, method, args):
+        heapq.heappush(self.heap, (ts, self.seq, method, args))
+        self.seq += 1
+        if self.latest is None or ts > self.latest:
+            self.latest = ts
+        while self.heap[0][0] < self.latest - self.window:
+            self._pop()
+
+    def _pop(self):
+        ts, _, method, (name, process, *rest) = heapq.heappop(self.heap)
+        if method == "complete":
+            cat, thread, start, end, args = rest
+            pid = self.writer.process(process, process)
+            tid = self.writer.thread(pid, thread, thread)
+            self.writer.complete(name, cat, pid, tid, start, end, args=args)
+        else:
+            delta, rising = rest
+            self.bandwidth.edge(name, process, ts, delta, rising)
+
+    def complete(self, name, cat, process, thread, start, end, args=None):
+        """add a slice on thread of process from start to end"""
+        self._push(start, "complete", (name, process, cat, thread, start, end, args))
+
+    def edge(self, name, process, ts, delta, rising):
+        """add a change of delta in the bandwidth of link name of process at ts, at the start of a transfer if rising"""
+        self._push(ts, "edge", (name, process, delta, rising))
+
+    def close(self):
+        """write the remaining events"""
+        while self.heap:
+            self._pop()
+        self.bandwidth.close()
+
+
+@click.command()
+@click.argument('input', type=click.Path(exists=True, dir_okay=False))
+@click.option('-o', '--output', default='trace.json', show_default=True, help='Write the trace to this file, gzip-compressed if it ends in .gz')
+@click.option('--gzip', 'compress', is_flag=True, help='gzip-compress the trace')
+@click.option('--format', type=click.Choice(['chrome', 'perfetto']), help='chrome://tracing JSON, or Perfetto protobuf  [default: perfetto if --output ends in .pftrace, else chrome]')
+@click.option('--window', default='1s', show_default=True, help='Reorder records that are written up to this late (ns, or seconds like 0.5s)')
+@click.option('--resample', help='Write the average bandwidth of each interval this long (ns, or seconds like 0.001s) instead of every change')
+@click.pass_context
+def trace(ctx, input, output, compress, format, window, resample):
+    """Convert INPUT, an openvprof.json recording, to a timeline
+
+    The recording is read twice, once for its first timestamp and once to
+    write the events, a record at a time, so memory use does not depend on
+    its length. A truncated last record is ignored.
+
+    Memcpy, unified memory, and PCIe throughput records are summed into a
+    bandwidth counter per link.
+    """
+    try:
+        window = to_timestamp(window, 0)
+        resample = to_timestamp(resample, 0) if resample else None
+    except ValueError:
+        logger.error("--window and --resample should be ns or seconds like 0.5s")
+        raise SystemExit(-1)
+    # times shorter than 1ns are 0
+    if window <= 0 or (resample is not None and resample <= 0):
+        logger.error("--window and --resample should be at least 1ns")
+        raise SystemExit(-1)
+
+    with open(input) as f:
+        start_time = min((r["wall_start_ns"] for r in records(f, warn=False) if "wall_start_ns" in r), default=0)
+    logger.debug("start time: {}".format(start_time))
+
+    unused = {}
+    with open(input) as f, perfetto_trace.open_writer(output, format=format, compress=compress, origin=start_time) as writer:
+        out = Reorder(writer, window, Bandwidth(writer, interval=resample))
+        for record in records(f):
+            kind = record.get("kind")
+            if kind in HANDLERS:
+                HANDLERS[kind](out, record)
+            else:
+                unused[kind] = unused.get(kind, 0) + 1
+        out.close()
+    for kind, count in sorted(unused.items(), key=lambda item: str(item[0])):
+        logger.debug("didn't use {} records of kind {}".format(count, kind))
+    logger.debug("wrote {} events".format(writer.num_events))
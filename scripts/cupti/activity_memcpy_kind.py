@@ -11,3 +11,21 @@ DTOA = 7
 DTOD = 8
 HTOH = 9
 PTOP = 10
+
+NAME = {
+    UNKNOWN: "Unknown",
+    HTOD: "HtoD",
+    DTOH: "DtoH",
+    HTOA: "HtoA",
+    ATOH: "AtoH",
+    ATOA: "AtoA",
+    ATOD: "AtoD",
+    DTOA: "DtoA",
+    DTOD: "DtoD",
+    HTOH: "HtoH",
+    PTOP: "PtoP",
+}
+
+
+def name(kind):
+    return NAME.get(kind, str(kind))
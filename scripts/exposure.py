@@ -0,0 +1,211 @@
+""" Active and exposed time of GPU kernels, communication, and CUDA runtime calls
+
+Report holds the times that cmd/summary.py prints, regardless of which engine
+produced them. vectorized_report computes them from NumPy activity arrays
+(see nvprof.columnar) instead of pushing each edge through a timeline.Expr
+graph:
+
+* the start and end timestamps of every record form a sorted grid of segments
+* the number of active records of each category in each segment is a
+  cumulative sum of +1/-1 edge counts over the grid
+* an expression like "kernel and not (comm or runtime)" is a boolean mask
+  over the segments
+* the time a record spends while a mask is active is a difference of the
+  cumulative masked segment length at its end and start, and per-key totals
+  are segment reductions over records sorted by key
+"""
+
+from collections import defaultdict
+
+import numpy as np
+
+from nvprof import columnar
+from nvprof.record import runtime_cbid_name
+
+
+def link_tag(src_id, dst_id):
+    """ the communication link name for a transfer, where -1 is the CPU"""
+    if src_id == -1:
+        src_tag = 'cpu'
+    else:
+        src_tag = 'gpu' + str(src_id)
+    if dst_id == -1:
+        dst_tag = 'cpu'
+    else:
+        dst_tag = 'gpu' + str(dst_id)
+    return src_tag + "-" + dst_tag
+
+
+def link_tags(devices):
+    """ all communication links between the CPU and DEVICES, in report order"""
+    tags = []
+    for d in devices:
+        tags += [link_tag(-1, d.id_), link_tag(d.id_, -1)]
+        for d1 in devices:
+            tags += [link_tag(d.id_, d1.id_)]
+    return tags
+
+
+class Report(object):
+    """ times (ns) of activities, and of exposed activities that do not overlap other kinds"""
+
+    def __init__(self):
+        self.any_comm = 0
+        self.exposed_comm = 0
+        self.comm_links = {}  # {link tag: time}
+
+        self.any_runtime = 0
+        self.exposed_runtime = 0
+        self.any_runtime_records = {}  # {(pid, tid, call name): time}
+        self.exposed_runtime_records = {}  # {(pid, tid, call name): time}
+
+        self.any_kernel = 0
+        self.exposed_kernel = 0
+        self.gpu_kernels = {}  # {device id: time}
+        self.any_kernel_records = {}  # {(device id, kernel name): time}
+
+        # [(depth, range name, count, inclusive, exclusive)] of the range tree, depth-first. not added by add()
+        self.ranges = []
+
+    def add(self, other):
+        """ add the times of other, a Report of a disjoint span of time, to this one"""
+        for field in ['any_comm', 'exposed_comm', 'any_runtime', 'exposed_runtime', 'any_kernel', 'exposed_kernel']:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+        for field in ['comm_links', 'any_runtime_records', 'exposed_runtime_records', 'gpu_kernels', 'any_kernel_records']:
+            times = getattr(self, field)
+            for key, t in getattr(other, field).items():
+                times[key] = times.get(key, 0) + t
+
+
+def active_counts(grid, starts, ends):
+    """the number of [start, end) intervals active in each segment [grid[i], grid[i+1])"""
+    n = len(grid)
+    delta = np.bincount(np.searchsorted(grid, starts), minlength=n) - \
+        np.bincount(np.searchsorted(grid, ends), minlength=n)
+    return np.cumsum(delta)[:-1]
+
+
+def masked_time(lengths, mask):
+    """ total length of segments where mask is True"""
+    return int(lengths[mask].sum())
+
+
+def record_times(grid, lengths, mask, starts, ends):
+    """ time each [start, end) record overlaps segments where mask is True"""
+    cumulative = np.zeros(len(grid), dtype=np.int64)
+    np.cumsum(np.where(mask, lengths, 0), out=cumulative[1:])
+    return cumulative[np.searchsorted(grid, ends)] - cumulative[np.searchsorted(grid, starts)]
+
+
+def sum_by_key(key_columns, values):
+    """ return {key: total} where key is a tuple of the key_columns of each value"""
+    if len(values) == 0:
+        return {}
+    keys = np.stack([np.asarray(c, dtype=np.int64) for c in key_columns], axis=1)
+    order = np.lexsort(key_columns[::-1])
+    keys = keys[order]
+    values = values[order]
+    segment_starts = np.concatenate(
+        ([0], np.flatnonzero(np.any(keys[1:] != keys[:-1], axis=1)) + 1))
+    totals = np.add.reduceat(values, segment_starts)
+    return {tuple(int(k) for k in keys[i]): int(total) for i, total in zip(segment_starts, totals)}
+
+
+def vectorized_report(kernels, memcpys, runtimes, devices, strings):
+    """ compute a Report from CONCURRENT_KERNEL, MEMCPY, and RUNTIME activity arrays
+
+    devices is a list of nvprof.record.Device, and strings maps StringTable ids to strings
+    """
+    grid = np.unique(np.concatenate([
+        kernels['start'], kernels['end'],
+        memcpys['start'], memcpys['end'],
+        runtimes['start'], runtimes['end'],
+    ]))
+    lengths = np.diff(grid)
+
+    kernel_active = active_counts(grid, kernels['start'], kernels['end']) > 0
+    comm_active = active_counts(grid, memcpys['start'], memcpys['end']) > 0
+    runtime_active = active_counts(
+        grid, runtimes['start'], runtimes['end']) > 0
+
+    exposed_kernel = kernel_active & ~(comm_active | runtime_active)
+    exposed_comm = comm_active & ~(kernel_active | runtime_active)
+    exposed_runtime = runtime_active & ~(kernel_active | comm_active)
+
+    report = Report()
+    report.any_kernel = masked_time(lengths, kernel_active)
+    report.exposed_kernel = masked_time(lengths, exposed_kernel)
+    report.any_comm = masked_time(lengths, comm_active)
+    report.exposed_comm = masked_time(lengths, exposed_comm)
+    report.any_runtime = masked_time(lengths, runtime_active)
+    report.exposed_runtime = masked_time(lengths, exposed_runtime)
+
+    for d in devices:
+        on_device = kernels['device_id'] == d.id_
+        active = active_counts(
+            grid, kernels['start'][on_device], kernels['end'][on_device]) > 0
+        report.gpu_kernels[d.id_] = masked_time(lengths, active)
+
+    src_ids, dst_ids = columnar.link_ids(memcpys)
+    report.comm_links = {tag: 0 for tag in link_tags(devices)}
+    for src_id, dst_id in sorted(set(zip(src_ids.tolist(), dst_ids.tolist()))):
+        on_link = (src_ids == src_id) & (dst_ids == dst_id)
+        active = active_counts(
+            grid, memcpys['start'][on_link], memcpys['end'][on_link]) > 0
+        report.comm_links[link_tag(src_id, dst_id)] = masked_time(
+            lengths, active)
+
+    times = record_times(grid, lengths, kernel_active,
+                         kernels['start'], kernels['end'])
+    by_id = sum_by_key([kernels['device_id'], kernels['name_id']], times)
+    report.any_kernel_records = {
+        (device_id, strings[name_id]): t for (device_id, name_id), t in by_id.items()}
+
+    runtime_keys = [runtimes['pid'], runtimes['tid'], runtimes['cbid']]
+    for mask, records in [
+        (runtime_active, report.any_runtime_records),
+        (exposed_runtime, report.exposed_runtime_records),
+    ]:
+        times = record_times(grid, lengths, mask,
+                             runtimes['start'], runtimes['end'])
+        for (pid, tid, cbid), t in sum_by_key(runtime_keys, times).items():
+            records[(pid, tid, runtime_cbid_name(cbid))] = t
+
+    return report
+
+
+def rank_overlap(edges, num_ranks):
+    """ return {category: (any rank time, all ranks time)} for records from several ranks
+
+    edges are (ts, edge, start, end, (rank, category), row) on a shared clock,
+    ordered by (ts, edge) (see nvprof.align.merged_rows and nvprof.sweep.edges).
+    "any" is the time at least one rank has an active record of the category,
+    and "all" is the time every rank does.
+    """
+    active = defaultdict(int)  # {(rank, category): active records}
+    ranks_active = defaultdict(int)  # {category: ranks with active records}
+    any_time = defaultdict(int)
+    all_time = defaultdict(int)
+    prev_ts = None
+    for ts, is_rising, start, end, key, _ in edges:
+        # zero-length records contribute no time
+        if start == end:
+            continue
+        if prev_ts is not None:
+            for category, n in ranks_active.items():
+                if n:
+                    any_time[category] += ts - prev_ts
+                if n == num_ranks:
+                    all_time[category] += ts - prev_ts
+        prev_ts = ts
+
+        category = key[1]
+        if is_rising:
+            active[key] += 1
+            if active[key] == 1:
+                ranks_active[category] += 1
+        else:
+            active[key] -= 1
+            if active[key] == 0:
+                ranks_active[category] -= 1
+    return {category: (any_time[category], all_time[category]) for category in ranks_active}
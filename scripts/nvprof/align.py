@@ -0,0 +1,75 @@
+""" Align the clocks of traces captured on different nodes, and merge their records in time order """
+
+import logging
+import statistics
+from collections import defaultdict
+from operator import itemgetter
+
+from nvprof import merge
+
+logger = logging.getLogger(__name__)
+
+
+def anchor_times(db, names, edge="end"):
+    """return {(name, k): timestamp} for the k-th range (by start) of each name like any of names
+
+    edge is "start" or "end", the edge of each range that happens at the same
+    time on every node (the end of a barrier, for example).
+    """
+    assert edge in ("start", "end")
+    strings = db.strings()
+    ranges_view = db.ranges_with_name(names)
+    counts = defaultdict(int)
+    anchors = {}
+    for name_id, ts in db.execute("SELECT name, {} FROM {} ORDER BY start".format(edge, ranges_view)):
+        name = strings[name_id]
+        anchors[(name, counts[name])] = ts
+        counts[name] += 1
+    return anchors
+
+
+def estimate_offsets(anchors):
+    """return the offset to add to the timestamps of each trace to put it on the clock of the first trace
+
+    anchors has one {key: timestamp} per trace (see anchor_times). The offset
+    of a trace is the median difference between the first trace's timestamp
+    and its own over all anchors they share, so a few anchors that did not
+    happen at the same time do not skew it.
+    """
+    reference = anchors[0]
+    offsets = []
+    for i, trace_anchors in enumerate(anchors):
+        shared = [k for k in trace_anchors if k in reference]
+        if not shared:
+            logger.warning(
+                "trace {} shares no anchors with trace 0, not aligning it".format(i))
+            offsets += [0]
+            continue
+        offsets += [statistics.median_low(reference[k] - trace_anchors[k]
+                                          for k in shared)]
+        logger.debug("trace {} offset {}ns from {} anchors".format(
+            i, offsets[-1], len(shared)))
+    return offsets
+
+
+def aligned_rows(db, table, offset, intervals=None, spans=None, clip=False):
+    """yield (start, end, row) for the filtered rows of table (see Db.filtered_rows), ordered by start
+
+    start and end are on the aligned clock, row is unchanged.
+    spans are on the clock of db.
+    """
+    rows, start_idx, end_idx = db.filtered_rows(
+        table, intervals=intervals, spans=spans, clip=clip)
+    for row in rows:
+        yield row[start_idx] + offset, row[end_idx] + offset, row
+
+
+def merged_rows(sources, batch_size=merge.DEFAULT_BATCH_SIZE):
+    """yield (start, end, tag, row) for rows from all sources, ordered by aligned start
+
+    sources is a sequence of (tag, rows), where rows are (start, end, row) ordered
+    by start (see aligned_rows). Sources are read batch_size rows at a time,
+    so no trace is ever loaded into memory.
+    """
+    for tag, (start, end, row) in merge.merge(sources, key=itemgetter(0), batch_size=batch_size):
+        yield start, end, tag, row
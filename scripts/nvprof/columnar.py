@@ -0,0 +1,177 @@
+""" Load nvprof activity tables into NumPy structured arrays """
+
+import logging
+import numpy as np
+
+from cupti import activity_memcpy_kind
+from nvprof import merge
+
+logger = logging.getLogger(__name__)
+
+# every activity table is loaded into the same record layout.
+# fields that a table does not have are -1
+ACTIVITY_DTYPE = np.dtype([
+    ('start', np.int64),
+    ('end', np.int64),
+    ('device_id', np.int32),
+    ('stream', np.int32),
+    ('pid', np.int64),
+    ('tid', np.int64),
+    ('cbid', np.int32),
+    ('name_id', np.int32),  # StringTable id
+    ('copy_kind', np.int8),
+    ('bytes', np.int64),
+])
+
+_KERNEL_COLUMNS = {
+    'start': 'start',
+    'end': 'end',
+    'device_id': 'deviceId',
+    'stream': 'streamId',
+    'name_id': 'name',
+}
+
+_API_COLUMNS = {
+    'start': 'start',
+    'end': 'end',
+    'pid': 'processId',
+    'tid': 'threadId',
+    'cbid': 'cbid',
+}
+
+# the nvprof column for each field of ACTIVITY_DTYPE, by table
+COLUMNS = {
+    'CUPTI_ACTIVITY_KIND_CONCURRENT_KERNEL': _KERNEL_COLUMNS,
+    'CUPTI_ACTIVITY_KIND_KERNEL': _KERNEL_COLUMNS,
+    'CUPTI_ACTIVITY_KIND_MEMCPY': {
+        'start': 'start',
+        'end': 'end',
+        'device_id': 'deviceId',
+        'stream': 'streamId',
+        'copy_kind': 'copyKind',
+        'bytes': 'bytes',
+    },
+    'CUPTI_ACTIVITY_KIND_RUNTIME': _API_COLUMNS,
+    'CUPTI_ACTIVITY_KIND_DRIVER': _API_COLUMNS,
+    'CUPTI_ACTIVITY_KIND_RANGE': {
+        'start': 'start',
+        'end': 'end',
+        # ranges whose markers are not attached to a thread have no pid or tid
+        'pid': 'IFNULL(processId, -1)',
+        'tid': 'IFNULL(threadId, -1)',
+        'name_id': 'name',
+    },
+}
+
+
+class Columns(object):
+    """ a table held as one array per field, which can be used like an ACTIVITY_DTYPE structured array
+
+    The arrays may be numpy.memmaps of a column store (see nvprof.columnstore),
+    so selecting a field does not copy anything. Fields that the table does
+    not have read as -1, like in load.
+    """
+
+    def __init__(self, fields, length):
+        self.fields = fields  # {field: array}
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if key in self.fields:
+                return self.fields[key]
+            return np.full(self.length, -1, dtype=ACTIVITY_DTYPE[key])
+        # an index, slice, or mask selects the same rows of every field
+        fields = {name: column[key] for name, column in self.fields.items()}
+        length = len(next(iter(fields.values()))) if fields else len(
+            np.arange(self.length)[key])
+        return Columns(fields, length)
+
+    def __setitem__(self, key, value):
+        self.fields[key] = value
+
+
+def select_sql(table, source=None, ordered=True):
+    """SQL that selects the ACTIVITY_DTYPE fields from SOURCE, a table or view with the columns of TABLE"""
+    columns = COLUMNS[table]
+    exprs = [columns.get(field, "-1") for field in ACTIVITY_DTYPE.names]
+    sql = "SELECT {} FROM {}".format(",".join(exprs), source or table)
+    if ordered:
+        sql += " ORDER BY start"
+    return sql
+
+
+def load(conn, table, source=None, ordered=True, batch_size=merge.DEFAULT_BATCH_SIZE):
+    """load the rows of SOURCE (default TABLE) into an ACTIVITY_DTYPE array
+
+    Only the columns in COLUMNS[table] are read, batch_size rows at a time.
+    If ordered, the array is sorted by start.
+    """
+    sql = select_sql(table, source=source, ordered=ordered)
+    logger.debug("executing SQL: {}".format(sql))
+    cursor = conn.execute(sql)
+    chunks = [np.array(batch, dtype=ACTIVITY_DTYPE)
+              for batch in merge.batches(cursor, batch_size)]
+    if chunks:
+        arr = np.concatenate(chunks)
+    else:
+        arr = np.empty(0, dtype=ACTIVITY_DTYPE)
+
+    if 'tid' in COLUMNS[table]:
+        unsigned_tids(arr['tid'])
+    return arr
+
+
+def unsigned_tids(tid):
+    """convert thread ids that nvprof stores as signed 32-bit integers to unsigned, in place
+
+    -1 is left alone, it means there is no thread.
+    """
+    tid[tid < -1] += 2**32
+
+
+def link_ids(arr):
+    """return (src_id, dst_id) arrays for memcpy records, where -1 is the CPU
+
+    This mirrors nvprof.record.Comm.from_nvprof_memcpy_row
+    """
+    copy_kind = arr['copy_kind']
+    device_id = arr['device_id']
+    from_host = (copy_kind == activity_memcpy_kind.HTOD) | (
+        copy_kind == activity_memcpy_kind.HTOA)
+    to_host = (copy_kind == activity_memcpy_kind.DTOH) | (
+        copy_kind == activity_memcpy_kind.ATOH)
+    host_only = copy_kind == activity_memcpy_kind.HTOH
+
+    src_id = np.where(from_host | host_only, -1, device_id)
+    dst_id = np.where(to_host | host_only, -1, device_id)
+    return src_id, dst_id
+
+
+def overlapping(arr, intervals, clip=False):
+    """return the records of arr that overlap any of intervals, a sorted list of disjoint (start, end)
+
+    This is the vectorized form of nvprof.sweep.overlapping. If clip, each
+    record is replaced by one record per interval it overlaps, with start and
+    end clipped to that interval.
+    """
+    interval_starts = np.array([i[0] for i in intervals], dtype=np.int64)
+    interval_ends = np.array([i[1] for i in intervals], dtype=np.int64)
+
+    # records overlap intervals [first, last)
+    first = np.searchsorted(interval_ends, arr['start'], side='left')
+    last = np.searchsorted(interval_starts, arr['end'], side='right')
+    hits = np.maximum(last - first, 0)
+    if not clip:
+        return arr[hits > 0]
+
+    record = np.repeat(np.arange(len(arr)), hits)
+    offset = np.arange(len(record)) - np.repeat(np.cumsum(hits) - hits, hits)
+    interval = first[record] + offset
+    pieces = arr[record]
+    pieces['start'] = np.maximum(pieces['start'], interval_starts[interval])
+    pieces['end'] = np.minimum(pieces['end'], interval_ends[interval])
+    return pieces
@@ -0,0 +1,281 @@
+""" A memory-mapped columnar trace format, written by the convert command
+
+A column store is a directory with
+
+* manifest.json: the format version, the trace Metadata, and the tables,
+  with their row counts and fields
+* <table>.<field>: one fixed-width little-endian column per field of
+  nvprof.columnar.ACTIVITY_DTYPE that the table has, with rows sorted by start
+* strings.ids, strings.offsets, strings.blob: StringTable ids, sorted, and
+  the UTF-8 bytes of each string at blob[offsets[i]:offsets[i+1]]
+
+ColumnStore opens the columns with numpy.memmap, so loading a table does not
+copy or parse anything, and concurrent analyses of the same store share the
+OS page cache.
+"""
+
+import json
+import logging
+import os
+import re
+
+import numpy as np
+
+from nvprof import columnar, merge, sweep
+from nvprof.db import Db
+from nvprof.metadata import Metadata
+from nvprof.record import Device, Range
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+FORMAT = "openvprof-columnar"
+FORMAT_VERSION = 1
+
+
+def is_store(path):
+    return os.path.isfile(os.path.join(path, MANIFEST))
+
+
+def column_path(path, table, field):
+    return os.path.join(path, "{}.{}".format(table, field))
+
+
+def convert(db, path, batch_size=merge.DEFAULT_BATCH_SIZE):
+    """write the activity tables and strings of db, an nvprof.db.Db, as a column store in directory path
+
+    Tables are read and written batch_size rows at a time.
+    """
+    os.makedirs(path, exist_ok=True)
+    metadata = db.metadata()
+    present = {row[0] for row in db.execute(
+        "SELECT name FROM main.sqlite_master WHERE type='table'")}
+
+    tables = {}
+    for table, columns in columnar.COLUMNS.items():
+        if table == "CUPTI_ACTIVITY_KIND_RANGE":
+            if "CUPTI_ACTIVITY_KIND_MARKER" not in present:
+                continue
+            db.range_table()
+        elif table not in present:
+            continue
+
+        fields = [f for f in columnar.ACTIVITY_DTYPE.names if f in columns]
+        logger.debug("converting {}".format(table))
+        files = {f: open(column_path(path, table, f), "wb") for f in fields}
+        rows = 0
+        cursor = db.execute(columnar.select_sql(table, ordered=True))
+        for batch in merge.batches(cursor, batch_size):
+            chunk = np.array(batch, dtype=columnar.ACTIVITY_DTYPE)
+            if 'tid' in columns:
+                columnar.unsigned_tids(chunk['tid'])
+            for f in fields:
+                chunk[f].tofile(files[f])
+            rows += len(chunk)
+        for f in files.values():
+            f.close()
+        tables[table] = {
+            "rows": rows,
+            "fields": {f: columnar.ACTIVITY_DTYPE[f].str for f in fields},
+        }
+
+    logger.debug("converting StringTable")
+    ids = []
+    offsets = [0]
+    with open(os.path.join(path, "strings.blob"), "wb") as blob:
+        for id_, value in db.execute("SELECT _id_, value FROM StringTable ORDER BY _id_"):
+            encoded = value.encode("utf-8")
+            blob.write(encoded)
+            ids += [id_]
+            offsets += [offsets[-1] + len(encoded)]
+    np.array(ids, dtype=np.int64).tofile(os.path.join(path, "strings.ids"))
+    np.array(offsets, dtype=np.int64).tofile(
+        os.path.join(path, "strings.offsets"))
+
+    manifest = {
+        "format": FORMAT,
+        "version": FORMAT_VERSION,
+        "metadata": json.loads(metadata.to_json()),
+        "tables": tables,
+        "strings": len(ids),
+    }
+    # the manifest is written last, so a partial conversion is not a store
+    with open(os.path.join(path, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def _map(filename, dtype, count):
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode="r", shape=(count,))
+
+
+def _like_pattern(name):
+    """a regular expression that is found in the strings that match SQL LIKE '%name%'"""
+    return "".join(".*" if c == "%" else "." if c == "_" else re.escape(c) for c in name)
+
+
+class StoreStrings(object):
+    """ the strings of a column store, with the interface of nvprof.strings.Strings"""
+
+    def __init__(self, path, count):
+        self.ids = _map(os.path.join(path, "strings.ids"), np.int64, count)
+        self.offsets = _map(os.path.join(
+            path, "strings.offsets"), np.int64, count + 1)
+        blob_path = os.path.join(path, "strings.blob")
+        self.blob = _map(blob_path, np.uint8, os.path.getsize(blob_path))
+        self.cache = {}
+        self.dicts = None
+
+    def _value(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i+1]].tobytes().decode("utf-8")
+
+    def __getitem__(self, id_):
+        if id_ not in self.cache:
+            i = np.searchsorted(self.ids, id_)
+            if i == len(self.ids) or self.ids[i] != id_:
+                raise KeyError(id_)
+            self.cache[id_] = self._value(i)
+        return self.cache[id_]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def id_of(self, s):
+        _, string_to_id = self.as_dicts()
+        return string_to_id.get(s)
+
+    def ids_like(self, names):
+        """return the set of ids of strings that match any of names like SQL LIKE '%name%'
+
+        % and _ in names match any string and any character, and ASCII case is ignored.
+        """
+        if not names:
+            return set()
+        id_to_string, _ = self.as_dicts()
+        like = re.compile("|".join(_like_pattern(name) for name in names), re.IGNORECASE | re.ASCII | re.DOTALL)
+        return {id_ for id_, s in id_to_string.items() if like.search(s)}
+
+    def as_dicts(self):
+        if self.dicts is None:
+            id_to_string = {int(id_): self._value(i)
+                            for i, id_ in enumerate(self.ids)}
+            string_to_id = {s: id_ for id_, s in id_to_string.items()}
+            self.dicts = id_to_string, string_to_id
+        return self.dicts
+
+
+class ColumnStore(object):
+    """ a column store opened with numpy.memmap, with the parts of the nvprof.db.Db interface used by reports
+
+    Only the vectorized summary engine runs on a column store.
+    """
+
+    columnar = True
+
+    def __init__(self, path, sidecar=False, batch_size=merge.DEFAULT_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format") != FORMAT or self.manifest.get("version") != FORMAT_VERSION:
+            logger.error("{} is not a version {} column store".format(
+                path, FORMAT_VERSION))
+            raise SystemExit(-1)
+        self._metadata = Metadata.from_json(
+            json.dumps(self.manifest["metadata"]))
+        self._strings = None
+        self._columns = {}
+
+    def metadata(self):
+        return self._metadata
+
+    def get_extent(self):
+        return self._metadata.extent()
+
+    def get_devices(self):
+        return [Device(id_=id_) for id_ in self._metadata.devices]
+
+    def num_rows(self, table_name, ranges=None):
+        assert not ranges
+        if table_name in self.manifest["tables"]:
+            return self.manifest["tables"][table_name]["rows"]
+        return 0
+
+    def strings(self):
+        if self._strings is None:
+            self._strings = StoreStrings(self.path, self.manifest["strings"])
+        return self._strings
+
+    def get_strings(self):
+        return self.strings().as_dicts()
+
+    def build_indexes(self, tables):
+        """ there is nothing to build, the columns are already sorted by start"""
+        pass
+
+    def load_columns(self, table, source=None, ordered=True, batch_size=None):
+        """ return the rows of table as nvprof.columnar.Columns of memmaps, ordered by start"""
+        assert source is None
+        if table not in self._columns:
+            info = self.manifest["tables"].get(
+                table, {"rows": 0, "fields": {}})
+            fields = {f: _map(column_path(self.path, table, f), np.dtype(dtype), info["rows"])
+                      for f, dtype in info["fields"].items()}
+            self._columns[table] = columnar.Columns(fields, info["rows"])
+        return self._columns[table]
+
+    def rows(self, table_name, columns=['*']):
+        """ yield tuples of columns, which are ACTIVITY_DTYPE field names, for rows ordered by start"""
+        arr = self.load_columns(table_name)
+        for start in range(0, len(arr), self.batch_size):
+            chunk = arr[start:start+self.batch_size]
+            yield from zip(*[chunk[c].tolist() for c in columns])
+
+    def records(self, table_names, start_ts=None, end_ts=None):
+        """ yield records of the range table ordered by start
+
+        The store does not keep the domain or depth of ranges, they are None.
+        """
+        for table in table_names:
+            if table != "CUPTI_ACTIVITY_KIND_RANGE":
+                logger.error("unhandled table {}".format(table))
+                raise SystemExit(-1)
+        arr = self.filtered_columns(
+            "CUPTI_ACTIVITY_KIND_RANGE", spans=[(start_ts, end_ts)])
+        for start, end, name_id, pid, tid in zip(arr['start'].tolist(), arr['end'].tolist(), arr['name_id'].tolist(), arr['pid'].tolist(), arr['tid'].tolist()):
+            if tid == -1:
+                pid = None
+                tid = None
+            yield Range(start, end, name_id, None, None, pid, tid)
+
+    def range_intervals(self, range_names, first_n=None):
+        """ return sorted, disjoint (start, end) intervals covered by ranges with a name like range_names"""
+        ranges = self.load_columns("CUPTI_ACTIVITY_KIND_RANGE")
+        name_ids = np.array(
+            sorted(self.strings().ids_like(range_names)), dtype=np.int64)
+        selected = ranges[np.isin(ranges['name_id'], name_ids)]
+        if first_n:
+            selected = selected[:first_n]
+        return sweep.coalesce(zip(selected['start'].tolist(), selected['end'].tolist()))
+
+    def filtered_columns(self, table, intervals=None, spans=None, clip=False, window=None):
+        """ like nvprof.db.Db.filtered_columns"""
+        arr = self.load_columns(table)
+
+        # rows are sorted by start, so rows that start after a span are a suffix
+        for begin, end in spans or []:
+            if end is not None:
+                arr = arr[:np.searchsorted(arr['start'], end, side='right')]
+            if begin is not None:
+                arr = arr[arr['end'] >= begin]
+        if window is not None:
+            arr = arr[:np.searchsorted(arr['start'], window[1], side='right')]
+            arr = arr[arr['end'] >= window[0]]
+
+        intervals = Db._clip_intervals(intervals, spans, clip)
+        if intervals is not None:
+            arr = columnar.overlapping(arr, intervals, clip=clip)
+        if window is not None:
+            arr = columnar.overlapping(arr, [window], clip=True)
+        return arr
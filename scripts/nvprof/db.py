@@ -1,11 +1,19 @@
 """ Handle databases created by nvprof """
 
+import os
 import sqlite3
 import logging
-from nvprof.record import Device, Runtime, ConcurrentKernel, Comm, Range
+import urllib.parse
+from nvprof.record import Device, Runtime, ConcurrentKernel, Comm, Range, marker_thread
 from nvprof.sql import Select
+from nvprof.sidecar import Sidecar
+from nvprof.metadata import Metadata
+from nvprof.strings import Strings
+from nvprof import merge
+from nvprof import sweep
 import copy
 import sys
+from operator import itemgetter
 
 logger = logging.getLogger(__name__)
 
@@ -19,22 +27,53 @@ select Min(start) as start from CUPTI_ACTIVITY_KIND_RUNTIME
 """
 
 
+def open_db(filename, **kwargs):
+    """open an nvprof database, or a column store written by the convert command (see nvprof.columnstore)
+
+    kwargs are passed to Db or ColumnStore
+    """
+    if os.path.isdir(filename):
+        # numpy is only needed by column stores
+        from nvprof.columnstore import ColumnStore
+        return ColumnStore(filename, **kwargs)
+    return Db(filename, **kwargs)
+
+
 class Db(object):
-    def __init__(self, filename=None, read_only=True):
+    # False for an nvprof database, True for a nvprof.columnstore.ColumnStore
+    columnar = False
+
+    def __init__(self, filename=None, read_only=True, sidecar=False, batch_size=merge.DEFAULT_BATCH_SIZE):
+        # an abstraction over CUPTI markers that describe a time range that mirrors other CUPTI types.
+        # It is built on first use by range_table()
+        self._has_range_table = False
+        # loaded or computed on first use by metadata()
+        self._metadata = None
+        # created on first use by strings()
+        self._strings = None
+        # set before opening the database, so __del__ can read them even if that fails
+
         self.next_view_id = -1
+        # rows fetched at a time by each cursor when merging tables
+        self.batch_size = batch_size
+        # quoted, so that ?, #, and % in filename are part of the path and not of the URI
         if read_only:
             # read-only
-            uri_str = "file:"+filename+"?mode=ro"
-            self.conn = sqlite3.connect(uri_str, uri=True)
+            uri_str = "file:"+urllib.parse.quote(filename)+"?mode=ro"
         else:
-            self.conn = sqlite3.connect(filename)
+            uri_str = "file:"+urllib.parse.quote(filename)
+        self.conn = sqlite3.connect(uri_str, uri=True)
+
+        # optional writable companion database with cached derived data
+        if sidecar:
+            self.sidecar = Sidecar(self.conn, filename)
+        else:
+            self.sidecar = None
+
         self.version = self._get_version()
         if self.version != 11:
             logger.warn("Expecting version 11, Db may be unreliable")
 
-        # create an abstraction over CUPTI markers that describe a time range that mirrors other CUPTI types
-        self._create_range_table()
-
     def __del__(self):
         self._release_range_table()
 
@@ -42,24 +81,84 @@ class Db(object):
         self.next_view_id += 1
         return "view" + str(self.next_view_id)
 
-    def _create_range_table(self):
+    def range_table(self):
+        """return the name of the range table, building it if needed
+
+        The table has columns (start, end, name, domain, depth, processId, threadId).
+        If a sidecar is attached, the table is stored there and later runs reuse it.
+        """
+        if not self._has_range_table:
+            self._create_range_table()
+            self._has_range_table = True
+        return "CUPTI_ACTIVITY_KIND_RANGE"
+
+    def _require(self, table):
+        """ build table first if it is derived from other tables"""
+        if table == "CUPTI_ACTIVITY_KIND_RANGE":
+            self.range_table()
+
+    def _range_rows(self):
+        """return (start, end, name, domain, depth, processId, threadId) for each pair of markers, ordered by start"""
         sql = """
-CREATE TEMPORARY TABLE CUPTI_ACTIVITY_KIND_RANGE AS
-WITH rows AS (
-    SELECT start, end, name, domain from (
+SELECT start, end, name, domain, object_id from (
     SELECT
     count(*) as num_markers,
     Min(timestamp) as start,
     Max(timestamp) as end,
     Max(name) as name,
-    domain
+    domain,
+    Max(objectId) as object_id
     FROM CUPTI_ACTIVITY_KIND_MARKER group by id
-    ) where num_markers == 2
-) SELECT * FROM rows"""
-        self.execute(sql)
+) where num_markers == 2"""
+        ranges = []
+        for start, end, name, domain, object_id in self.execute(sql):
+            pid, tid = marker_thread(object_id)
+            ranges += [(start, end, name, domain, pid, tid)]
+
+        # walk each thread's ranges outermost-first, keeping a stack of the ends of enclosing ranges
+        ranges.sort(key=lambda r: (r[4] is None, r[4] or 0, r[5] or 0, r[0], -r[1]))
+        rows = []
+        thread = None
+        stack = []
+        for start, end, name, domain, pid, tid in ranges:
+            if (pid, tid) != thread:
+                thread = (pid, tid)
+                stack = []
+            while stack and stack[-1] < end:
+                stack.pop()
+            rows += [(start, end, name, domain, len(stack), pid, tid)]
+            stack += [end]
+        rows.sort(key=itemgetter(0))
+        return rows
+
+    def _fill_range_table(self, table):
+        self.execute("""CREATE TABLE {} (
+  start INTEGER,
+  end INTEGER,
+  name INTEGER,
+  domain INTEGER,
+  depth INTEGER,
+  processId INTEGER,
+  threadId INTEGER
+)""".format(table))
+        self.conn.executemany(
+            "INSERT INTO {} VALUES (?, ?, ?, ?, ?, ?, ?)".format(table), self._range_rows())
+
+    def _create_range_table(self):
+        if self.sidecar:
+            ranges = self.sidecar.range_table(self._fill_range_table)
+            self.execute(
+                "CREATE TEMP VIEW CUPTI_ACTIVITY_KIND_RANGE AS SELECT * FROM {}".format(ranges))
+        else:
+            self._fill_range_table("temp.CUPTI_ACTIVITY_KIND_RANGE")
 
     def _release_range_table(self):
-        sql = "DROP TABLE CUPTI_ACTIVITY_KIND_RANGE"
+        if not self._has_range_table:
+            return
+        if self.sidecar:
+            sql = "DROP VIEW CUPTI_ACTIVITY_KIND_RANGE"
+        else:
+            sql = "DROP TABLE CUPTI_ACTIVITY_KIND_RANGE"
         self.execute(sql)
 
     def get_cursor(self):
@@ -68,37 +167,26 @@ WITH rows AS (
     def _get_version(self):
         return self.conn.execute(str(Select("Version"))).fetchone()[0]
 
+    def metadata(self):
+        """return the Metadata of the trace
+
+        If a sidecar is attached, the metadata is read from it, or computed
+        once and stored there.
+        """
+        if self._metadata is None:
+            cached = self.sidecar.get_metadata() if self.sidecar else None
+            if cached:
+                self._metadata = Metadata.from_json(cached)
+            else:
+                logger.debug("computing trace metadata")
+                self._metadata = Metadata.compute(self.conn)
+                if self.sidecar:
+                    self.sidecar.put_metadata(self._metadata.to_json())
+        return self._metadata
+
     def get_extent(self):
         """return (first, last) timestamp"""
-        first = float('Inf')
-        last = -1
-
-        start_end_tables = [
-            "CUPTI_ACTIVITY_KIND_RUNTIME",
-            "CUPTI_ACTIVITY_KIND_DRIVER",
-            "CUPTI_ACTIVITY_KIND_CONCURRENT_KERNEL",
-            "CUPTI_ACTIVITY_KIND_MEMCPY",
-            "CUPTI_ACTIVITY_KIND_MEMCPY2",
-            "CUPTI_ACTIVITY_KIND_KERNEL",
-            'CUPTI_ACTIVITY_KIND_RANGE',
-        ]
-        timestamp_tables = [
-            'CUPTI_ACTIVITY_KIND_MARKER'
-        ]
-
-        sql = "SELECT Min(start), Max(end) FROM ("
-        for i, t in enumerate(start_end_tables):
-            if i > 0:
-                sql += "UNION ALL "
-            sql += 'SELECT start, end FROM {}\n'.format(t)
-        for t in timestamp_tables:
-            sql += "UNION ALL SELECT timestamp, timestamp FROM {}\n".format(t)
-        sql += ")"
-        row = self.execute(sql).fetchone()
-        if row:
-            return row
-        else:
-            return (None, None)
+        return self.metadata().extent()
 
     def _range_filter_string(ranges):
         if not ranges:
@@ -121,28 +209,37 @@ WITH rows AS (
                 filter_str += ")"
         return filter_str
 
-    def get_strings(self):
-        return self.read_strings()
+    def strings(self):
+        """return the nvprof.strings.Strings of this database, which reads StringTable lazily"""
+        if self._strings is None:
+            self._strings = Strings(self.conn)
+        return self._strings
 
-    def read_strings(self):
-        """ read StringTable from an nvprof db"""
-        cursor = self.conn.cursor()
-        id_to_string = {}
-        string_to_id = {}
-        cmd = Select("StringTable")
-        for row in cursor.execute(str(cmd)):
-            id_, s = row
-            id_to_string[id_] = s
-            assert s not in string_to_id
-            string_to_id[s] = id_
-        return id_to_string, string_to_id
+    def get_strings(self):
+        """return (id_to_string, string_to_id) for the whole StringTable"""
+        return self.strings().as_dicts()
 
     def rows(self, table_name, columns=['*']):
+        self._require(table_name)
         col_str = ",".join(columns)
         return self.conn.execute("SELECT {} from {}".format(col_str, table_name))
 
     def multi_rows(self, table_names, start_ts=None, end_ts=None):
-        return MultiTableRows(self, table_names, start_ts=start_ts, end_ts=end_ts)
+        return MultiTableRows(self, table_names, start_ts=start_ts, end_ts=end_ts, batch_size=self.batch_size)
+
+    def load_columns(self, table, source=None, ordered=True, batch_size=None):
+        """ load the rows of TABLE, or SOURCE (a view with the columns of TABLE), into a NumPy structured array
+
+        see nvprof.columnar.ACTIVITY_DTYPE for the fields
+        """
+        # numpy is only needed by the columnar APIs
+        from nvprof import columnar
+        self._require(table)
+        return columnar.load(self.conn, table, source=source, ordered=ordered, batch_size=batch_size or self.batch_size)
+
+    def load_activities(self, table_names, ordered=True):
+        """ return {table: structured array} for each table in table_names"""
+        return {table: self.load_columns(table, ordered=ordered) for table in table_names}
 
     def execute(self, s):
         s = str(s)
@@ -150,7 +247,19 @@ WITH rows AS (
         cursor = self.conn.cursor()
         return cursor.execute(s)
 
+    def _indexed(self, table):
+        """ return True if the sidecar is attached and can index table"""
+        return self.sidecar is not None and self.sidecar.indexes(table)
+
     def num_rows(self, table_name, ranges=None):
+        if not ranges:
+            num_rows = self.metadata().num_rows(table_name)
+            if num_rows is not None:
+                return num_rows
+        self._require(table_name)
+        if self._indexed(table_name):
+            # only read the (start, end, id) copy of the table
+            table_name = self.sidecar.start_table(table_name)
         cmd = "SELECT Count(*) from {}".format(table_name)
         cmd += Db._range_filter_string(ranges)
         logger.debug("executing SQL: {}".format(cmd))
@@ -160,11 +269,8 @@ WITH rows AS (
         """return the number of edges contained within [r] for r in ranges"""
 
     def get_devices(self):
-        # look for unique devices in CUPTI_ACTIVITY_KIND_DEVICE
-        devices = []
-        for row in self.conn.execute("SELECT * FROM CUPTI_ACTIVITY_KIND_DEVICE"):
-            devices += [Device(id_=row[26])]
-        return devices
+        # unique devices in CUPTI_ACTIVITY_KIND_DEVICE
+        return [Device(id_=id_) for id_ in self.metadata().devices]
 
     def commit(self):
         self.conn.commit()
@@ -184,12 +290,12 @@ WITH rows AS (
 
     def records(self, table_names, start_ts=None, end_ts=None):
 
-        strings, _ = self.get_strings()
+        strings = self.strings()
 
-        for table, row, _, _ in MultiTableRows(self, table_names, start_ts, end_ts):
+        for table, row, _, _ in self.multi_rows(table_names, start_ts, end_ts):
             if table in table_names:
                 if table == "CUPTI_ACTIVITY_KIND_RUNTIME":
-                    yield Runtime.from_nvprof_row(row)
+                    yield Runtime.from_nvprof_row(row, strings)
                 elif table == "CUPTI_ACTIVITY_KIND_CONCURRENT_KERNEL":
                     yield ConcurrentKernel.from_nvprof_row(row, strings)
                 elif table == "CUPTI_ACTIVITY_KIND_RANGE":
@@ -210,15 +316,14 @@ WITH rows AS (
     def ranges_with_name(self, range_names, first_n=None):
         assert len(range_names) > 0
         view_name = self.get_unique_name()
+        ranges = self.range_table()
+        # match the names against StringTable once, then select ranges by id.
+        # With a sidecar, the range table has an index on name
+        name_ids = sorted(self.strings().ids_like(range_names))
         sql = """CREATE TEMP TABLE {} AS
-SELECT CUPTI_ACTIVITY_KIND_RANGE.*
-FROM
-CUPTI_ACTIVITY_KIND_RANGE
-INNER JOIN StringTable on CUPTI_ACTIVITY_KIND_RANGE.name = StringTable._id_
-WHERE StringTable.value like '%{}%'""".format(view_name, range_names[0])
-        for name in range_names[1:]:
-            sql += "\n  or StringTable.value like '%{}%'".format(name)
-        sql += "\nORDER BY CUPTI_ACTIVITY_KIND_RANGE.start"
+SELECT * FROM {}
+WHERE name IN ({})
+ORDER BY start""".format(view_name, ranges, ",".join(str(i) for i in name_ids))
         if first_n:
             sql += "\nLIMIT {}".format(first_n)
         self.execute(sql)
@@ -308,6 +413,16 @@ order by ts""".format(new_view, rows_view)
     def rows_overlap_spans(self, table, spans):
         """ create a view where rows are only present if they overlap some spans"""
         out_view = self.get_unique_name()
+        if self._indexed(table):
+            # find the overlapping ids in the sidecar, then fetch the rows by _id_
+            predicates = Db._span_predicates(spans, "s") or ["1"]
+            sql = """CREATE TEMP VIEW {0} AS
+SELECT t.* FROM {1} AS s
+CROSS JOIN main.{2} AS t ON t._id_ = s.id
+WHERE {3}""".format(out_view, self.sidecar.start_table(table), table, "\n  AND ".join(predicates))
+            self.execute(sql)
+            return out_view
+
         sql = """CREATE TEMP VIEW {0} AS
 SELECT * FROM {1} WHERE""".format(out_view, table)
 
@@ -337,6 +452,7 @@ SELECT * FROM {1} WHERE""".format(out_view, table)
         return out_view
 
     def create_filtered_table(self, table, range_names=None, first_n_ranges=None, spans=None):
+        self._require(table)
         filtered_view = table
         if range_names:
             # create a view which has ranges with a name like range_names
@@ -351,6 +467,172 @@ SELECT * FROM {1} WHERE""".format(out_view, table)
 
         return filtered_view
 
+    def create_filtered_edges(self, table, range_names=None, first_n_ranges=None, spans=None):
+        """ create a view of the edges of rows in table that overlap the selected ranges and spans
+
+        If a sidecar is attached, the view reads pre-sorted edges from it, so
+        ordering the view by ts does not need to sort the whole table.
+        """
+        if not self._indexed(table):
+            filtered = self.create_filtered_table(
+                table, range_names=range_names, first_n_ranges=first_n_ranges, spans=spans)
+            return self.create_edges_view(filtered)
+
+        edges_table = self.sidecar.edges_table(table)
+
+        predicates = []
+        if range_names:
+            ranges_view = self.ranges_with_name(
+                range_names, first_n=first_n_ranges)
+            predicates += ["EXISTS (SELECT 1 FROM {0} WHERE {0}.start <= e.end AND {0}.end >= e.start)".format(
+                ranges_view)]
+        predicates += Db._span_predicates(spans, "e")
+
+        out_view = self.get_unique_name()
+        sql = """CREATE TEMP VIEW {0} AS
+SELECT e.ts as ts, e.edge as edge, t.* FROM {1} AS e
+CROSS JOIN main.{2} AS t ON t._id_ = e.id""".format(out_view, edges_table, table)
+        if predicates:
+            sql += "\nWHERE " + "\n  AND ".join(predicates)
+        self.execute(sql)
+        return out_view
+
+    def _span_predicates(spans, table):
+        """ SQL predicates that are true for rows of table that overlap all spans"""
+        predicates = []
+        for span in spans or []:
+            assert len(span) == 2
+            if span[0]:
+                predicates += ["{}.end >= {}".format(table, span[0])]
+            if span[1]:
+                predicates += ["{}.start <= {}".format(table, span[1])]
+        return predicates
+
+    def range_intervals(self, range_names, first_n=None):
+        """ return sorted, disjoint (start, end) intervals covered by ranges with a name like range_names"""
+        ranges_view = self.ranges_with_name(range_names, first_n=first_n)
+        return sweep.coalesce(self.execute("SELECT start, end FROM {}".format(ranges_view)))
+
+    def ordered_rows(self, table, spans=None):
+        """ return a cursor over the rows of table that overlap spans, ordered by start"""
+        self._require(table)
+        if self._indexed(table):
+            # the sidecar copy is already ordered by start
+            predicates = Db._span_predicates(spans, "s") or ["1"]
+            sql = """SELECT t.* FROM {} AS s
+CROSS JOIN main.{} AS t ON t._id_ = s.id
+WHERE {}
+ORDER BY s.start""".format(self.sidecar.start_table(table), table, " AND ".join(predicates))
+        else:
+            sql = "SELECT * FROM {}".format(table)
+            predicates = Db._span_predicates(spans, table)
+            if predicates:
+                sql += " WHERE " + " AND ".join(predicates)
+            sql += " ORDER BY start"
+        return self.execute(sql)
+
+    def correlated_activities(self, api_table, activity_table, columns=["*"]):
+        """ return a cursor over (api start, api end, processId, threadId, activity columns...)
+
+        There is one row for each activity in activity_table launched by a call
+        in api_table, matched by correlationId and ordered by the start of the call.
+        """
+        col_str = ",".join("a." + c for c in columns)
+        if self._indexed(api_table) and self._indexed(activity_table):
+            sql = """SELECT c.start, c.end, c.processId, c.threadId, {0}
+FROM {1} AS s
+CROSS JOIN main.{2} AS c ON c._id_ = s.id
+CROSS JOIN {3} AS k ON k.correlationId = c.correlationId
+CROSS JOIN main.{4} AS a ON a._id_ = k.id
+ORDER BY s.start""".format(col_str, self.sidecar.start_table(api_table), api_table,
+                           self.sidecar.correlation_table(activity_table), activity_table)
+        else:
+            sql = """SELECT c.start, c.end, c.processId, c.threadId, {0}
+FROM {1} AS c
+INNER JOIN {2} AS a ON a.correlationId = c.correlationId
+ORDER BY c.start""".format(col_str, api_table, activity_table)
+        return self.execute(sql)
+
+    def _clip_intervals(intervals, spans, clip):
+        """ the intervals to filter rows with, including spans if rows are clipped to them"""
+        if clip and spans:
+            span_intervals = sweep.span_intervals(spans)
+            if intervals is None:
+                return span_intervals
+            return sweep.intersect(intervals, span_intervals)
+        return intervals
+
+    def filtered_rows(self, table, intervals=None, spans=None, clip=False, window=None):
+        """ return (rows, start index, end index) for rows of table that overlap spans and intervals
+
+        rows are ordered by start. intervals are sorted, disjoint (start, end)
+        pairs (see range_intervals), or None to not filter by intervals. Rows
+        are matched against intervals in a single sweep. If clip, rows are
+        clipped to the intervals and spans, see nvprof.sweep.overlapping.
+
+        If window is a (start, end) pair, only the part of each selected row
+        inside the window is returned, so windows that only share their
+        boundaries never count the same time twice.
+        """
+        cursor = self.ordered_rows(table, spans=Db._window_spans(spans, window))
+        columns = [d[0] for d in cursor.description]
+        start_idx = columns.index("start")
+        end_idx = columns.index("end")
+
+        rows = cursor
+        intervals = Db._clip_intervals(intervals, spans, clip)
+        if intervals is not None:
+            rows = sweep.overlapping(
+                rows, intervals, start_idx, end_idx, clip=clip)
+        if window is not None:
+            rows = sweep.overlapping(
+                rows, [window], start_idx, end_idx, clip=True)
+        return rows, start_idx, end_idx
+
+    def filtered_edges(self, table, intervals=None, spans=None, clip=False, window=None):
+        """ return (ts, edge, *row) for rows of table that overlap spans and intervals, ordered by (ts, edge)
+
+        see filtered_rows
+        """
+        if intervals is None and not clip and window is None:
+            return self.ordered_edges(self.create_filtered_edges(table, spans=spans))
+        rows, start_idx, end_idx = self.filtered_rows(
+            table, intervals=intervals, spans=spans, clip=clip, window=window)
+        return sweep.edges(rows, start_idx, end_idx)
+
+    def filtered_columns(self, table, intervals=None, spans=None, clip=False, window=None):
+        """ like filtered_rows, but load the rows into a NumPy structured array (see load_columns)"""
+        from nvprof import columnar
+
+        source = None
+        sql_spans = Db._window_spans(spans, window)
+        if sql_spans:
+            source = self.rows_overlap_spans(table, sql_spans)
+        arr = self.load_columns(table, source=source, ordered=False)
+
+        intervals = Db._clip_intervals(intervals, spans, clip)
+        if intervals is not None:
+            arr = columnar.overlapping(arr, intervals, clip=clip)
+        if window is not None:
+            arr = columnar.overlapping(arr, [window], clip=True)
+        return arr
+
+    def _window_spans(spans, window):
+        """ spans that also select only rows that overlap window, which may be None"""
+        if window is None:
+            return spans
+        return list(spans or []) + [window]
+
+    def build_indexes(self, tables):
+        """ build the sidecar copies of tables that filtered rows are read from, if a sidecar is attached
+
+        Call this before other processes open the same sidecar, so they do not race to build them.
+        """
+        for table in tables:
+            if self._indexed(table):
+                self.sidecar.start_table(table)
+                self.sidecar.edges_table(table)
+
     def create_edges_view(self, view):
         out_view = self.get_unique_name()
         sql = """CREATE TEMP VIEW {0} AS
@@ -369,176 +651,80 @@ select {1}.end as ts, 0 as edge, * from {1}""".format(out_view, view)
         sql.result_columns = ["Count(*)"]
         return self.execute(sql).fetchone()[0]
 
-    def multi_edges(self, table_names, start_ts=None, end_ts=None):
-        edges = {}
-        next_edges = {}
-        for table in table_names:
-            edges[table] = self.edges(table, start_ts=start_ts, end_ts=end_ts)
-            next_edges[table] = edges[table].fetchone()
-
-        while True:
-            # clean up any tables that have no more rows
-            to_remove = []
-            for table, edge in next_edges.items():
-                if edge is None:
-                    to_remove += [table]
-            for table in to_remove:
-                logger.debug("no more rows in {}".format(table))
-                del(edges[table])
-                del(next_edges[table])
-
-            yield_edge = None
-            yield_table = None
-            for table, edge in next_edges.items():
-                if not yield_table:
-                    yield_edge = edge
-                    yield_table = table
-                else:
-                    if edge[0] < yield_edge[0]:
-                        yield_edge = edge
-                        yield_table = table
-            if not yield_table:
-                break
-
-            next_edges[yield_table] = edges[yield_table].fetchone()
-            yield yield_table, yield_edge
+    def multi_edges(self, table_names, start_ts=None, end_ts=None, batch_size=None):
+        """yield (table, edge) for edges in all tables, ordered by timestamp"""
+        sources = [(table, self.edges(table, start_ts=start_ts, end_ts=end_ts))
+                   for table in table_names]
+        yield from merge.merge(sources, batch_size=batch_size or self.batch_size)
 
-    def multi_ordered_edges_records(self, edge_tables, row_factories={}):
+    def multi_ordered_edges_records(self, edge_tables, row_factories={}, batch_size=None):
 
-        strings, _ = self.get_strings()
+        strings = self.strings()
 
-        for table, edge in self.multi_ordered_edges(edge_tables):
+        for table, edge in self.multi_ordered_edges(edge_tables, batch_size=batch_size):
             yield edge[0], edge[1], row_factories[table](edge[2:], strings)
 
-    def multi_ordered_edges(self, edge_tables):
-
-        edges = {}
-        next_edges = {}
-        for table in edge_tables:
-            edges[table] = self.ordered_edges(table)
-            next_edges[table] = edges[table].fetchone()
-
-        while True:
-            # clean up any tables that have no more rows
-            to_remove = []
-            for table, edge in next_edges.items():
-                if edge is None:
-                    to_remove += [table]
-            for table in to_remove:
-                logger.debug("no more rows in {}".format(table))
-                del(edges[table])
-                del(next_edges[table])
-
-            yield_edge = None
-            yield_table = None
-            for table, edge in next_edges.items():
-                if not yield_table:
-                    yield_edge = edge
-                    yield_table = table
-                else:
-                    if edge[0] < yield_edge[0]:
-                        yield_edge = edge
-                        yield_table = table
-            if not yield_table:
-                break
+    def multi_ordered_edges(self, edge_tables, batch_size=None):
+        """yield (table, edge) for edges in all edge_tables, ordered by timestamp
 
-            next_edges[yield_table] = edges[yield_table].fetchone()
-            yield yield_table, yield_edge
+        edge_tables is a list of edge view names, or a dict of {tag: edges}
+        where edges are already ordered by (ts, edge) (see filtered_edges).
+        At the same timestamp, falling edges come before rising edges.
+        """
+        if isinstance(edge_tables, dict):
+            sources = list(edge_tables.items())
+        else:
+            sources = [(table, self.ordered_edges(table))
+                       for table in edge_tables]
+        yield from merge.merge(sources, key=itemgetter(0, 1), batch_size=batch_size or self.batch_size)
 
     def ordered_edges(self, edge_table):
-        return self.execute('SELECT * FROM {} ORDER BY ts'.format(edge_table))
+        return self.execute('SELECT * FROM {} ORDER BY ts, edge'.format(edge_table))
 
 
 class MultiTableRows(object):
-    def __init__(self, db, tables, start_ts=None, end_ts=None):
-        self.cursors = {}
-        self.next_rows = {}
+    """iterate over (table, row, start, end) for rows in multiple tables, ordered by start"""
+
+    def __init__(self, db, tables, start_ts=None, end_ts=None, batch_size=merge.DEFAULT_BATCH_SIZE):
         self.current_ts = 0
+        sources = []
         for table in tables:
+            db._require(table)
             cursor = db.get_cursor()
-            sql_cmd = "SELECT start,end,* FROM {}".format(table)
+            if db._indexed(table):
+                # walk the sidecar copy in start order and fetch rows by _id_
+                sql_cmd = "SELECT t.start,t.end,t.* FROM {} AS s CROSS JOIN main.{} AS t ON t._id_ = s.id".format(
+                    db.sidecar.start_table(table), table)
+                prefix = "s."
+            else:
+                sql_cmd = "SELECT start,end,* FROM {}".format(table)
+                prefix = ""
             if start_ts or end_ts:
                 sql_cmd += " where"
             if start_ts:
-                sql_cmd += " end >= {}".format(start_ts)
+                sql_cmd += " {}end >= {}".format(prefix, start_ts)
             if start_ts and end_ts:
                 sql_cmd += " and"
             if end_ts:
-                sql_cmd += " start <= {}".format(end_ts)
-            sql_cmd += " ORDER BY start"
+                sql_cmd += " {}start <= {}".format(prefix, end_ts)
+            sql_cmd += " ORDER BY {}start".format(prefix)
             logger.debug("executing {}".format(sql_cmd))
-            # read the first row
             cursor.execute(sql_cmd)
-            next_row = cursor.fetchone()
-            # if there is a row, keep this cursor
-            if next_row is not None:
-                self.cursors[table] = cursor
-                self.next_rows[table] = next_row
-        for table in self.next_rows:
-            row = self.next_rows[table]
-            if not self.current_ts:
-                self.current_ts = row[0]
-            self.current_ts = min(self.current_ts, row[0])
+            sources += [(table, cursor)]
+        self.merged = merge.merge(sources, batch_size=batch_size)
 
     def __iter__(self):
         return self
 
-    def get_next_row(self, ts):
-        """return table, row, start, and end that comes before or at ts"""
-        next_table = None
-        next_row = None
-
-        # to_remove = []
-        # for table in self.next_rows:
-        #     if self.next_rows[table] is None:
-        #         to_remove += [table]
-        # for table in to_remove:
-        #     del(self.next_rows[table])
-
-        # search all tables for the soonest timestamp
-        for table in self.next_rows:
-            row = self.next_rows[table]
-
-            if not next_table:
-                next_table = table
-                next_row = row
-
-            # expect to get rows in ascending order of start time
-            assert row[0] >= self.current_ts
-
-            if row[0] < next_row[0]:
-                # print(table, "is later at", end)
-                next_table = table
-                next_row = row
-
-        # if we found a next row, read the future next_row from the db
-        # if there is no future next row, discard the table
-        if next_table is not None:
-            future_row = self.cursors[next_table].fetchone()
-            if future_row is not None:
-                self.next_rows[next_table] = future_row
-            else:
-                del(self.next_rows[next_table])
-                del(self.cursors[next_table])
-
-        # table, the actual row, start, and end
-        if next_table:
-            return next_table, next_row[2:], next_row[0], next_row[1]
-        else:
-            return None, None, None, None
-
     def __next__(self):
         # get the table and row for the next time stamp
-        table, row, start, end = self.get_next_row(self.current_ts)
-        if not table:
-            raise StopIteration
-
-        # print(table, row, ts, self.current_ts)
-        assert start >= self.current_ts
+        table, row = next(self.merged)
+        start = row[0]
 
-        # update the current timestamp
+        # expect to get rows in ascending order of start time
         assert start is not None
+        assert start >= self.current_ts
         self.current_ts = start
 
-        # return the table that produced the row, and the row
-        return table, row, start, end
+        # return the table that produced the row, the row, start, and end
+        return table, row[2:], row[0], row[1]
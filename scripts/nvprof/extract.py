@@ -0,0 +1,267 @@
+""" Extract the selected records of an nvprof database into a new nvprof database """
+
+import logging
+import os
+import re
+import struct
+import urllib.parse
+
+logger = logging.getLogger(__name__)
+
+# the schema the output database is attached to the input connection as
+SCHEMA = "extract"
+
+# the table of a clipped extract that lists the clipped records by table and rowid,
+# so the nvprof tables keep their schema
+CLIPPED_TABLE = "openvprof_clipped"
+
+# tables whose name column is the kernel name
+KERNEL_TABLES = [
+    "CUPTI_ACTIVITY_KIND_CONCURRENT_KERNEL",
+    "CUPTI_ACTIVITY_KIND_KERNEL",
+    "CUPTI_ACTIVITY_KIND_CDP_KERNEL",
+]
+
+
+class Selection(object):
+    """ the records to extract
+
+    begin and end are timestamps, or None. intervals are sorted, disjoint
+    (start, end) pairs (see nvprof.db.Db.range_intervals), or None to not
+    select by ranges. Records are selected if they overlap (begin, end) and
+    any interval. devices, pids, and tids (unsigned, like
+    nvprof.record.Runtime.tid) select the records of tables that have those
+    columns, and kernel_ids the StringTable ids of kernel names to keep, or
+    None for all kernels. Empty sequences do not select anything.
+
+    If clip, records that cross begin or end are clipped to them, and listed
+    in CLIPPED_TABLE.
+    """
+
+    def __init__(self, begin=None, end=None, intervals=None, devices=(), pids=(), tids=(), kernel_ids=None, clip=False):
+        self.begin = begin
+        self.end = end
+        self.clip = clip
+        self.intervals = intervals
+        self.devices = list(devices)
+        self.pids = list(pids)
+        self.tids = list(tids)
+        self.kernel_ids = kernel_ids
+
+
+def _qualified(create_sql, kind):
+    """return a CREATE TABLE or CREATE INDEX statement from sqlite_master that creates its object in SCHEMA"""
+    pattern = r"^\s*(CREATE\s+(?:UNIQUE\s+)?{}\s+(?:IF\s+NOT\s+EXISTS\s+)?)".format(kind)
+    sql, n = re.subn(pattern, r"\1{}.".format(SCHEMA), create_sql,
+                     count=1, flags=re.IGNORECASE)
+    assert n == 1, create_sql
+    return sql
+
+
+def _in(expr, values):
+    return "{} IN ({})".format(expr, ",".join(str(v) for v in values))
+
+
+def _signed(tids):
+    """tids as they may be stored in threadId, which nvprof writes signed"""
+    return sorted({tid - 2**32 if tid >= 2**31 else tid for tid in tids} | set(tids))
+
+
+def _u32_hex(values):
+    """the SQL hex() of each value as a little-endian 32-bit blob, like the halves of a MARKER objectId"""
+    return ["'{}'".format(struct.pack("<I", v % 2**32).hex().upper()) for v in values]
+
+
+def table_columns(db, table):
+    """return the set of column names of table in the main database of db"""
+    return {row[1] for row in db.execute("PRAGMA main.table_info({})".format(table))}
+
+
+def time_predicates(selection, start, end, intervals_table):
+    """SQL predicates that are true if the record from start to end (SQL expressions) overlaps the selected time
+
+    A record that takes no time at begin is selected, and one at end is not,
+    so a record on the boundary of adjacent selections is in exactly one.
+    intervals_table holds selection.intervals keyed by start. The intervals
+    are disjoint, so only the last one that starts before the record ends
+    can overlap it, and it is found with one index lookup.
+    """
+    predicates = []
+    if selection.begin is not None:
+        predicates += ["({0} > {1} OR {2} >= {1})".format(end, selection.begin, start)]
+    if selection.end is not None:
+        predicates += ["{} < {}".format(start, selection.end)]
+    if selection.intervals is not None:
+        predicates += ["(SELECT i.end FROM {} AS i WHERE i.start < {} ORDER BY i.start DESC LIMIT 1) > {}".format(
+            intervals_table, end, start)]
+    return predicates
+
+
+def row_predicates(db, table, columns, selection, intervals_table):
+    """return SQL predicates on t, a row of table, that are true for rows that should be extracted
+
+    Rows with start and end are kept if they overlap the selected time. With
+    a sidecar, they are found with its index on start instead of a scan.
+    Markers are kept in pairs, if the range they delimit overlaps the selected
+    time and thread, so that every range in the output still has its start and end.
+    Tables without timestamps (strings, devices, ...) are copied, except
+    that only the selected devices are kept.
+    """
+    predicates = []
+    if {"start", "end"} <= columns:
+        if "_id_" in columns and db._indexed(table):
+            by_start = time_predicates(selection, "s.start", "s.end", intervals_table)
+            if by_start:
+                predicates += ["t._id_ IN (SELECT s.id FROM {} AS s WHERE {})".format(
+                    db.sidecar.start_table(table), " AND ".join(by_start))]
+        else:
+            predicates += time_predicates(selection,
+                                          "t.start", "t.end", intervals_table)
+    elif "timestamp" in columns and "id" in columns:
+        pair = time_predicates(selection, "m.start", "m.end", intervals_table)
+        if "objectId" in columns:
+            if selection.pids:
+                pair += [_in("hex(substr(m.object_id, 1, 4))", _u32_hex(selection.pids))]
+            if selection.tids:
+                pair += [_in("hex(substr(m.object_id, 5, 4))", _u32_hex(selection.tids))]
+        if pair:
+            predicates += ["""t.id IN (SELECT m.id FROM (
+    SELECT id, Min(timestamp) AS start, Max(timestamp) AS end, Max(objectId) AS object_id
+    FROM main.{} GROUP BY id
+  ) AS m WHERE {})""".format(table, " AND ".join(pair))]
+    elif "timestamp" in columns:
+        predicates += time_predicates(selection, "t.timestamp",
+                                      "t.timestamp", intervals_table)
+
+    if selection.devices:
+        if "deviceId" in columns:
+            predicates += [_in("t.deviceId", selection.devices)]
+        elif table == "CUPTI_ACTIVITY_KIND_DEVICE":
+            predicates += [_in("t.id", selection.devices)]
+    if selection.pids and "processId" in columns:
+        predicates += [_in("t.processId", selection.pids)]
+    if selection.tids and "threadId" in columns:
+        predicates += [_in("t.threadId", _signed(selection.tids))]
+    if selection.kernel_ids is not None and table in KERNEL_TABLES:
+        predicates += [_in("t.name", sorted(selection.kernel_ids))]
+    return predicates
+
+
+def _bounded(expr, begin, end):
+    """SQL for expr limited to begin and end, which may be None"""
+    if begin is not None:
+        expr = "Max({}, {})".format(expr, begin)
+    if end is not None:
+        expr = "Min({}, {})".format(expr, end)
+    return expr
+
+
+def clip_rows(db, table, columns, selection):
+    """clip the rows of table in the output to selection.begin and selection.end, and list them in CLIPPED_TABLE
+
+    Markers are clipped in pairs, like they are selected.
+    """
+    begin, end = selection.begin, selection.end
+    if {"start", "end"} <= columns:
+        crossing = []
+        if begin is not None:
+            crossing += ["start < {}".format(begin)]
+        if end is not None:
+            crossing += ["end > {}".format(end)]
+        updates = ["start = " + _bounded("start", begin, end),
+                   "end = " + _bounded("end", begin, end)]
+    elif "timestamp" in columns and "id" in columns:
+        bounds = []
+        if begin is not None:
+            bounds += ["Min(timestamp) < {}".format(begin)]
+        if end is not None:
+            bounds += ["Max(timestamp) > {}".format(end)]
+        crossing = ["id IN (SELECT id FROM {}.{} GROUP BY id HAVING {})".format(
+            SCHEMA, table, " OR ".join(bounds))]
+        updates = ["timestamp = " + _bounded("timestamp", begin, end)]
+    else:
+        return
+
+    db.execute("INSERT INTO {0}.{1} SELECT '{2}', rowid FROM {0}.{2} WHERE {3}".format(
+        SCHEMA, CLIPPED_TABLE, table, " OR ".join(crossing)))
+    cursor = db.execute("UPDATE {}.{} SET {} WHERE {}".format(
+        SCHEMA, table, ", ".join(updates), " OR ".join(crossing)))
+    logger.debug("clipped {} rows of {}".format(cursor.rowcount, table))
+
+
+def prepare(db):
+    """build the sidecar tables that extract reads, if db has a sidecar
+
+    Call this before extracting from the same db in several processes, so
+    they do not race to build them.
+    """
+    for table, in db.execute("SELECT name FROM main.sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'").fetchall():
+        if db._indexed(table):
+            db.sidecar.start_table(table)
+
+
+def extract(db, output, selection):
+    """write the records of db (an nvprof.db.Db) picked by selection (a Selection) to a new nvprof database at output
+
+    The schema and the rows of tables without timestamps are copied as-is, so
+    the output can be opened like any other nvprof database. Rows are copied
+    with INSERT ... SELECT on a single connection, so the input is read once
+    and every criterion is applied in the same pass.
+    """
+    if os.path.exists(output):
+        os.remove(output)
+
+    tables = db.execute(
+        "SELECT name, sql FROM main.sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'").fetchall()
+    indexes = db.execute(
+        "SELECT name, sql FROM main.sqlite_master WHERE type='index' AND sql IS NOT NULL").fetchall()
+
+    intervals_table = None
+    if selection.intervals is not None:
+        intervals_table = "temp." + db.get_unique_name()
+        db.execute("CREATE TABLE {} (start INTEGER PRIMARY KEY, end INTEGER)".format(
+            intervals_table))
+        db.conn.executemany("INSERT INTO {} VALUES (?, ?)".format(
+            intervals_table), selection.intervals)
+        db.commit()
+
+    # output is quoted, so that ?, #, and % in it are part of the path and not of the URI
+    db.conn.execute("ATTACH DATABASE ? AS {}".format(SCHEMA), ("file:" + urllib.parse.quote(output) + "?mode=rwc",))
+    # the output is rewritten from scratch if anything goes wrong
+    db.execute("PRAGMA {}.journal_mode = OFF".format(SCHEMA))
+    db.execute("PRAGMA {}.synchronous = OFF".format(SCHEMA))
+
+    for table, create_sql in tables:
+        db.execute(_qualified(create_sql, "TABLE"))
+
+    for table, _ in tables:
+        predicates = row_predicates(db, table, table_columns(db, table),
+                                    selection, intervals_table)
+        sql = "INSERT INTO {0}.{1} SELECT t.* FROM main.{1} AS t".format(
+            SCHEMA, table)
+        if predicates:
+            sql += "\nWHERE " + "\n  AND ".join(predicates)
+        cursor = db.execute(sql)
+        logger.debug("extracted {} rows from {}".format(cursor.rowcount, table))
+
+    if selection.clip and (selection.begin is not None or selection.end is not None):
+        db.execute("CREATE TABLE IF NOT EXISTS {}.{} (table_name TEXT NOT NULL, row_id INTEGER NOT NULL)".format(
+            SCHEMA, CLIPPED_TABLE))
+        for table, _ in tables:
+            clip_rows(db, table, table_columns(db, table), selection)
+
+    # keep AUTOINCREMENT counters, so ids in the output match the input.
+    # The copies above already added counters of the rows they inserted, so replace those
+    if db.execute("SELECT 1 FROM main.sqlite_master WHERE name='sqlite_sequence'").fetchone():
+        db.execute("DELETE FROM {}.sqlite_sequence".format(SCHEMA))
+        db.execute(
+            "INSERT INTO {0}.sqlite_sequence SELECT * FROM main.sqlite_sequence".format(SCHEMA))
+
+    # indexes are built after the rows are inserted, which is faster than updating them row by row
+    for _, create_sql in indexes:
+        db.execute(_qualified(create_sql, "INDEX"))
+
+    db.commit()
+    db.execute("DETACH DATABASE {}".format(SCHEMA))
+    if intervals_table:
+        db.execute("DROP TABLE {}".format(intervals_table))
@@ -0,0 +1,137 @@
+""" Log-linear (HDR-style) histograms of durations, filled a NumPy array at a time """
+
+import numpy as np
+
+from nvprof import merge
+
+# each power of two is split into 2**SUB_BUCKET_BITS buckets of equal width,
+# so a value is off by less than 1 / 2**SUB_BUCKET_BITS (3%) of itself
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+# the percentiles reported by Histogram.percentiles
+PERCENTILES = [50, 90, 99, 99.9]
+
+
+def bucket_of(values):
+    """the buckets of values, an array of non-negative integers below 2**53
+
+    Values below SUB_BUCKETS have a bucket each. Above that, a value with
+    bit length e goes into one of the SUB_BUCKETS buckets of [2**(e-1), 2**e)
+    by its leading SUB_BUCKET_BITS + 1 bits.
+    """
+    values = np.asarray(values, dtype=np.int64)
+    # frexp is exact for integers below 2**53, and its exponent is the bit length
+    _, bit_length = np.frexp(values.astype(np.float64))
+    shift = np.maximum(bit_length.astype(np.int64) - 1 - SUB_BUCKET_BITS, 0)
+    return np.where(values < SUB_BUCKETS, values,
+                    ((shift + 1) << SUB_BUCKET_BITS) + (values >> shift) - SUB_BUCKETS)
+
+
+def bucket_bounds(buckets):
+    """the (lowest, highest) values that go into each of buckets, an array"""
+    buckets = np.asarray(buckets, dtype=np.int64)
+    shift = np.maximum((buckets >> SUB_BUCKET_BITS) - 1, 0)
+    lowest = np.where(buckets < SUB_BUCKETS, buckets,
+                      (SUB_BUCKETS + (buckets & (SUB_BUCKETS - 1))) << shift)
+    return lowest, lowest + (1 << shift) - 1
+
+
+class Histogram(object):
+    """ a count of non-negative integer values (ns) per log-linear bucket, and their exact min, max, and count
+
+    Histograms are filled with add(), an array of values at a time, and
+    histograms of shards or files are combined with merge(). They only keep
+    the counts of buckets up to the largest value, a few hundred for any
+    duration, however many values are added.
+    """
+
+    def __init__(self):
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def _grow(self, size):
+        if size > len(self.counts):
+            self.counts = np.concatenate(
+                [self.counts, np.zeros(size - len(self.counts), dtype=np.int64)])
+
+    def add(self, values):
+        """count each of values, negative values as 0"""
+        values = np.maximum(np.asarray(values, dtype=np.int64), 0)
+        if not len(values):
+            return
+        counts = np.bincount(bucket_of(values))
+        self._grow(len(counts))
+        self.counts[:len(counts)] += counts
+        self.count += len(values)
+        lo, hi = int(values.min()), int(values.max())
+        self.min = lo if self.min is None else min(self.min, lo)
+        self.max = hi if self.max is None else max(self.max, hi)
+
+    def merge(self, other):
+        """add the values counted by other to this histogram"""
+        if not other.count:
+            return
+        self._grow(len(other.counts))
+        self.counts[:len(other.counts)] += other.counts
+        self.count += other.count
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def percentile(self, q):
+        """the value that q percent of the values are at or below
+
+        The value is the middle of its bucket, limited to the exact min and max.
+        """
+        if not self.count:
+            return None
+        rank = max(int(np.ceil(q / 100 * self.count)), 1)
+        bucket = int(np.searchsorted(np.cumsum(self.counts), rank))
+        lowest, highest = bucket_bounds([bucket])
+        value = (int(lowest[0]) + int(highest[0])) // 2
+        return min(max(value, self.min), self.max)
+
+    def percentiles(self, qs=PERCENTILES):
+        """[(q, percentile(q))] for each of qs"""
+        return [(q, self.percentile(q)) for q in qs]
+
+    def powers_of_two(self):
+        """(counts, lower, upper): the number of values with each bit length, from 2^lower to 2^upper
+
+        counts[i] is the number of values in [2^(lower+i), 2^(lower+i+1)), with 0 in the first.
+        """
+        buckets = np.nonzero(self.counts)[0]
+        lowest, _ = bucket_bounds(buckets)
+        _, exponents = np.frexp(np.maximum(lowest, 1).astype(np.float64))
+        exponents = exponents.astype(np.int64) - 1
+        lower, upper = int(exponents.min()), int(exponents.max())
+        counts = np.bincount(exponents - lower, weights=self.counts[buckets],
+                             minlength=upper - lower + 1)
+        return counts.astype(np.int64).tolist(), lower, upper
+
+
+def durations(db, table):
+    """yield arrays of the end - start of the rows of table in db, an nvprof.db.Db or column store, a batch at a time
+
+    Only the duration is read from an nvprof database, so memory use is bounded by the batch size.
+    """
+    if not db.num_rows(table):
+        return
+    if db.columnar:
+        arr = db.load_columns(table)
+        for i in range(0, len(arr), db.batch_size):
+            yield arr['end'][i:i+db.batch_size] - arr['start'][i:i+db.batch_size]
+        return
+    cursor = db.execute("SELECT end - start FROM {}".format(table))
+    for batch in merge.batches(cursor, db.batch_size):
+        yield np.fromiter((row[0] for row in batch), dtype=np.int64, count=len(batch))
+
+
+def of_table(db, table):
+    """return a Histogram of the durations of the rows of table in db, filled in one pass"""
+    histo = Histogram()
+    for values in durations(db, table):
+        histo.add(values)
+    return histo
@@ -0,0 +1,76 @@
+""" k-way merge of sorted row sources """
+
+import heapq
+from itertools import islice
+from operator import itemgetter
+
+# how many rows to pull from each source at a time
+DEFAULT_BATCH_SIZE = 4096
+
+
+def batches(source, batch_size=DEFAULT_BATCH_SIZE):
+    """yield lists of up to batch_size rows from source, a sqlite3 cursor or any iterable"""
+    if hasattr(source, "fetchmany"):
+        while True:
+            batch = source.fetchmany(batch_size)
+            if not batch:
+                return
+            yield batch
+    else:
+        it = iter(source)
+        while True:
+            batch = list(islice(it, batch_size))
+            if not batch:
+                return
+            yield batch
+
+
+def merge(sources, key=itemgetter(0), batch_size=DEFAULT_BATCH_SIZE):
+    """yield (tag, row) for all rows in sources, in ascending order of key(row)
+
+    sources is a sequence of (tag, source) pairs, where each source is a
+    sqlite3 cursor or iterable that produces rows already ordered by key.
+    Rows are pulled from each source batch_size at a time, and a heap holds
+    the head of each source, so the cost per row is O(log(len(sources))).
+    Rows with equal keys come out in the order their sources were given,
+    and in source order within a single source.
+    """
+
+    # per-source [tag, batch iterator, current batch, position in batch]
+    states = []
+    heap = []
+    for i, (tag, source) in enumerate(sources):
+        source_batches = batches(source, batch_size)
+        batch = next(source_batches, None)
+        states.append([tag, source_batches, batch, 0])
+        if batch:
+            heap.append((key(batch[0]), i))
+    heapq.heapify(heap)
+
+    while len(heap) > 1:
+        _, i = heap[0]
+        state = states[i]
+        batch = state[2]
+        pos = state[3]
+        row = batch[pos]
+        pos += 1
+        if pos == len(batch):
+            batch = next(state[1], None)
+            state[2] = batch
+            pos = 0
+        state[3] = pos
+        if batch:
+            heapq.heapreplace(heap, (key(batch[pos]), i))
+        else:
+            heapq.heappop(heap)
+        yield state[0], row
+
+    # only one source is left, so there is nothing to compare against
+    if heap:
+        _, i = heap[0]
+        tag, source_batches, batch, pos = states[i]
+        while batch:
+            for row in batch[pos:]:
+                yield tag, row
+            batch = next(source_batches, None)
+            pos = 0
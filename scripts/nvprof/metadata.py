@@ -0,0 +1,110 @@
+""" Summary facts about an nvprof database that are cheap to keep and expensive to recompute """
+
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# tables with start and end columns
+START_END_TABLES = [
+    "CUPTI_ACTIVITY_KIND_RUNTIME",
+    "CUPTI_ACTIVITY_KIND_DRIVER",
+    "CUPTI_ACTIVITY_KIND_CONCURRENT_KERNEL",
+    "CUPTI_ACTIVITY_KIND_MEMCPY",
+    "CUPTI_ACTIVITY_KIND_MEMCPY2",
+    "CUPTI_ACTIVITY_KIND_KERNEL",
+]
+
+# tables with a single timestamp column
+TIMESTAMP_TABLES = [
+    "CUPTI_ACTIVITY_KIND_MARKER",
+]
+
+
+class Metadata(object):
+    """ extent, per-table row counts and timestamps, devices, threads, and string count of a trace
+
+    tables maps each table in START_END_TABLES and TIMESTAMP_TABLES that is
+    present in the trace to (row count, first timestamp, last timestamp).
+    tids are unsigned, like nvprof.record.Runtime.tid.
+    """
+
+    def __init__(self, tables=None, devices=None, pids=None, tids=None, num_strings=0):
+        self.tables = tables or {}
+        self.devices = devices or []  # device ids
+        self.pids = pids or set()  # process ids of runtime calls
+        self.tids = tids or set()  # thread ids of runtime calls
+        self.num_strings = num_strings
+
+    def compute(conn):
+        """scan the trace on conn once and return its Metadata"""
+        present = {row[0] for row in conn.execute(
+            "SELECT name FROM main.sqlite_master WHERE type='table'")}
+
+        tables = {}
+        for table in START_END_TABLES + TIMESTAMP_TABLES:
+            if table not in present:
+                continue
+            if table in TIMESTAMP_TABLES:
+                sql = "SELECT Count(*), Min(timestamp), Max(timestamp) FROM {}"
+            else:
+                sql = "SELECT Count(*), Min(start), Max(end) FROM {}"
+            sql = sql.format(table)
+            logger.debug("executing SQL: {}".format(sql))
+            tables[table] = tuple(conn.execute(sql).fetchone())
+
+        devices = []
+        if "CUPTI_ACTIVITY_KIND_DEVICE" in present:
+            for row in conn.execute("SELECT * FROM CUPTI_ACTIVITY_KIND_DEVICE"):
+                devices += [row[26]]
+
+        pids = set()
+        tids = set()
+        if "CUPTI_ACTIVITY_KIND_RUNTIME" in present:
+            for pid, tid in conn.execute("SELECT distinct processId, threadId from CUPTI_ACTIVITY_KIND_RUNTIME"):
+                if tid < 0:
+                    tid += 2**32
+                pids.add(pid)
+                tids.add(tid)
+
+        num_strings = 0
+        if "StringTable" in present:
+            num_strings = conn.execute(
+                "SELECT Count(*) FROM StringTable").fetchone()[0]
+
+        return Metadata(tables=tables, devices=devices, pids=pids, tids=tids, num_strings=num_strings)
+
+    def extent(self):
+        """return (first, last) timestamp over all tables, or (None, None) if there are no records"""
+        firsts = [t[1] for t in self.tables.values() if t[1] is not None]
+        lasts = [t[2] for t in self.tables.values() if t[2] is not None]
+        if not firsts:
+            return (None, None)
+        return (min(firsts), max(lasts))
+
+    def num_rows(self, table):
+        """return the number of rows in table, or None if the metadata does not cover it"""
+        if table in self.tables:
+            return self.tables[table][0]
+        if table in START_END_TABLES or table in TIMESTAMP_TABLES:
+            return 0
+        return None
+
+    def to_json(self):
+        return json.dumps({
+            "tables": self.tables,
+            "devices": self.devices,
+            "pids": sorted(self.pids),
+            "tids": sorted(self.tids),
+            "num_strings": self.num_strings,
+        })
+
+    def from_json(s):
+        d = json.loads(s)
+        return Metadata(
+            tables={k: tuple(v) for k, v in d["tables"].items()},
+            devices=d["devices"],
+            pids=set(d["pids"]),
+            tids=set(d["tids"]),
+            num_strings=d["num_strings"],
+        )
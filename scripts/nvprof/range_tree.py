@@ -0,0 +1,108 @@
+""" Rebuild the nesting of NVTX ranges on each thread into a tree of call paths """
+
+
+class Node(object):
+    """ a call path: a range name under the names of the ranges that enclose it
+
+    key is a StringTable id, a (pid, tid) thread for the root of a thread,
+    or None for the root of the tree. Times are in ns, summed over every
+    instance of the path. exclusive is the time not covered by child ranges.
+    kernel and memcpy are the GPU time of activities launched by runtime calls
+    made in the path but not in a child.
+    """
+    __slots__ = ("key", "children", "count", "inclusive", "exclusive", "kernel", "memcpy")
+
+    def __init__(self, key):
+        self.key = key
+        self.children = {}
+        self.count = 0
+        self.inclusive = 0
+        self.exclusive = 0
+        self.kernel = 0
+        self.memcpy = 0
+
+    def child(self, key):
+        """return the child for key, adding it if needed"""
+        node = self.children.get(key)
+        if node is None:
+            node = self.children[key] = Node(key)
+        return node
+
+    def total(self, field):
+        """the sum of field over this node and its descendants"""
+        return getattr(self, field) + sum(c.total(field) for c in self.children.values())
+
+    def walk(self, path=()):
+        """yield (path, node) for the descendants of this node depth-first, longest inclusive time first
+
+        path is the keys from below this node to the descendant.
+        """
+        for node in sorted(self.children.values(), key=lambda n: -n.inclusive):
+            yield path + (node.key,), node
+            yield from node.walk(path + (node.key,))
+
+
+class Builder(object):
+    """ build a tree of Nodes from ranges and GPU activities in a single pass in time order
+
+    range() and launch() must be called in order of their start, and ranges
+    that start at the same time longest first, so a range is pushed before
+    the ranges it encloses. A range that starts at the same time as a longer
+    one that was added before it is its child. Each thread
+    keeps a stack of the ranges that are open on it, [end, node, time covered
+    by children, start], and a range is closed when a later range or launch
+    on its thread starts after it ends. A range that starts before its parent
+    ends but ends after it is still its child, and only the part inside the
+    parent is subtracted from the parent's exclusive time.
+
+    With by_thread, the paths of each thread are under a Node for the
+    thread, otherwise paths with the same names on different threads are merged.
+    """
+
+    def __init__(self, by_thread=False):
+        self.root = Node(None)
+        self.by_thread = by_thread
+        self.stacks = {}  # (pid, tid) -> stack of open ranges
+
+    def _close(self, frame):
+        end, node, covered, start = frame
+        node.exclusive += end - start - covered
+
+    def _stack(self, thread, ts):
+        """the stack of thread, without the ranges that end at or before ts"""
+        stack = self.stacks.get(thread)
+        if stack is None:
+            stack = self.stacks[thread] = []
+        while stack and stack[-1][0] <= ts:
+            self._close(stack.pop())
+        return stack
+
+    def _parent(self, thread, stack):
+        if stack:
+            return stack[-1][1]
+        if self.by_thread:
+            return self.root.child(thread)
+        return self.root
+
+    def range(self, start, end, name_id, thread):
+        """add a range on thread (pid, tid), (None, None) if it is not on a thread"""
+        stack = self._stack(thread, start)
+        if stack:
+            stack[-1][2] += min(end, stack[-1][0]) - start
+        node = self._parent(thread, stack).child(name_id)
+        node.count += 1
+        node.inclusive += end - start
+        stack += [[end, node, 0, start]]
+
+    def launch(self, ts, thread, field, duration):
+        """add duration (ns) of GPU time, field "kernel" or "memcpy", launched by a call on thread at ts"""
+        stack = self._stack(thread, ts)
+        node = self._parent(thread, stack)
+        setattr(node, field, getattr(node, field) + duration)
+
+    def close(self):
+        """close the ranges that are still open, and return the root Node"""
+        for stack in self.stacks.values():
+            while stack:
+                self._close(stack.pop())
+        return self.root
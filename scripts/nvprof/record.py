@@ -1,4 +1,5 @@
 from collections import namedtuple, defaultdict
+import struct
 from cupti import activity_memcpy_kind
 
 
@@ -43,6 +44,13 @@ RUNTIME_CBID_NAME = {
 }
 
 
+def runtime_cbid_name(cbid):
+    if cbid in RUNTIME_CBID_NAME:
+        return RUNTIME_CBID_NAME[cbid]
+    else:
+        return str(cbid)
+
+
 class Runtime(namedtuple('Runtime', ['cbid', 'start', 'end', 'pid', 'tid', 'correlation_id', 'return_value'])):
     __slots__ = ()
 
@@ -54,10 +62,7 @@ class Runtime(namedtuple('Runtime', ['cbid', 'start', 'end', 'pid', 'tid', 'corr
         return Runtime(*row[1:5], tid, *row[6:])
 
     def name(self):
-        if self.cbid in RUNTIME_CBID_NAME:
-            return RUNTIME_CBID_NAME[self.cbid]
-        else:
-            return str(self.cbid)
+        return runtime_cbid_name(self.cbid)
 
     def __str__(self):
         s = "Runtime::" + str(self.pid) + "::" + str(self.tid) + "::"
@@ -68,11 +73,12 @@ class Runtime(namedtuple('Runtime', ['cbid', 'start', 'end', 'pid', 'tid', 'corr
         return s
 
 
-class ConcurrentKernel(namedtuple('ConcurrentKernel', ['start', 'end', 'completed', 'device_id', 'name'])):
+class ConcurrentKernel(namedtuple('ConcurrentKernel', ['start', 'end', 'completed', 'device_id', 'name_id'])):
+    """name_id is a StringTable id, resolve it with strings[name_id]"""
     __slots__ = ()
 
     def from_nvprof_row(row, strings):
-        return ConcurrentKernel(*row[6:10], strings[row[24]])
+        return ConcurrentKernel(*row[6:10], row[24])
 
 
 class Comm(namedtuple('Comm', [
@@ -101,12 +107,9 @@ class Comm(namedtuple('Comm', [
         elif copy_kind == activity_memcpy_kind.HTOH:
             src_id = -1
             dst_id = -1
-        elif DTOD or PTOP:
+        else:  # DTOD, PTOP, and array copies stay on the device
             src_id = device_id
             dst_id = device_id
-        else:
-            logger.error("Unhandled copy_kind {}".format(copy_kind))
-            raise ValueError
 
         return Comm('memcpy', *row[2:4], *row[5:8], src_id, dst_id, 0, 0)
 
@@ -135,12 +138,32 @@ class Marker(namedtuple('Marker', ['timestamp', 'id_', 'name'])):
 # ) where num_markers == 2
 
 
-class Range(namedtuple('Range', ['start', 'end', 'name', 'domain'])):
-    """Represents a paired set of markers from nvprof"""
+def marker_thread(object_id):
+    """return (pid, tid) from a MARKER objectId blob, with tid signed like RUNTIME.threadId
+
+    returns (None, None) if the marker is not attached to a thread
+    """
+    if object_id is None or len(object_id) < 8:
+        return None, None
+    pid, tid = struct.unpack("<II", object_id[:8])
+    if tid >= 2**31:
+        tid -= 2**32
+    return pid, tid
+
+
+class Range(namedtuple('Range', ['start', 'end', 'name_id', 'domain_id', 'depth', 'pid', 'tid'])):
+    """Represents a paired set of markers from nvprof
+
+    name_id and domain_id are StringTable ids.
+    depth is the number of ranges on the same thread that enclose this one
+    """
     __slots__ = ()
 
     def from_nvprof_row(row, strings):
-        return Range(*row[0:2], strings[row[2]], strings[row[3]])
+        tid = row[6]
+        if tid is not None and tid < 0:
+            tid += 2**32
+        return Range(*row[0:6], tid)
 
 
 """
@@ -0,0 +1,211 @@
+""" A writable companion database that caches derived data for an nvprof database """
+
+import os
+import hashlib
+import logging
+import urllib.parse
+
+logger = logging.getLogger(__name__)
+
+# the sidecar for foo.nvprof is foo.nvprof.openvprof
+SUFFIX = ".openvprof"
+
+# bump this when the layout of the sidecar changes so old sidecars are rebuilt
+FORMAT_VERSION = 1
+
+# how much of the head and tail of the nvprof file to hash
+HASH_BYTES = 1024 * 1024
+
+
+def sidecar_path(filename):
+    return filename + SUFFIX
+
+
+def file_key(filename):
+    """return (size, mtime_ns, digest) that identifies the contents of FILENAME
+
+    The digest only covers the head and tail of the file, which is enough to
+    notice a different capture without reading a multi-GB file.
+    """
+    st = os.stat(filename)
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        h.update(f.read(HASH_BYTES))
+        if st.st_size > HASH_BYTES:
+            f.seek(max(HASH_BYTES, st.st_size - HASH_BYTES))
+            h.update(f.read(HASH_BYTES))
+    return st.st_size, st.st_mtime_ns, h.hexdigest()
+
+
+class Sidecar(object):
+    """ a database attached to a Db connection as SCHEMA
+
+    The nvprof database itself is opened read-only, so anything that must
+    persist across runs (pre-sorted edges, copies of hot columns that are
+    ordered or indexed by start, end, correlationId, or name, ...) is
+    written here instead.
+    The sidecar is keyed by the size, mtime, and hash of the nvprof file and
+    is discarded and rebuilt when the key does not match.
+    """
+
+    SCHEMA = "sidecar"
+
+    def __init__(self, conn, filename):
+        self.conn = conn
+        self.path = sidecar_path(filename)
+        self.key = file_key(filename)
+
+        self._attach()
+        if not self._is_valid():
+            logger.debug("sidecar {} is missing or stale, rebuilding".format(self.path))
+            self._detach()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self._attach()
+            self._initialize()
+
+    def _attach(self):
+        uri_str = "file:" + urllib.parse.quote(self.path) + "?mode=rwc"
+        self.conn.execute("ATTACH DATABASE ? AS {}".format(self.SCHEMA), (uri_str,))
+
+    def _detach(self):
+        self.conn.execute("DETACH DATABASE {}".format(self.SCHEMA))
+
+    def _is_valid(self):
+        if not self.has_table("openvprof_meta"):
+            return False
+        row = self.conn.execute(
+            "SELECT version, size, mtime_ns, digest FROM {}.openvprof_meta".format(self.SCHEMA)).fetchone()
+        if row is None:
+            return False
+        return row[0] == FORMAT_VERSION and tuple(row[1:]) == self.key
+
+    def _initialize(self):
+        self.conn.execute(
+            "CREATE TABLE {}.openvprof_meta (version INTEGER, size INTEGER, mtime_ns INTEGER, digest TEXT)".format(self.SCHEMA))
+        self.conn.execute("INSERT INTO {}.openvprof_meta VALUES (?, ?, ?, ?)".format(
+            self.SCHEMA), (FORMAT_VERSION, *self.key))
+        self.conn.commit()
+
+    def has_table(self, table):
+        """return True if table exists in the sidecar"""
+        sql = "SELECT Count(*) FROM {}.sqlite_master WHERE type='table' AND name=?".format(
+            self.SCHEMA)
+        return self.conn.execute(sql, (table,)).fetchone()[0] > 0
+
+    def get_metadata(self):
+        """return the cached trace metadata (a JSON string), or None if it has not been stored"""
+        if not self.has_table("openvprof_metadata"):
+            return None
+        row = self.conn.execute(
+            "SELECT value FROM {}.openvprof_metadata".format(self.SCHEMA)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def put_metadata(self, value):
+        """store the trace metadata, a JSON string"""
+        self._build("openvprof_metadata", [
+            "CREATE TABLE {table} (value TEXT)",
+        ])
+        self.conn.execute(
+            "DELETE FROM {}.openvprof_metadata".format(self.SCHEMA))
+        self.conn.execute("INSERT INTO {}.openvprof_metadata VALUES (?)".format(
+            self.SCHEMA), (value,))
+        self.conn.commit()
+
+    def indexes(self, table):
+        """return True if TABLE is an nvprof table the sidecar can index, with _id_, start, and end columns"""
+        columns = {row[1] for row in self.conn.execute(
+            "PRAGMA main.table_info({})".format(table))}
+        return {"_id_", "start", "end"} <= columns
+
+    def _build(self, name, statements):
+        """run statements to build sidecar table NAME if it does not exist, and return its qualified name
+
+        Each statement is SQL formatted with {table}, the qualified name, and
+        {name}, or a function that is called with the qualified name.
+        """
+        qualified = "{}.{}".format(self.SCHEMA, name)
+        if self.has_table(name):
+            return qualified
+        logger.debug("building sidecar table {}".format(name))
+        for sql in statements:
+            if callable(sql):
+                sql(qualified)
+            else:
+                self.conn.execute(sql.format(table=qualified, name=name))
+        self.conn.commit()
+        return qualified
+
+    def edges_table(self, table):
+        """return the name of the sidecar table holding the edges of TABLE, building it if needed
+
+        The edge table has columns (ts, edge, id, start, end), where id is the
+        _id_ of the row in TABLE. It is stored ordered by (ts, edge, id), so
+        scanning it in timestamp order does not require a sort, and falling
+        edges come before rising edges at the same timestamp.
+        """
+        return self._build(table + "_EDGES", [
+            """CREATE TABLE {table} (
+  ts INTEGER,
+  edge INTEGER,
+  id INTEGER,
+  start INTEGER,
+  end INTEGER,
+  PRIMARY KEY (ts, edge, id)
+) WITHOUT ROWID""",
+            """INSERT INTO {{table}}
+SELECT start, 1, _id_, start, end FROM main.{0}
+UNION ALL
+SELECT end, 0, _id_, start, end FROM main.{0}
+ORDER BY 1, 2, 3""".format(table),
+        ])
+
+    def start_table(self, table):
+        """return the name of the sidecar table holding (start, end, id) of TABLE ordered by start, building it if needed
+
+        id is the _id_ of the row in TABLE. The table is stored in
+        (start, id) order, and has a covering index on (end, start, id), so
+        counting rows or finding the rows that overlap a time span only reads
+        these three columns, and scanning rows by start does not sort.
+        """
+        return self._build(table + "_BY_START", [
+            """CREATE TABLE {table} (
+  start INTEGER,
+  end INTEGER,
+  id INTEGER,
+  PRIMARY KEY (start, id)
+) WITHOUT ROWID""",
+            """INSERT INTO {{table}}
+SELECT start, end, _id_ FROM main.{} ORDER BY start, _id_""".format(table),
+            "CREATE INDEX {table}_end ON {name} (end, start, id)",
+        ])
+
+    def correlation_table(self, table):
+        """return the name of the sidecar table holding (correlationId, id) of TABLE, building it if needed
+
+        id is the _id_ of the row in TABLE, so joining API calls to the
+        activities they launched is an index lookup instead of a scan.
+        """
+        return self._build(table + "_BY_CORRELATION", [
+            """CREATE TABLE {table} (
+  correlationId INTEGER,
+  id INTEGER,
+  PRIMARY KEY (correlationId, id)
+) WITHOUT ROWID""",
+            """INSERT INTO {{table}}
+SELECT correlationId, _id_ FROM main.{} ORDER BY correlationId, _id_""".format(table),
+        ])
+
+    def range_table(self, build):
+        """return the name of the sidecar range table, calling build(name) to create and fill it if needed
+
+        The table has a covering index on (name, start, end, domain) that
+        answers "ranges with these names, ordered by start" without a scan of
+        every range.
+        """
+        return self._build("CUPTI_ACTIVITY_KIND_RANGE", [
+            build,
+            "CREATE INDEX {table}_name ON {name} (name, start, end, domain)",
+        ])
@@ -0,0 +1,119 @@
+""" Online duration statistics that are updated an array at a time and merge across batches, shards, and files """
+
+import heapq
+import math
+import numpy as np
+
+from nvprof import histogram
+
+
+# report columns (ns, except count), and how to get them from a Stats
+COLUMNS = {
+    'count': lambda s: s.count,
+    'tot': lambda s: s.total,
+    'min': lambda s: s.min,
+    'max': lambda s: s.max,
+    'avg': lambda s: s.mean,
+    'stddev': lambda s: s.stddev,
+    'p50': lambda s: s.percentile(50),
+    'p90': lambda s: s.percentile(90),
+    'p99': lambda s: s.percentile(99),
+    'p99.9': lambda s: s.percentile(99.9),
+}
+
+
+class Stats(object):
+    """ count, total, mean, variance, min, max, and percentiles of durations (ns)
+
+    The mean and variance are combined across arrays and other Stats with
+    the parallel form of Welford's algorithm, so they do not lose precision
+    over many values. Percentiles, min, and max come from an
+    nvprof.histogram.Histogram. Memory use does not grow with the number of values.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # the sum of squared differences from the mean
+        self.histogram = histogram.Histogram()
+
+    def add(self, values):
+        """add each of values, an array of durations"""
+        values = np.asarray(values, dtype=np.int64)
+        if not len(values):
+            return
+        batch = Stats()
+        batch.count = len(values)
+        batch.total = int(values.sum())
+        batch.mean = batch.total / batch.count
+        batch.m2 = float(np.square(values - batch.mean).sum())
+        batch.histogram.add(values)
+        self.merge(batch)
+
+    def merge(self, other):
+        """add the values of other to these Stats"""
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.total += other.total
+        self.histogram.merge(other.histogram)
+
+    @property
+    def min(self):
+        return self.histogram.min
+
+    @property
+    def max(self):
+        return self.histogram.max
+
+    @property
+    def stddev(self):
+        """the sample standard deviation, 0 for a single value"""
+        if self.count < 2:
+            return 0.0
+        return math.sqrt(self.m2 / (self.count - 1))
+
+    def percentile(self, q):
+        return self.histogram.percentile(q)
+
+
+def add_grouped(groups, keys, values):
+    """add each of values to the Stats in groups (a dict) of the matching row of keys, an int64 array with a row per value
+
+    groups is keyed by tuples of the key columns. Values are grouped with
+    NumPy, so each group is added to once per call.
+    """
+    if not len(keys):
+        return
+    unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.searchsorted(inverse[order], np.arange(len(unique) + 1)).tolist()
+    for i, key in enumerate(unique.tolist()):
+        key = tuple(key)
+        if key not in groups:
+            groups[key] = Stats()
+        groups[key].add(values[order[bounds[i]:bounds[i + 1]]])
+
+
+def top(groups, column, k=None):
+    """the (key, Stats) items of groups with the largest column (a COLUMNS key), the k largest if k"""
+    by = COLUMNS[column]
+    if k:
+        return heapq.nlargest(k, groups.items(), key=lambda item: by(item[1]))
+    return sorted(groups.items(), key=lambda item: by(item[1]), reverse=True)
+
+
+def header(keys):
+    """the tab-separated header of a report of the COLUMNS of groups, followed by the key columns"""
+    return "\t".join(["count"] + ["{}(s)".format(c) for c in list(COLUMNS)[1:]] + list(keys))
+
+
+def row(s):
+    """the COLUMNS of s, with times in seconds"""
+    return [s.count] + [COLUMNS[c](s) / 1e9 for c in list(COLUMNS)[1:]]
@@ -0,0 +1,76 @@
+""" Lazily loaded, memoized access to the StringTable of an nvprof database """
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Strings(object):
+    """ map StringTable ids to strings, reading only what is asked for
+
+    Records carry StringTable ids, and reports resolve the few ids they print
+    with strings[id]. Each id is read from the database at most once. Methods
+    that need every string (as_dicts) read the whole table once.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.id_to_string = {}
+        self.string_to_id = {}
+        self.loaded = False
+        self.like_cache = {}
+
+    def load(self):
+        """read the whole StringTable, if it has not been read yet"""
+        if self.loaded:
+            return
+        logger.debug("loading StringTable")
+        for id_, s in self.conn.execute("SELECT _id_, value FROM StringTable"):
+            self.id_to_string[id_] = s
+            assert s not in self.string_to_id or self.string_to_id[s] == id_
+            self.string_to_id[s] = id_
+        self.loaded = True
+
+    def __getitem__(self, id_):
+        if id_ in self.id_to_string:
+            return self.id_to_string[id_]
+        if not self.loaded:
+            row = self.conn.execute(
+                "SELECT value FROM StringTable WHERE _id_ = ?", (id_,)).fetchone()
+            if row is not None:
+                self.id_to_string[id_] = row[0]
+                self.string_to_id[row[0]] = id_
+                return row[0]
+        raise KeyError(id_)
+
+    def __len__(self):
+        self.load()
+        return len(self.id_to_string)
+
+    def id_of(self, s):
+        """return the id of string s, or None if it is not in the StringTable"""
+        if s in self.string_to_id or self.loaded:
+            return self.string_to_id.get(s)
+        row = self.conn.execute(
+            "SELECT _id_ FROM StringTable WHERE value = ?", (s,)).fetchone()
+        if row is None:
+            return None
+        self.id_to_string[row[0]] = s
+        self.string_to_id[s] = row[0]
+        return row[0]
+
+    def ids_like(self, names):
+        """return the set of ids of strings that contain any of names (SQL LIKE '%name%')"""
+        key = tuple(names)
+        if key not in self.like_cache:
+            sql = "SELECT _id_ FROM StringTable WHERE " + \
+                " or ".join("value like ?" for _ in names)
+            args = ["%{}%".format(name) for name in names]
+            self.like_cache[key] = {row[0]
+                                    for row in self.conn.execute(sql, args)}
+        return self.like_cache[key]
+
+    def as_dicts(self):
+        """return (id_to_string, string_to_id) for the whole StringTable"""
+        self.load()
+        return self.id_to_string, self.string_to_id
@@ -0,0 +1,122 @@
+""" Sweep-line filtering of rows ordered by start against sorted intervals """
+
+import heapq
+
+# stand-ins for an open beginning or end of a span
+MIN_TIMESTAMP = -2**63
+MAX_TIMESTAMP = 2**63 - 1
+
+
+def coalesce(intervals):
+    """return sorted, disjoint (start, end) intervals that cover the same time as intervals"""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged += [(start, end)]
+    return merged
+
+
+def intersect(a, b):
+    """return the sorted, disjoint intervals covered by both a and b, which are sorted and disjoint"""
+    out = []
+    i = 0
+    j = 0
+    while i < len(a) and j < len(b):
+        start = max(a[i][0], b[j][0])
+        end = min(a[i][1], b[j][1])
+        if start <= end:
+            out += [(start, end)]
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return out
+
+
+def span_intervals(spans):
+    """return intervals covered by all (begin, end) spans, where begin or end may be None"""
+    intervals = [(MIN_TIMESTAMP, MAX_TIMESTAMP)]
+    for begin, end in spans:
+        if begin is None:
+            begin = MIN_TIMESTAMP
+        if end is None:
+            end = MAX_TIMESTAMP
+        intervals = intersect(intervals, [(begin, end)])
+    return intervals
+
+
+def _clipped(row, start_idx, start, end_idx, end):
+    row = list(row)
+    row[start_idx] = start
+    row[end_idx] = end
+    return tuple(row)
+
+
+def overlapping(rows, intervals, start_idx, end_idx, clip=False):
+    """yield rows that overlap any of intervals
+
+    rows must be ordered by row[start_idx], and intervals must be sorted and
+    disjoint (see coalesce). Both are walked once, so the cost is
+    O(len(rows) + len(intervals)) instead of comparing every row with every
+    interval.
+
+    If clip, a row is replaced by one piece per interval it overlaps, with
+    start and end clipped to that interval. Pieces are also yielded in order
+    of start.
+    """
+    i = 0
+    pending = []  # heap of (start, seq, piece) for clipped pieces
+    seq = 0
+    for row in rows:
+        start = row[start_idx]
+        end = row[end_idx]
+
+        # no piece of this or later rows can start before start
+        while pending and pending[0][0] <= start:
+            yield heapq.heappop(pending)[2]
+
+        # skip intervals that end before this row, or any later row, starts
+        while i < len(intervals) and intervals[i][1] < start:
+            i += 1
+        if i == len(intervals):
+            break
+        if intervals[i][0] > end:
+            continue
+
+        if not clip:
+            yield row
+            continue
+
+        j = i
+        while j < len(intervals) and intervals[j][0] <= end:
+            piece_start = max(start, intervals[j][0])
+            piece_end = min(end, intervals[j][1])
+            piece = _clipped(row, start_idx, piece_start, end_idx, piece_end)
+            heapq.heappush(pending, (piece_start, seq, piece))
+            seq += 1
+            j += 1
+
+    while pending:
+        yield heapq.heappop(pending)[2]
+
+
+def edges(rows, start_idx, end_idx):
+    """yield (ts, edge, *row) for each rising and falling edge of rows ordered by start
+
+    Edges are ordered by (ts, edge), like Db.ordered_edges, so falling edges
+    come before rising edges at the same timestamp.
+    """
+    ends = []  # heap of (end, seq, row)
+    for seq, row in enumerate(rows):
+        start = row[start_idx]
+        while ends and ends[0][0] <= start:
+            end, _, r = heapq.heappop(ends)
+            yield (end, 0) + r
+        yield (start, 1) + row
+        heapq.heappush(ends, (row[end_idx], seq, row))
+    while ends:
+        end, _, r = heapq.heappop(ends)
+        yield (end, 0) + r
@@ -1,12 +1,10 @@
 #! env python3
 
-import sqlite3
 import sys
-import json
 import click
+import contextlib
 from math import log
 import logging
-import time
 
 import cmd.summary
 import cmd.list_ranges
@@ -14,51 +12,29 @@ import cmd.stats
 import cmd.filter
 import cmd.list_records
 import cmd.list_edges
+import cmd.multi_rank
+import cmd.convert
+import cmd.split
+import cmd.trace
+import cmd.kernel_stats
+import cmd.range_tree
 import cmd.list_ranges
+import chrome_trace
+import perfetto_trace
+from cupti import activity_memcpy_kind
+from nvprof import align, sweep
+from nvprof.db import Db, open_db
+from nvprof.record import Range, Runtime, runtime_cbid_name
 
 logger = logging.getLogger(__name__)
 
 
-def table_size(cursor, table_name):
-    cursor.execute('SELECT Count(*) FROM {}'.format(table_name))
-    row = cursor.fetchone()
-    return row[0]
-
-
-class Histogram(object):
-    def __init__(self, lower=None, upper=None):
-        if lower:
-            self.lower_bound = int(math.log(lower))
-        else:
-            self.lower_bound = None
-        if upper:
-            self.upper_bound = int(math.log(upper))
-        else:
-            self.upper_bound = None
-        self.bins = {}
-
-    def insert(self, e):
-        l = int(log(e, 2))
-        if self.lower_bound:
-            if l < lower_bound:
-                l = lower_bound
-        if self.upper_bound:
-            if l > upper_bound:
-                l = upper_bound
-        if l not in self.bins:
-            self.bins[l] = 0
-        self.bins[l] += 1
-
-    def get(self):
-        max_key = max(self.bins.keys())
-        min_key = min(self.bins.keys())
-        return [self.bins[i] if i in self.bins else 0 for i in range(min_key, max_key+1)], min_key, max_key
-
-
 def linnorm(x, to):
     """x, linearly scaled f-> [0,to]"""
     lower = min(x)
     upper = max(x)
+    if upper == lower:
+        return [to - 1 for e in x]
     raw = [((e - lower) * to) // (upper - lower) for e in x]
     raw = [e if e != to else e-1 for e in raw]
     return raw
@@ -69,6 +45,8 @@ def lognorm(x, to):
     x = [0 if e == 0 else log(e) for e in x]
     lower = min(x)
     upper = max(x)
+    if upper == lower:
+        return [to - 1 for e in x]
     raw = [((e - lower) * to) / (upper - lower) for e in x]
     raw = [int(e) for e in raw]
     raw = [e if e != to else e-1 for e in raw]
@@ -86,140 +64,213 @@ def spark(x, log=False):
 
 @click.group()
 @click.option('--debug', is_flag=True, help="print debugging messages")
+@click.option('--sidecar', is_flag=True, help="cache sorted edges and indexes in FILENAME.openvprof and reuse them in later runs")
 @click.pass_context
-def cli(ctx, debug):
+def cli(ctx, debug, sidecar):
     logging.basicConfig(format='%(asctime)s,%(msecs)03d - [%(filename)s:%(lineno)s] - %(levelname)s: %(message)s',
                         datefmt='%Y-%b-%d %H:%M:%S')
     ctx.ensure_object(dict)
     ctx.obj["DEBUG"] = debug
+    ctx.obj["SIDECAR"] = sidecar
     if debug:
         logging.getLogger().setLevel(logging.DEBUG)
 
 
+def print_histogram(histo, log=False):
+    """print the power-of-two sparkline and the percentiles of an nvprof.histogram.Histogram of durations (ns)"""
+    if not histo.count:
+        print("Durations: no records")
+        return
+    counts, lower, upper = histo.powers_of_two()
+    logging.debug("histogram data: {}".format(counts))
+    print("Durations: 2^{} {} 2^{}".format(lower, spark(counts, log=log), upper))
+    print("  ".join(["count {}".format(histo.count), "min {}ns".format(histo.min)] +
+                    ["p{} {}ns".format(q, v) for q, v in histo.percentiles()] +
+                    ["max {}ns".format(histo.max)]))
+
+
+def table_histogram(filenames, table, sidecar):
+    """return the merged nvprof.histogram.Histogram of the durations of table in each of filenames"""
+    # numpy is only needed by the histogram commands
+    from nvprof import histogram
+    histo = histogram.Histogram()
+    for filename in filenames:
+        logging.debug("Opening {}".format(filename))
+        db = open_db(filename, sidecar=sidecar)
+        logging.debug("table {} has {} entries".format(table, db.num_rows(table)))
+        histo.merge(histogram.of_table(db, table))
+    return histo
+
+
 @click.command()
-@click.argument('filename')
+@click.argument('filenames', nargs=-1, required=True)
+@click.option('--scale', type=click.Choice(['lin', 'log']), default='lin', show_default=True)
 @click.pass_context
-def driver_time(ctx, filename):
-    """Show a histogram of driver API times"""
-    logging.debug("Opening {}".format(filename))
-    conn = sqlite3.connect(filename)
-    c = conn.cursor()
-    if ctx.obj["DEBUG"]:
-        logging.debug("table CUPTI_ACTIVITY_KIND_DRIVER has {} entries".format(
-            table_size(c, 'CUPTI_ACTIVITY_KIND_DRIVER')))
-
-    first = None
-    last = None
-    histo = Histogram()
-    for row in c.execute("SELECT * FROM CUPTI_ACTIVITY_KIND_DRIVER"):
-        start_ns = row[2]
-        end_ns = row[3]
-        if not first:
-            first = start_ns
-        if not last:
-            last = start_ns
-        first = min(first, start_ns)
-        last = max(last, start_ns)
-        histo.insert(end_ns - start_ns)
-    # print("First event start: {}".format(  time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(first//1e9))  ))
-    # print("Last event end: {}".format(  time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last//1e9))  ))
-    logging.debug("first event timestamp {}ns".format(first))
-    logging.debug("last event timestamp {}ns".format(last))
-    histo, lower, upper = histo.get()
-    print("Durations: 2^{} {} 2^{}".format(lower, spark(histo), upper))
+def driver_time(ctx, filenames, scale):
+    """Show a histogram of driver API times (ns)
+
+    With several FILENAMES, like the shards written by split, their
+    histograms are merged.
+    """
+    histo = table_histogram(filenames, "CUPTI_ACTIVITY_KIND_DRIVER", ctx.obj["SIDECAR"])
+    print_histogram(histo, log=scale == "log")
 
 
 @click.command()
-@click.argument('filename')
+@click.argument('filenames', nargs=-1, required=True)
 @click.option('--scale', type=click.Choice(['lin', 'log']), default='lin', show_default=True)
 @click.pass_context
-def kernel_time(ctx, filename, scale):
-    """Show a histogram of kernel times (ns)"""
-    logging.debug("Opening {}".format(filename))
-    conn = sqlite3.connect(filename)
-    c = conn.cursor()
-    if ctx.obj["DEBUG"]:
-        logging.debug("table CUPTI_ACTIVITY_KIND_CONCURRENT_KERNEL has {} entries".format(
-            table_size(c, 'CUPTI_ACTIVITY_KIND_CONCURRENT_KERNEL')))
-
-    first = None
-    last = None
-    histo = Histogram()
-    for row in c.execute("SELECT * FROM CUPTI_ACTIVITY_KIND_CONCURRENT_KERNEL"):
-        start_ns = row[6]
-        end_ns = row[7]
-        if not first:
-            first = start_ns
-        if not last:
-            last = start_ns
-        first = min(first, start_ns)
-        last = max(last, start_ns)
-        histo.insert(end_ns - start_ns)
-    histo, lower, upper = histo.get()
-    logging.debug("lower bound is {}".format(lower))
-    logging.debug("upper bound is {}".format(upper))
-    logging.debug("histogram data: {}".format(histo))
-    if scale == "lin":
-        logging.debug("Using linear y-axis scale")
-        sparkstring = spark(histo, log=False)
+def kernel_time(ctx, filenames, scale):
+    """Show a histogram of kernel times (ns)
+
+    With several FILENAMES, like the shards written by split, their
+    histograms are merged.
+    """
+    histo = table_histogram(filenames, "CUPTI_ACTIVITY_KIND_CONCURRENT_KERNEL", ctx.obj["SIDECAR"])
+    print_histogram(histo, log=scale == "log")
+
+
+# tables drawn by timeline, and the category of their events
+TIMELINE_TABLES = [
+    ("CUPTI_ACTIVITY_KIND_RANGE", "nvtx"),
+    ("CUPTI_ACTIVITY_KIND_RUNTIME", "runtime"),
+    ("CUPTI_ACTIVITY_KIND_CONCURRENT_KERNEL", "kernel"),
+    ("CUPTI_ACTIVITY_KIND_MEMCPY", "memcpy"),
+    ("CUPTI_ACTIVITY_KIND_MEMCPY2", "memcpy"),
+]
+
+
+def timeline_track(writer, prefix, cat, row):
+    """return (pid, tid) of the track of an nvprof row of a TIMELINE_TABLES table
+
+    GPU activities are drawn on a process per device and a thread per
+    stream, API calls and NVTX ranges on the process and thread that made them.
+    """
+    if cat in ("kernel", "memcpy"):
+        device, stream = (row[9], row[11]) if cat == "kernel" else (row[8], row[10])
+        pid = writer.process((prefix, "gpu", device),
+                             "{}GPU {}".format(prefix, device))
+        return pid, writer.thread(pid, stream, "stream {}".format(stream))
+
+    if cat == "runtime":
+        record = Runtime.from_nvprof_row(row, None)
     else:
-        logging.debug("Using logarithmic y-axis scale")
-        sparkstring = spark(histo, log=True)
-    print("Durations: 2^{} {} 2^{}".format(lower, sparkstring, upper))
+        record = Range.from_nvprof_row(row, None)
+    if record.pid is None:
+        return writer.process((prefix, "nvtx"), "{}NVTX".format(prefix)), 0
+    pid = writer.process((prefix, "process", record.pid),
+                         "{}process {}".format(prefix, record.pid))
+    return pid, record.tid
+
+
+def timeline_slice(cat, row, strings):
+    """return (name, args) of the event of an nvprof row of a TIMELINE_TABLES table"""
+    if cat == "kernel":
+        return strings[row[24]], {"correlationId": row[22]}
+    elif cat == "memcpy":
+        return activity_memcpy_kind.name(row[1]), {"bytes": row[5]}
+    elif cat == "runtime":
+        return runtime_cbid_name(row[1]), {"correlationId": row[6]}
+    return strings[row[2]], {"domain": strings[row[3]]} if row[3] else None
 
 
 @click.command()
-@click.argument('filename')
-@click.option('--to')
-@click.option('--from', '_from')
-def timeline(filename, _from, to):
-    """Generate a chrome:://tracing timeline"""
-
-    conn = sqlite3.connect(filename)
-    c = conn.cursor()
-
-    if to:
-        try:
-            to = float(to)
-        except ValueError:
-            print("to should be a float", file=sys.stderr)
-            sys.exit(-1)
-
-    if _from:
-        try:
-            _from = float(_from)
-        except ValueError:
-            print("from should be a float", file=sys.stderr)
-            sys.exit(-1)
-
-    trace = {
-        "traceEvents": [],
-        "displayTimeUnit": "ns",
-    }
-
-    # add KERNELS to timeline
-    for row in c.execute("SELECT * FROM CUPTI_ACTIVITY_KIND_CONCURRENT_KERNEL"):
-        start_ns = row[6]
-        end_ns = row[7]
-        if _from and start_ns < _from:
-            continue
-        if to and end_ns > to:
-            continue
-        j = {
-            "name": "name",
-            "cat": "cat",
-            "ph": "X",
-            "pid": "CONCURRENT_KERNEL",
-            "tid": "tid",
-            "ts": start_ns // 1000,
-            "dur": (end_ns - start_ns) // 1000,
-            "args": {},
-            # "tdur": dur,
-        }
-        trace["traceEvents"] += [j]
-
-    s = json.dumps(trace, indent=4)
-    print(s)
+@click.argument('filenames', nargs=-1, required=True)
+@click.option('--to', help='Only include records that start before this time')
+@click.option('--from', '_from', help='Only include records that end after this time')
+@click.option('-o', '--output', default='-', show_default=True, help='Write the trace to this file, gzip-compressed if it ends in .gz')
+@click.option('--resolution', help='Merge events shorter than this (ns, or seconds like 0.001s) into aggregate slices per track')
+@click.option('--detail', nargs=3, multiple=True, metavar='FROM TO PATH', help='Also write every event between FROM and TO to PATH')
+@click.option('--gzip', 'compress', is_flag=True, help='gzip-compress the trace')
+@click.option('--format', type=click.Choice(['chrome', 'perfetto']), help='chrome://tracing JSON, or Perfetto protobuf  [default: perfetto if --output ends in .pftrace, else chrome]')
+@click.option('--align', 'anchors', multiple=True, help='Align the clocks of the files on ranges with this in the name')
+@click.option('--align-edge', type=click.Choice(['start', 'end']), default='end', show_default=True, help='The edge of the anchor ranges that happens at the same time in every file')
+@click.pass_context
+def timeline(ctx, filenames, _from, to, output, resolution, detail, compress, format, anchors, align_edge):
+    """Generate a chrome:://tracing timeline
+
+    The timeline is chrome://tracing JSON, or a Perfetto protobuf trace with
+    --format perfetto.
+    Kernels and memcpys are drawn per device and stream, runtime calls and
+    NVTX ranges per process and thread. Timestamps are relative to the first
+    record. --from and --to are timestamps, or seconds from the first record
+    like "1.5s".
+
+    With several FILENAMES, records from all files are merged in time order,
+    on the clock of the first file if --align is given.
+    """
+
+    dbs = [Db(filename, sidecar=ctx.obj["SIDECAR"]) for filename in filenames]
+    if anchors:
+        offsets = align.estimate_offsets(
+            [align.anchor_times(db, anchors, edge=align_edge) for db in dbs])
+    else:
+        offsets = [0] * len(dbs)
+    # files without records add nothing to the timeline
+    firsts = [db.get_extent()[0] for db in dbs]
+    starts = [first + offset for first, offset in zip(firsts, offsets) if first is not None]
+    if not starts:
+        print("no records in {}".format(", ".join(filenames)), file=sys.stderr)
+        sys.exit(-1)
+    origin = min(starts)
+
+    try:
+        to = cmd.summary.to_timestamp(to, origin) if to else None
+        _from = cmd.summary.to_timestamp(_from, origin) if _from else None
+        resolution = cmd.summary.to_timestamp(resolution, 0) if resolution else None
+        detail = [(cmd.summary.to_timestamp(b, origin), cmd.summary.to_timestamp(e, origin), path)
+                  for b, e, path in detail]
+    except ValueError:
+        print("times should be a timestamp or seconds like 1.5s", file=sys.stderr)
+        sys.exit(-1)
+
+    # the window is selected in SQL, on the clock of each file
+    sources = []
+    for rank, (db, offset) in enumerate(zip(dbs, offsets)):
+        spans = []
+        if _from or to:
+            spans = [(_from - offset if _from else None,
+                      to - offset if to else None)]
+        for table, cat in TIMELINE_TABLES:
+            source = "CUPTI_ACTIVITY_KIND_MARKER" if table == "CUPTI_ACTIVITY_KIND_RANGE" else table
+            if not db.metadata().num_rows(source):
+                continue
+            sources += [((rank, cat), align.aligned_rows(db, table, offset, spans=spans))]
+    prefixes = ["{} ".format(rank) if len(dbs) > 1 else "" for rank in range(len(dbs))]
+
+    with contextlib.ExitStack() as stack:
+        writer = stack.enter_context(perfetto_trace.open_writer(
+            output, format=format, compress=compress, origin=origin))
+        details = [(b, e, stack.enter_context(perfetto_trace.open_writer(path, format=format, compress=compress, origin=origin)))
+                   for b, e, path in detail]
+
+        def write_details(cat, start, end, name, args, rank, row):
+            for b, e, w in details:
+                if start <= e and end >= b:
+                    w.complete(name, cat, *timeline_track(w, prefixes[rank], cat, row),
+                               start, end, args=args)
+
+        rows = align.merged_rows(sources)
+        if resolution is None:
+            for start, end, (rank, cat), row in rows:
+                name, args = timeline_slice(cat, row, dbs[rank].strings())
+                writer.complete(name, cat, *timeline_track(writer, prefixes[rank], cat, row),
+                                start, end, args=args)
+                write_details(cat, start, end, name, args, rank, row)
+        else:
+            # a single pass over the edges of all records, in time order
+            overview = chrome_trace.Aggregator(writer, resolution)
+            for _, edge, start, end, (rank, cat), row in sweep.edges(rows, 0, 1):
+                if edge:
+                    name, args = timeline_slice(cat, row, dbs[rank].strings())
+                    overview.rising(name, cat, *timeline_track(writer, prefixes[rank], cat, row),
+                                    start, end, args=args)
+                    write_details(cat, start, end, name, args, rank, row)
+                elif end - start >= resolution:
+                    overview.falling(*timeline_track(writer, prefixes[rank], cat, row),
+                                     start, end)
+            overview.close()
+    logger.debug("wrote {} events".format(writer.num_events))
 
 
 cli.add_command(timeline)
@@ -231,6 +282,12 @@ cli.add_command(cmd.list_ranges.list_ranges)
 cli.add_command(cmd.list_records.list_records)
 cli.add_command(cmd.filter.filter)
 cli.add_command(cmd.list_edges.list_edges)
+cli.add_command(cmd.multi_rank.multi_rank)
+cli.add_command(cmd.convert.convert)
+cli.add_command(cmd.split.split)
+cli.add_command(cmd.trace.trace)
+cli.add_command(cmd.kernel_stats.kernel_stats)
+cli.add_command(cmd.range_tree.range_tree)
 
 if __name__ == '__main__':
     cli()
@@ -0,0 +1,407 @@
+""" Write Perfetto protobuf traces one event at a time
+
+The trace is a perfetto.protos.Trace, a sequence of TracePackets with
+TrackEvents, encoded directly in the protobuf wire format, so no protobuf
+library is needed. All packets are on one sequence: event names, categories,
+and argument names are interned, and timestamps are deltas on an
+incremental clock. The files open in the Perfetto UI (ui.perfetto.dev),
+which runs locally in the browser.
+"""
+
+import gzip
+import heapq
+import struct
+import sys
+
+import chrome_trace
+
+# field numbers from perfetto/protos/perfetto/trace/
+TRACE_PACKET = 1  # Trace.packet
+
+PACKET_CLOCK_SNAPSHOT = 6
+PACKET_TIMESTAMP = 8
+PACKET_TRUSTED_PACKET_SEQUENCE_ID = 10
+PACKET_TRACK_EVENT = 11
+PACKET_INTERNED_DATA = 12
+PACKET_SEQUENCE_FLAGS = 13
+PACKET_TIMESTAMP_CLOCK_ID = 58
+PACKET_TRACE_PACKET_DEFAULTS = 59
+PACKET_TRACK_DESCRIPTOR = 60
+
+SEQ_INCREMENTAL_STATE_CLEARED = 1
+SEQ_NEEDS_INCREMENTAL_STATE = 2
+
+CLOCK_SNAPSHOT_CLOCKS = 1
+CLOCK_ID = 1
+CLOCK_TIMESTAMP = 2
+CLOCK_IS_INCREMENTAL = 3
+
+DEFAULTS_TIMESTAMP_CLOCK_ID = 58
+
+TRACK_UUID = 1
+TRACK_NAME = 2
+TRACK_PARENT_UUID = 5
+TRACK_COUNTER = 8
+
+EVENT_CATEGORY_IIDS = 3
+EVENT_DEBUG_ANNOTATIONS = 4
+EVENT_TYPE = 9
+EVENT_NAME_IID = 10
+EVENT_TRACK_UUID = 11
+EVENT_DOUBLE_COUNTER_VALUE = 44
+
+TYPE_SLICE_BEGIN = 1
+TYPE_SLICE_END = 2
+TYPE_COUNTER = 4
+
+ANNOTATION_NAME_IID = 1
+ANNOTATION_BOOL_VALUE = 2
+ANNOTATION_INT_VALUE = 4
+ANNOTATION_DOUBLE_VALUE = 5
+ANNOTATION_STRING_VALUE = 6
+
+INTERNED_EVENT_CATEGORIES = 1
+INTERNED_EVENT_NAMES = 2
+INTERNED_DEBUG_ANNOTATION_NAMES = 3
+INTERNED_IID = 1
+INTERNED_NAME = 2
+
+# the trace clock, and the sequence-scoped incremental clock that event timestamps are deltas on
+BOOTTIME = 6
+INCREMENTAL_CLOCK = 64
+
+SEQUENCE_ID = 1
+
+# bytes of packets buffered before they are written
+WRITE_SIZE = 1 << 20
+
+# file extensions of Perfetto traces, which may be followed by .gz
+EXTENSIONS = (".pftrace", ".perfetto-trace")
+
+
+# the varints of 0 to 2^14 - 1, which most tags, ids, lengths, and timestamp deltas are,
+# encoded once so that looking one up is a list index
+NUM_SMALL_VARINTS = 1 << 14
+_SMALL_VARINTS = [bytes((n,)) for n in range(0x80)] + \
+    [bytes((n & 0x7f | 0x80, n >> 7)) for n in range(0x80, NUM_SMALL_VARINTS)]
+
+
+def _varint(n):
+    if 0 <= n < NUM_SMALL_VARINTS:
+        return _SMALL_VARINTS[n]
+    if 0 < n < 0x200000:
+        return bytes((n & 0x7f | 0x80, n >> 7 & 0x7f | 0x80, n >> 14))
+    n &= (1 << 64) - 1  # negative int64s are encoded as 10-byte two's complement
+    out = bytearray()
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _uint(field, value):
+    return _varint(field << 3) + _varint(value)
+
+
+def _bytes(field, value):
+    return _varint(field << 3 | 2) + _varint(len(value)) + value
+
+
+def _string(field, value):
+    return _bytes(field, value.encode("utf-8"))
+
+
+def _double(field, value):
+    return _varint(field << 3 | 1) + struct.pack("<d", value)
+
+
+# fields that are the same in many packets
+_SEQUENCE = _uint(PACKET_TRUSTED_PACKET_SEQUENCE_ID, SEQUENCE_ID)
+_NEEDS_STATE = _uint(PACKET_SEQUENCE_FLAGS, SEQ_NEEDS_INCREMENTAL_STATE)
+_TIMESTAMP_TAG = _varint(PACKET_TIMESTAMP << 3)
+_TRACK_EVENT_TAG = _varint(PACKET_TRACK_EVENT << 3 | 2)
+_ANNOTATION_TAG = _varint(EVENT_DEBUG_ANNOTATIONS << 3 | 2)
+_INT_VALUE_TAG = _varint(ANNOTATION_INT_VALUE << 3)
+_BEGIN = _uint(EVENT_TYPE, TYPE_SLICE_BEGIN)
+_END = _uint(EVENT_TYPE, TYPE_SLICE_END)
+_COUNTER = _uint(EVENT_TYPE, TYPE_COUNTER)
+_ABSOLUTE = _uint(PACKET_TIMESTAMP_CLOCK_ID, BOOTTIME)
+_PACKET_TAG = _varint(TRACE_PACKET << 3 | 2)
+# the fields after the TrackEvent of every event packet
+_EVENT_TAIL = _NEEDS_STATE + _SEQUENCE
+# TracePacket.timestamp fields of the small deltas
+_SMALL_TIMESTAMPS = [_TIMESTAMP_TAG + v for v in _SMALL_VARINTS]
+
+
+def open_writer(path, format=None, compress=False, origin=0):
+    """return a Writer for path, or a chrome_trace.Writer
+
+    format is "chrome", "perfetto", or None to write Perfetto if path has one of EXTENSIONS.
+    """
+    if format is None:
+        stem = path[:-len(".gz")] if path.endswith(".gz") else path
+        format = "perfetto" if stem.endswith(EXTENSIONS) else "chrome"
+    if format == "perfetto":
+        return Writer(path, compress=compress, origin=origin)
+    return chrome_trace.Writer(path, compress=compress, origin=origin)
+
+
+class Writer(object):
+    """ a Perfetto trace written to a file as events are added
+
+    It has the interface of chrome_trace.Writer. Timestamps are in ns,
+    relative to origin in the trace. process() tracks are parents of the
+    thread() tracks that events are on.
+
+    Slices are written as a begin and an end event. Ends are held until an
+    event starts after them, so packets are written in timestamp order when
+    complete() is called in start order, and timestamps are small deltas.
+    Packets that are out of order are written with an absolute timestamp.
+    Perfetto needs the slices of a track to nest, so a slice that overlaps
+    the end of another on its thread is put on an extra track of the thread.
+
+    The fields that are the same in many packets, like the end of a slice on
+    a track or the name, category, and track of a begin, are encoded once,
+    and packets are added to the write buffer a field at a time instead of
+    being joined first.
+    """
+
+    def __init__(self, path, compress=False, origin=0):
+        self.path = path
+        self.compress = compress or path.endswith(".gz")
+        self.origin = origin
+        self.f = None
+        self.last_ts = 0  # the incremental clock
+        self.ends = []  # heap of (end, seq, track uuid)
+        self.pids = {}  # key -> pid
+        self.next_uuid = 1
+        # (pid, None) for processes, (pid, tid, lane) for slices, (pid, "counter", name) for counters -> uuid
+        self.tracks = {}
+        self.track_names = {}  # (pid, tid) -> name
+        self.lanes = {}  # (pid, tid) -> a stack of the ends of open slices per lane
+        self.track_fields = {}  # uuid -> encoded TrackEvent.track_uuid
+        # the encoded fields that are the same in many packets, so each is encoded once:
+        # uuid -> the packet after its timestamp for the end of a slice on the track
+        self.end_packets = {}
+        # (uuid, name, cat) -> the TrackEvent fields of the begin of a slice, before its annotations
+        self.begin_fields = {}
+        # annotation name -> the DebugAnnotation fields of an int value of it, before the value
+        self.int_annotations = {}
+        # kind -> {string: encoded field with its iid}
+        self.interned = {INTERNED_EVENT_CATEGORIES: {},
+                         INTERNED_EVENT_NAMES: {},
+                         INTERNED_DEBUG_ANNOTATION_NAMES: {}}
+        self.num_events = 0
+        self.buffer = bytearray()
+
+    def __enter__(self):
+        if self.path == "-":
+            out = sys.stdout.buffer
+            self.f = gzip.GzipFile(fileobj=out, mode="wb") if self.compress else out
+        elif self.compress:
+            self.f = gzip.open(self.path, "wb")
+        else:
+            self.f = open(self.path, "wb")
+
+        # map the incremental clock to the trace clock, and make it the default for every packet
+        clocks = _bytes(CLOCK_SNAPSHOT_CLOCKS, _uint(CLOCK_ID, INCREMENTAL_CLOCK) + _uint(CLOCK_TIMESTAMP, 0) +
+                        _uint(CLOCK_IS_INCREMENTAL, 1))
+        clocks += _bytes(CLOCK_SNAPSHOT_CLOCKS,
+                         _uint(CLOCK_ID, BOOTTIME) + _uint(CLOCK_TIMESTAMP, 0))
+        self._write(_uint(PACKET_SEQUENCE_FLAGS, SEQ_INCREMENTAL_STATE_CLEARED) +
+                    _bytes(PACKET_CLOCK_SNAPSHOT, clocks) +
+                    _bytes(PACKET_TRACE_PACKET_DEFAULTS, _uint(DEFAULTS_TIMESTAMP_CLOCK_ID, INCREMENTAL_CLOCK)))
+        return self
+
+    def __exit__(self, *exc):
+        self._end_slices(None)
+        self.f.write(self.buffer)
+        if self.f is sys.stdout.buffer:
+            self.f.flush()
+        else:
+            self.f.close()
+        return False
+
+    def _write(self, body):
+        buffer = self.buffer
+        buffer += _PACKET_TAG
+        buffer += _varint(len(body) + len(_SEQUENCE))
+        buffer += body
+        buffer += _SEQUENCE
+        if len(buffer) > WRITE_SIZE:
+            self._flush()
+
+    def _flush(self):
+        self.f.write(self.buffer)
+        self.buffer = bytearray()
+
+    def _timestamp(self, ts):
+        ts -= self.origin
+        if ts >= self.last_ts:
+            delta = ts - self.last_ts
+            self.last_ts = ts
+            if delta < NUM_SMALL_VARINTS:
+                return _SMALL_TIMESTAMPS[delta]
+            return _TIMESTAMP_TAG + _varint(delta)
+        return _TIMESTAMP_TAG + _varint(max(ts, 0)) + _ABSOLUTE
+
+    def _intern(self, kind, field, s, new):
+        """return field with the iid of string s in interned table kind, adding s to new if it is not interned yet"""
+        table = self.interned[kind]
+        if s not in table:
+            iid = len(table) + 1
+            table[s] = _uint(field, iid)
+            new += [_bytes(kind, _uint(INTERNED_IID, iid) + _string(INTERNED_NAME, s))]
+        return table[s]
+
+    def _track(self, key, name, parent=None, counter=False):
+        """return the uuid of the track for key, writing its descriptor the first time it is used"""
+        if key not in self.tracks:
+            uuid = self.next_uuid
+            self.next_uuid += 1
+            self.tracks[key] = uuid
+            self.track_fields[uuid] = _uint(EVENT_TRACK_UUID, uuid)
+            event = _END + self.track_fields[uuid]
+            self.end_packets[uuid] = _TRACK_EVENT_TAG + _varint(len(event)) + event + _EVENT_TAIL
+            body = _uint(TRACK_UUID, uuid) + _string(TRACK_NAME, name)
+            if parent is not None:
+                body += _uint(TRACK_PARENT_UUID, parent)
+            if counter:
+                body += _bytes(TRACK_COUNTER, b"")
+            self._write(_bytes(PACKET_TRACK_DESCRIPTOR, body))
+        return self.tracks[key]
+
+    def _slice_track(self, pid, tid, start, end):
+        """return the uuid of the first lane of thread tid of pid that a slice from start to end nests in"""
+        lanes = self.lanes.setdefault((pid, tid), [])
+        for lane, stack in enumerate(lanes):
+            while stack and stack[-1] <= start:
+                stack.pop()
+            if not stack or stack[-1] >= end:
+                break
+        else:
+            lane = len(lanes)
+            lanes += [[]]
+        lanes[lane] += [end]
+
+        key = (pid, tid, lane)
+        if key in self.tracks:
+            return self.tracks[key]
+        name = self.track_names.get((pid, tid), "thread {}".format(tid))
+        if lane:
+            name = "{} ({})".format(name, lane + 1)
+        return self._track(key, name, parent=self.tracks[(pid, None)])
+
+    def _end_slices(self, ts):
+        """write the ends of slices that end at or before ts, or all of them if ts is None"""
+        # the packets are added to the buffer in one batch
+        ends, buffer, end_packets, timestamp = self.ends, self.buffer, self.end_packets, self._timestamp
+        while ends and (ts is None or ends[0][0] <= ts):
+            end, _, uuid = heapq.heappop(ends)
+            head, tail = timestamp(end), end_packets[uuid]
+            buffer += _PACKET_TAG
+            buffer += _SMALL_VARINTS[len(head) + len(tail)]
+            buffer += head
+            buffer += tail
+        if len(buffer) > WRITE_SIZE:
+            self._flush()
+
+    def _annotation(self, name, value, new):
+        if type(value) is int:
+            body = self.int_annotations.get(name)
+            if body is None:
+                body = self.int_annotations[name] = self._intern(
+                    INTERNED_DEBUG_ANNOTATION_NAMES, ANNOTATION_NAME_IID, name, new) + _INT_VALUE_TAG
+            body += _varint(value)
+            return _ANNOTATION_TAG + _SMALL_VARINTS[len(body)] + body
+        body = self._intern(INTERNED_DEBUG_ANNOTATION_NAMES, ANNOTATION_NAME_IID, name, new)
+        if isinstance(value, bool):
+            body += _uint(ANNOTATION_BOOL_VALUE, value)
+        elif isinstance(value, int):
+            body += _INT_VALUE_TAG + _varint(value)
+        elif isinstance(value, float):
+            body += _double(ANNOTATION_DOUBLE_VALUE, value)
+        else:
+            body += _string(ANNOTATION_STRING_VALUE, str(value))
+        return _ANNOTATION_TAG + _varint(len(body)) + body
+
+    def process(self, key, name):
+        """return the pid of the track for key, named name the first time it is used"""
+        if key not in self.pids:
+            pid = len(self.pids)
+            self.pids[key] = pid
+            self._track((pid, None), name)
+        return self.pids[key]
+
+    def thread(self, pid, tid, name):
+        """return tid, naming thread tid of pid name if it is not used yet"""
+        self.track_names.setdefault((pid, tid), name)
+        return tid
+
+    def complete(self, name, cat, pid, tid, start, end, args=None):
+        """write a slice from timestamp start to end (ns)"""
+        if self.ends and self.ends[0][0] <= start:
+            self._end_slices(start)
+        uuid = self._slice_track(pid, tid, start, end)
+
+        new = []
+        event = self.begin_fields.get((uuid, name, cat))
+        if event is None:
+            event = self.begin_fields[(uuid, name, cat)] = _BEGIN + self.track_fields[uuid] + \
+                self._intern(INTERNED_EVENT_NAMES, EVENT_NAME_IID, name, new) + \
+                self._intern(INTERNED_EVENT_CATEGORIES,
+                             EVENT_CATEGORY_IIDS, cat, new)
+        if args:
+            for k, v in args.items():
+                event += self._annotation(k, v, new)
+        timestamp = self._timestamp(start)
+        tail = _NEEDS_STATE + _bytes(PACKET_INTERNED_DATA, b"".join(new)) + _SEQUENCE if new else _EVENT_TAIL
+        event_length = _varint(len(event))
+        buffer = self.buffer
+        buffer += _PACKET_TAG
+        buffer += _varint(len(timestamp) + len(_TRACK_EVENT_TAG) + len(event_length) + len(event) + len(tail))
+        buffer += timestamp
+        buffer += _TRACK_EVENT_TAG
+        buffer += event_length
+        buffer += event
+        buffer += tail
+        if len(buffer) > WRITE_SIZE:
+            self._flush()
+        heapq.heappush(self.ends, (end, self.num_events, uuid))
+        self.num_events += 1
+
+    def counter(self, name, pid, ts, values):
+        """write the values (a dict of series name to value) of counter name at timestamp ts (ns)"""
+        self._end_slices(ts)
+        for series, value in values.items():
+            track_name = name if len(values) == 1 else "{} {}".format(name, series)
+            uuid = self._track((pid, "counter", track_name), track_name,
+                               parent=self.tracks[(pid, None)], counter=True)
+            event = _COUNTER + self.track_fields[uuid] + \
+                _double(EVENT_DOUBLE_COUNTER_VALUE, float(value))
+            self._write(self._timestamp(ts) +
+                        _bytes(PACKET_TRACK_EVENT, event) + _NEEDS_STATE)
+            self.num_events += 1
+
+    def event(self, e):
+        """write e, a chrome://tracing event dict with ts in us after origin
+
+        Complete ("X") and counter ("C") events are written, and process_name
+        and thread_name metadata name tracks. pid and tid may be strings.
+        """
+        key = ("chrome", e.get("pid"))
+        ph = e.get("ph")
+        if ph == "M" and e.get("name") == "process_name":
+            self.process(key, e["args"]["name"])
+            return
+        pid = self.process(key, str(e.get("pid")))
+        if ph == "X":
+            start = self.origin + int(round(e["ts"] * 1000))
+            self.complete(e.get("name", ""), e.get("cat", ""), pid, e.get("tid", 0),
+                          start, start + int(round(e.get("dur", 0) * 1000)), args=e.get("args"))
+        elif ph == "C":
+            self.counter(e.get("name", ""), pid, self.origin +
+                         int(round(e["ts"] * 1000)), e.get("args", {}))
+        elif ph == "M" and e.get("name") == "thread_name":
+            self.thread(pid, e.get("tid", 0), e["args"]["name"])
@@ -0,0 +1,102 @@
+import os
+import sqlite3
+import struct
+import subprocess
+import sys
+
+import pytest
+
+SCRIPTS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# appended, so the scripts' cmd package does not hide the standard library's cmd
+sys.path.append(SCRIPTS)
+
+KERNEL_COLUMNS = [
+    "_id_ INTEGER PRIMARY KEY AUTOINCREMENT", "cacheConfig BLOB", "sharedMemoryConfig INT", "registersPerThread INT",
+    "partitionedGlobalCacheRequested INT", "partitionedGlobalCacheExecuted INT", "start INT", "end INT",
+    "completed INT", "deviceId INT", "contextId INT", "streamId INT", "gridX INT", "gridY INT", "gridZ INT",
+    "blockX INT", "blockY INT", "blockZ INT", "staticSharedMemory INT", "dynamicSharedMemory INT",
+    "localMemoryPerThread INT", "localMemoryTotal INT", "correlationId INT", "gridId INT", "name INT",
+    "queued INT", "submitted INT", "launchType INT", "isSharedMemoryCarveoutRequested INT",
+    "sharedMemoryCarveoutRequested INT", "sharedMemoryExecuted INT",
+]
+
+SCHEMA = [
+    "CREATE TABLE CUPTI_ACTIVITY_KIND_CONCURRENT_KERNEL({})".format(", ".join(KERNEL_COLUMNS)),
+    "CREATE TABLE CUPTI_ACTIVITY_KIND_KERNEL({})".format(", ".join(KERNEL_COLUMNS)),
+    "CREATE TABLE CUPTI_ACTIVITY_KIND_DRIVER(_id_ INTEGER PRIMARY KEY AUTOINCREMENT, cbid INT, start INT, end INT, "
+    "processId INT, threadId INT, correlationId INT, returnValue INT)",
+    "CREATE TABLE CUPTI_ACTIVITY_KIND_RUNTIME(_id_ INTEGER PRIMARY KEY AUTOINCREMENT, cbid INT, start INT, end INT, "
+    "processId INT, threadId INT, correlationId INT, returnValue INT)",
+    "CREATE TABLE CUPTI_ACTIVITY_KIND_MEMCPY(_id_ INTEGER PRIMARY KEY AUTOINCREMENT, copyKind INT, srcKind INT, "
+    "dstKind INT, flags INT, bytes INT, start INT, end INT, deviceId INT, contextId INT, streamId INT, "
+    "correlationId INT, runtimeCorrelationId INT)",
+    "CREATE TABLE CUPTI_ACTIVITY_KIND_MARKER(_id_ INTEGER PRIMARY KEY AUTOINCREMENT, flags INT, timestamp INT, "
+    "id INT, objectKind INT, objectId BLOB, name INT, domain INT)",
+    "CREATE TABLE CUPTI_ACTIVITY_KIND_DEVICE({})".format(", ".join(
+        ["_id_ INTEGER PRIMARY KEY AUTOINCREMENT"] + ["c{} INT".format(i) for i in range(1, 26)] + ["id INT", "name INT"])),
+    "CREATE TABLE StringTable(_id_ INTEGER PRIMARY KEY AUTOINCREMENT, value TEXT NOT NULL UNIQUE)",
+    "CREATE TABLE Version(version INT)",
+]
+
+PID = 100
+TID = 200
+
+
+def write_nvprof(path, strings=(), runtime=(), kernels=(), memcpys=(), ranges=()):
+    """write a minimal nvprof database to path
+
+    runtime is (cbid, start, end, correlationId), kernels (start, end, deviceId,
+    correlationId, name), memcpys (copyKind, bytes, start, end, deviceId,
+    correlationId), and ranges (start, end, name) pushed and popped on one
+    thread. names are strings, which are added to the StringTable.
+    """
+    conn = sqlite3.connect(path)
+    for sql in SCHEMA:
+        conn.execute(sql)
+    conn.execute("INSERT INTO Version VALUES (11)")
+    ids = {}
+    for s in ["GPU"] + list(strings) + [k[4] for k in kernels] + [r[2] for r in ranges]:
+        if s not in ids:
+            ids[s] = conn.execute("INSERT INTO StringTable(value) VALUES (?)", (s,)).lastrowid
+    conn.execute("INSERT INTO CUPTI_ACTIVITY_KIND_DEVICE(c1, id, name) VALUES (0, 0, ?)", (ids["GPU"],))
+    for cbid, start, end, corr in runtime:
+        conn.execute("INSERT INTO CUPTI_ACTIVITY_KIND_RUNTIME(cbid, start, end, processId, threadId, correlationId, "
+                     "returnValue) VALUES (?, ?, ?, ?, ?, ?, 0)", (cbid, start, end, PID, TID, corr))
+    for start, end, device, corr, name in kernels:
+        conn.execute("INSERT INTO CUPTI_ACTIVITY_KIND_CONCURRENT_KERNEL(start, end, completed, deviceId, contextId, "
+                     "streamId, correlationId, name) VALUES (?, ?, ?, ?, 1, 7, ?, ?)",
+                     (start, end, end, device, corr, ids[name]))
+    for kind, num_bytes, start, end, device, corr in memcpys:
+        conn.execute("INSERT INTO CUPTI_ACTIVITY_KIND_MEMCPY(copyKind, srcKind, dstKind, flags, bytes, start, end, "
+                     "deviceId, contextId, streamId, correlationId, runtimeCorrelationId) "
+                     "VALUES (?, 1, 3, 0, ?, ?, ?, ?, 1, 7, ?, ?)", (kind, num_bytes, start, end, device, corr, corr))
+    object_id = struct.pack("<II4x", PID, TID)
+    for i, (start, end, name) in enumerate(ranges):
+        conn.execute("INSERT INTO CUPTI_ACTIVITY_KIND_MARKER(flags, timestamp, id, objectKind, objectId, name, domain) "
+                     "VALUES (2, ?, ?, 2, ?, ?, 0)", (start, i + 1, object_id, ids[name]))
+        conn.execute("INSERT INTO CUPTI_ACTIVITY_KIND_MARKER(flags, timestamp, id, objectKind, objectId, name, domain) "
+                     "VALUES (4, ?, ?, 2, ?, 0, 0)", (end, i + 1, object_id))
+    conn.commit()
+    conn.close()
+    return path
+
+
+def openvprof(*args):
+    """run openvprof.py with args, and return its stdout"""
+    result = subprocess.run([sys.executable, os.path.join(SCRIPTS, "openvprof.py")] + [str(a) for a in args],
+                            cwd=SCRIPTS, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+
+@pytest.fixture
+def trace(tmp_path):
+    """a small trace from 1000 to 2000 ns, with a kernel at 1500 that takes no time and one from 1400 to 1600"""
+    return write_nvprof(
+        str(tmp_path / "trace.nvprof"),
+        runtime=[(211, 1000, 1100, 1), (211, 1300, 1350, 2), (211, 1450, 1460, 3), (41, 1700, 1800, 4),
+                 (165, 1900, 2000, 5)],
+        kernels=[(1200, 1250, 0, 1, "kernA"), (1400, 1600, 0, 2, "kernB"), (1500, 1500, 0, 3, "kernA")],
+        memcpys=[(1, 1 << 20, 1750, 1850, 0, 4)],
+        ranges=[(1000, 2000, "outer"), (1000, 1300, "inner")],
+    )
@@ -0,0 +1,38 @@
+from conftest import openvprof, write_nvprof
+
+from nvprof.range_tree import Builder
+
+
+def tree(root):
+    return [(path, node.count, node.inclusive, node.exclusive) for path, node in root.walk()]
+
+
+def test_start_together():
+    builder = Builder()
+    builder.range(0, 100, "outer", (1, 2))
+    builder.range(0, 10, "inner", (1, 2))
+    builder.range(50, 60, "inner", (1, 2))
+    assert tree(builder.close()) == [
+        (("outer",), 1, 100, 80),
+        (("outer", "inner"), 2, 20, 20),
+    ]
+
+
+def test_start_together_query(tmp_path):
+    # the enclosing range is recorded after the range it encloses
+    path = write_nvprof(str(tmp_path / "trace.nvprof"), ranges=[(1000, 1300, "inner"), (1000, 2000, "outer")])
+    assert openvprof("range-tree", path).splitlines()[1:] == [
+        "1\t1e-06\t7e-07\t0.0\t0.0\touter",
+        "1\t3e-07\t3e-07\t0.0\t0.0\t  inner",
+    ]
+
+
+def test_marker_report(trace):
+    lines = openvprof("summary", trace).splitlines()
+    start = lines.index("Marker Report")
+    assert lines[start + 2:start + 6] == [
+        "count\tincl(s)\texcl(s)\tname",
+        "1\t1e-06\t7e-07\touter",
+        "1\t3e-07\t3e-07\t  inner",
+        "",
+    ]
@@ -0,0 +1,41 @@
+import glob
+import sqlite3
+
+from conftest import openvprof
+
+
+def shards(tmp_path, trace, *args):
+    openvprof("split", *args, trace, tmp_path / "shard")
+    return sorted(glob.glob(str(tmp_path / "shard.*.nvprof")))
+
+
+def test_summary_of_shard(tmp_path, trace):
+    paths = shards(tmp_path, trace, "-N", 2)
+    assert len(paths) == 2
+    for path in paths:
+        assert "Runtime Report" in openvprof("summary", path)
+        openvprof("list-records", path)
+
+
+def test_schema_unchanged(tmp_path, trace):
+    columns = [row[1] for row in sqlite3.connect(trace).execute("PRAGMA table_info(CUPTI_ACTIVITY_KIND_RUNTIME)")]
+    for path in shards(tmp_path, trace, "-N", 2):
+        conn = sqlite3.connect(path)
+        assert [row[1] for row in conn.execute("PRAGMA table_info(CUPTI_ACTIVITY_KIND_RUNTIME)")] == columns
+
+
+def test_clipped(tmp_path, trace):
+    kernels = []
+    for path in shards(tmp_path, trace, "-N", 2):
+        conn = sqlite3.connect(path)
+        clipped = {row for row in conn.execute(
+            "SELECT start, end FROM CUPTI_ACTIVITY_KIND_CONCURRENT_KERNEL WHERE rowid IN "
+            "(SELECT row_id FROM openvprof_clipped WHERE table_name = 'CUPTI_ACTIVITY_KIND_CONCURRENT_KERNEL')")}
+        kernels += [(path, clipped, conn.execute(
+            "SELECT start, end FROM CUPTI_ACTIVITY_KIND_CONCURRENT_KERNEL ORDER BY start").fetchall())]
+    (_, clipped0, kernels0), (_, clipped1, kernels1) = kernels
+    assert clipped0 == {(1400, 1500)}
+    assert clipped1 == {(1500, 1600)}
+    assert kernels0 == [(1200, 1250), (1400, 1500)]
+    # the kernel that takes no time on the boundary is in exactly one shard
+    assert kernels1 == [(1500, 1600), (1500, 1500)] or kernels1 == [(1500, 1500), (1500, 1600)]
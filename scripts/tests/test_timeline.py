@@ -0,0 +1,13 @@
+import json
+
+from conftest import openvprof, write_nvprof
+
+
+def test_empty_input(tmp_path, trace):
+    empty = write_nvprof(str(tmp_path / "empty.nvprof"))
+    alone, merged = tmp_path / "alone.json", tmp_path / "merged.json"
+    openvprof("timeline", "-o", alone, trace)
+    openvprof("timeline", "-o", merged, empty, trace)
+    events = [json.load(open(str(path)))["traceEvents"] for path in [alone, merged]]
+    assert len(events[0]) == len(events[1])
+    assert [e.get("ts") for e in events[0]] == [e.get("ts") for e in events[1]]